@@ -0,0 +1,78 @@
+"""
+Embedding throughput of the batched embed path against a local fake backend.
+
+Compares the previous one-request-per-text loop with OllamaModel.embed at several
+batch sizes and concurrency windows, and checks that every run returns the same
+vectors in input order.
+
+Usage:
+    uv run python benchmarks/bench_embed.py --texts 2000
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+import ollama
+from loguru import logger
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.fake_llm_server import start_fake_server
+from brain.models.ollama_model import OllamaModel
+
+
+def legacy_embed(client, model, texts):
+    """The previous embed path: one HTTP round trip per text."""
+    return [client.embeddings(model=model, prompt=text)["embedding"] for text in texts]
+
+
+def timed(fn):
+    start = time.perf_counter()
+    result = fn()
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--texts", type=int, default=2000)
+    parser.add_argument("--latency", type=float, default=0.005)
+    parser.add_argument("--per-item-cost", type=float, default=0.0002)
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[16, 64, 256])
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4])
+    parser.add_argument("--output", help="Write results as JSON to this file")
+    args = parser.parse_args()
+
+    logger.remove()
+    logger.deep_debug = lambda *a, **k: None
+
+    server = start_fake_server(latency=args.latency, per_item_cost=args.per_item_cost)
+    texts = [f"document chunk number {i}" for i in range(args.texts)]
+    model = OllamaModel(base_url=server.url, model="fake-embed")
+
+    results = []
+    reference, seconds = timed(lambda: np.asarray(legacy_embed(ollama.Client(host=server.url), model.model, texts), dtype=np.float32))
+    results.append({"path": "legacy", "batch_size": 1, "concurrency": 1,
+                    "seconds": round(seconds, 3), "texts_per_s": round(len(texts) / seconds, 1)})
+    print(json.dumps(results[-1]))
+
+    for batch_size in args.batch_sizes:
+        for concurrency in args.concurrency:
+            embeddings, seconds = timed(lambda: model.embed(texts, batch_size=batch_size, concurrency=concurrency))
+            assert embeddings.dtype == np.float32 and embeddings.flags["C_CONTIGUOUS"]
+            assert np.array_equal(embeddings, reference), "batched embeddings differ from the legacy path"
+            results.append({"path": "batched", "batch_size": batch_size, "concurrency": concurrency,
+                            "seconds": round(seconds, 3), "texts_per_s": round(len(texts) / seconds, 1)})
+            print(json.dumps(results[-1]))
+
+    model.close()
+    server.shutdown()
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
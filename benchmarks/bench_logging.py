@@ -0,0 +1,144 @@
+"""
+Per-token logging overhead of the Ollama streaming path.
+
+Streams in-memory chat chunks through the streaming loop and measures the time spent
+per token on the event loop under three logging setups:
+
+- before: the previous setup, with three synchronous serialized file sinks including
+  DEEPDEBUG, and two f-string deep_debug calls per chunk
+- after: setup_logging() defaults, queue-backed sinks and DEEPDEBUG off, through
+  OllamaModel._async_chat
+- after_deep_debug: as after with DEEPDEBUG on, so chunk logs are sampled
+
+The overhead is reported against the same loop with no sinks at all. Time to drain
+the log queue is reported separately, since it is spent on the writer thread.
+
+Usage:
+    uv run python benchmarks/bench_logging.py --tokens 20000
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+
+from loguru import logger
+from ollama._types import ChatResponse, Message
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config.logging_setup import setup_logging
+from brain.models.ollama_model import OllamaModel
+
+
+class FakeAsyncClient:
+    """Replays prepared chunks in place of ollama.AsyncClient."""
+
+    def __init__(self, chunks):
+        self.chunks = chunks
+
+    async def chat(self, model, messages, stream):
+        async def replay():
+            for chunk in self.chunks:
+                yield chunk
+        return replay()
+
+
+def make_chunks(tokens):
+    chunks = [ChatResponse(model="llama3.2", created_at="2025-01-01T00:00:00Z",
+                           message=Message(role="assistant", content=f" token{i}"), done=False)
+              for i in range(tokens)]
+    chunks.append(ChatResponse(model="llama3.2", created_at="2025-01-01T00:00:00Z",
+                               message=Message(role="assistant", content=""), done=True))
+    return chunks
+
+
+async def legacy_async_chat(chunks):
+    """The previous per-chunk loop body, with eagerly formatted deep_debug calls."""
+    for chunk in chunks:
+        logger.deep_debug(f"Received chunk from Ollama: {chunk}")
+        if 'message' in chunk and chunk['message'].get('content'):
+            content = chunk['message']['content']
+            logger.deep_debug(f"Yielding content: {content}")
+            yield {'message': content, 'is_chunk': True}
+
+
+def legacy_setup_logging(log_dir):
+    """The previous setup_logging: synchronous serialized sinks at every level."""
+    logger.remove()
+    setup_logging(enqueue=False, deep_debug_enabled=True, log_dir=log_dir)
+
+
+async def consume(make_stream):
+    stream = make_stream()
+    start = time.perf_counter()
+    async for _ in stream:
+        pass
+    return time.perf_counter() - start
+
+
+def run_stream(make_stream):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(consume(make_stream))
+    finally:
+        loop.close()
+
+
+def current_stream(chunks):
+    """OllamaModel._async_chat reading the prepared chunks."""
+    model = OllamaModel()
+
+    def make_stream():
+        model._async_clients[asyncio.get_running_loop()] = FakeAsyncClient(chunks)
+        return model._async_chat([{"role": "user", "content": "hi"}])
+    return make_stream
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tokens", type=int, default=20000)
+    parser.add_argument("--output", help="Write results as JSON to this file")
+    args = parser.parse_args()
+
+    chunks = make_chunks(args.tokens)
+    results = []
+    with tempfile.TemporaryDirectory() as log_dir:
+        modes = [
+            ("baseline_no_sinks", lambda: logger.remove(), lambda: current_stream(chunks)),
+            ("before", lambda: legacy_setup_logging(log_dir), lambda: lambda: legacy_async_chat(chunks)),
+            ("after", lambda: setup_logging(log_dir=log_dir), lambda: current_stream(chunks)),
+            ("after_deep_debug", lambda: setup_logging(deep_debug_enabled=True, log_dir=log_dir), lambda: current_stream(chunks)),
+        ]
+        # Registers deep_debug for the previous setup, and warms up the loop and model code
+        setup_logging(enqueue=False, log_dir=log_dir)
+        logger.remove()
+        run_stream(current_stream(chunks))
+        baseline = None
+        for name, configure, make_stream in modes:
+            configure()
+            elapsed = run_stream(make_stream())
+            drain_start = time.perf_counter()
+            logger.complete()
+            logger.remove()
+            drain = time.perf_counter() - drain_start
+            if baseline is None:
+                baseline = elapsed
+            results.append({
+                "mode": name,
+                "tokens": args.tokens,
+                "us_per_token": round(elapsed * 1e6 / args.tokens, 2),
+                "overhead_us_per_token": round((elapsed - baseline) * 1e6 / args.tokens, 2),
+                "queue_drain_s": round(drain, 3),
+            })
+            print(json.dumps(results[-1]))
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
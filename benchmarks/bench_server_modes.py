@@ -0,0 +1,222 @@
+"""
+Compare the Flask (threaded WSGI) and async (tornado) brain server modes.
+
+Each mode is started in a subprocess with every persona handler replaced by a fake
+model that streams tokens at a fixed rate, so only the serving path is measured.
+The driver then opens N concurrent SSE streams against /<dialog_id> and reports
+completed streams, time-to-first-token, wall time, peak RSS and peak thread count.
+
+Usage:
+    uv run python benchmarks/bench_server_modes.py --concurrency 10 100 1000
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import threading
+import time
+
+import httpx
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class FakeStreamingModel:
+    """Streams a fixed number of tokens with a fixed delay between them."""
+
+    model = "fake"
+    embed_batch_size = 1
+    embed_concurrency = 1
+
+    def __init__(self, tokens, token_interval):
+        self.tokens = tokens
+        self.token_interval = token_interval
+
+    async def _async_chat(self, messages):
+        for i in range(self.tokens):
+            await asyncio.sleep(self.token_interval)
+            yield {'message': f"tok{i} ", 'is_chunk': True}
+
+    def chat(self, messages, stream=False):
+        return self._async_chat(messages)
+
+    def close(self):
+        pass
+
+
+def serve(mode, port, tokens, token_interval):
+    """Run one server mode in this process with fake handlers injected."""
+    os.chdir(REPO_ROOT)
+    sys.path.insert(0, REPO_ROOT)
+    if mode == "flask":
+        import brain_server as server_module
+    else:
+        import brain_server_async as server_module
+
+    router = server_module.domain_router
+    # Measure the server modes themselves, not admission control or request coalescing
+    router.scheduler = None
+    router.single_flight = None
+    for persona in router.config.persona_models:
+        router._handlers[persona] = FakeStreamingModel(tokens, token_interval)
+
+    if mode == "flask":
+        from werkzeug.serving import make_server
+        make_server("127.0.0.1", port, server_module.app, threaded=True).serve_forever()
+    else:
+        asyncio.run(server_module.serve(port))
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_port(port, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.5):
+                return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"Server did not start on port {port}")
+
+
+class ProcessSampler(threading.Thread):
+    """Samples RSS and thread count of a process from /proc."""
+
+    def __init__(self, pid, interval=0.05):
+        super().__init__(daemon=True)
+        self.pid = pid
+        self.interval = interval
+        self.peak_rss_kb = 0
+        self.baseline_rss_kb = None
+        self.peak_threads = 0
+        self._stop_event = threading.Event()
+
+    def sample(self):
+        status = {}
+        with open(f"/proc/{self.pid}/status") as f:
+            for line in f:
+                key, _, value = line.partition(":")
+                status[key] = value.strip()
+        return int(status["VmRSS"].split()[0]), int(status["Threads"])
+
+    def run(self):
+        while not self._stop_event.is_set():
+            try:
+                rss_kb, threads = self.sample()
+            except (FileNotFoundError, KeyError):
+                return
+            if self.baseline_rss_kb is None:
+                self.baseline_rss_kb = rss_kb
+            self.peak_rss_kb = max(self.peak_rss_kb, rss_kb)
+            self.peak_threads = max(self.peak_threads, threads)
+            self._stop_event.wait(self.interval)
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+
+async def one_stream(client, url, index):
+    payload = {
+        "sender": "bench",
+        "persona_selected": "Chat",
+        "messages": json.dumps([{"role": "user", "content": f"hello {index}"}]),
+    }
+    start = time.perf_counter()
+    ttft = None
+    async with client.stream("POST", f"{url}/bench-{index}", data=payload) as response:
+        async for line in response.aiter_lines():
+            if not line.startswith("data: "):
+                continue
+            if ttft is None:
+                ttft = time.perf_counter() - start
+            if line == "data: [DONE]":
+                return ttft, time.perf_counter() - start
+    raise RuntimeError("Stream ended without [DONE]")
+
+
+async def drive(url, concurrency):
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(limits=limits, timeout=None) as client:
+        results = await asyncio.gather(
+            *(one_stream(client, url, i) for i in range(concurrency)),
+            return_exceptions=True,
+        )
+    ok = [r for r in results if not isinstance(r, BaseException)]
+    return ok, len(results) - len(ok)
+
+
+def run_mode(mode, concurrency, tokens, token_interval):
+    port = free_port()
+    process = subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), "--serve", mode, "--port", str(port),
+         "--tokens", str(tokens), "--token-interval", str(token_interval)],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        wait_for_port(port)
+        sampler = ProcessSampler(process.pid)
+        sampler.start()
+        time.sleep(0.2)
+        start = time.perf_counter()
+        ok, errors = asyncio.run(drive(f"http://127.0.0.1:{port}", concurrency))
+        wall = time.perf_counter() - start
+        sampler.stop()
+    finally:
+        process.terminate()
+        process.wait(timeout=10)
+
+    ttfts = sorted(r[0] for r in ok)
+    rss_delta_kb = sampler.peak_rss_kb - (sampler.baseline_rss_kb or 0)
+    return {
+        "mode": mode,
+        "concurrency": concurrency,
+        "completed": len(ok),
+        "errors": errors,
+        "wall_s": round(wall, 3),
+        "ttft_p50_ms": round(statistics.median(ttfts) * 1000, 1) if ttfts else None,
+        "ttft_max_ms": round(ttfts[-1] * 1000, 1) if ttfts else None,
+        "peak_rss_mb": round(sampler.peak_rss_kb / 1024, 1),
+        "rss_per_stream_kb": round(rss_delta_kb / concurrency, 1),
+        "peak_threads": sampler.peak_threads,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[10, 100, 1000])
+    parser.add_argument("--modes", nargs="+", default=["flask", "async"], choices=["flask", "async"])
+    parser.add_argument("--tokens", type=int, default=50)
+    parser.add_argument("--token-interval", type=float, default=0.02)
+    parser.add_argument("--output", help="Write results as JSON to this file")
+    parser.add_argument("--serve", choices=["flask", "async"], help=argparse.SUPPRESS)
+    parser.add_argument("--port", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.serve, args.port, args.tokens, args.token_interval)
+        return
+
+    results = []
+    for concurrency in args.concurrency:
+        for mode in args.modes:
+            result = run_mode(mode, concurrency, args.tokens, args.token_interval)
+            results.append(result)
+            print(json.dumps(result))
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
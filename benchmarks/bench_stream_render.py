@@ -0,0 +1,156 @@
+"""
+Render lag and CPU of streaming a response into the interface.
+
+Replays a token stream at its recorded timing against a placeholder that serializes
+every repaint the way Streamlit does (one ForwardMsg carrying the full markdown body).
+Compares the previous per-token repaint, which also logged the growing response at
+debug level, with StreamRenderer at several frame rates. Render lag is the time from a
+token's arrival until a repaint first shows it.
+
+Usage:
+    uv run python benchmarks/bench_stream_render.py --tokens 2000 --tokens-per-second 400
+    uv run python benchmarks/bench_stream_render.py --stream recorded_stream.jsonl
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+from loguru import logger
+from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from interface.stream_renderer import StreamRenderer, CURSOR
+
+WORDS = ["the", "model", "streams", "tokens", "**bold**", "`code`", "and", "a", "list:\n- item", "\n\n", "table", "|", "of", "results", "."]
+
+
+class RecordingPlaceholder:
+    """Stands in for st.empty(): serializes every repaint and records what it showed."""
+
+    def __init__(self):
+        self.paints = []  # (time, characters of response shown)
+        self.bytes_sent = 0
+
+    def markdown(self, body):
+        message = ForwardMsg()
+        message.delta.new_element.markdown.body = body
+        self.bytes_sent += len(message.SerializeToString())
+        shown = len(body) - len(CURSOR) if body.endswith(CURSOR) else len(body)
+        self.paints.append((time.perf_counter(), shown))
+
+
+class PerTokenRenderer:
+    """The previous behaviour: repaint and debug-log the whole response for every token."""
+
+    def __init__(self, placeholder):
+        self.placeholder = placeholder
+        self.full_response = ""
+
+    def append(self, chunk):
+        self.full_response += chunk
+        self.placeholder.markdown(self.full_response + CURSOR)
+        logger.debug(f"Updated response: {self.full_response}")
+
+    def finish(self):
+        self.placeholder.markdown(self.full_response)
+        return self.full_response
+
+
+def synthesize_stream(tokens, tokens_per_second, seed=0):
+    rng = np.random.default_rng(seed)
+    delays = rng.exponential(1.0 / tokens_per_second, tokens)
+    return [{"token": " " + WORDS[i % len(WORDS)], "delay": float(delay)}
+            for i, delay in zip(rng.integers(0, len(WORDS), tokens), delays)]
+
+
+def load_stream(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def replay(stream, renderer, placeholder):
+    """Feed tokens at their recorded times; returns per-token lag in seconds and CPU time."""
+    arrivals, lengths = [], []
+    total = 0
+    cpu_start = time.process_time()
+    start = time.perf_counter()
+    due = start
+    for record in stream:
+        due += record["delay"]
+        wait = due - time.perf_counter()
+        if wait > 0:
+            time.sleep(wait)
+        renderer.append(record["token"])
+        total += len(record["token"])
+        arrivals.append(due)
+        lengths.append(total)
+    renderer.finish()
+    cpu = time.process_time() - cpu_start
+
+    # First repaint showing each token
+    lags = np.empty(len(arrivals))
+    paint = 0
+    for i, (arrival, length) in enumerate(zip(arrivals, lengths)):
+        while placeholder.paints[paint][1] < length:
+            paint += 1
+        lags[i] = placeholder.paints[paint][0] - arrival
+    return lags, cpu
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--stream", help="JSONL token stream with {token, delay} records to replay")
+    parser.add_argument("--record", help="Write the synthesized token stream to this JSONL file")
+    parser.add_argument("--tokens", type=int, default=2000)
+    parser.add_argument("--tokens-per-second", type=float, default=400)
+    parser.add_argument("--fps", type=float, nargs="+", default=[10, 15, 30])
+    parser.add_argument("--max-pending-chars", type=int, default=1024)
+    parser.add_argument("--output", help="Write results as JSON to this file")
+    args = parser.parse_args()
+
+    stream = load_stream(args.stream) if args.stream else synthesize_stream(args.tokens, args.tokens_per_second)
+    if args.record:
+        with open(args.record, "w") as f:
+            f.writelines(json.dumps(record) + "\n" for record in stream)
+
+    # Debug logging goes to a file, as in the interface
+    logger.remove()
+    log_dir = tempfile.TemporaryDirectory()
+    logger.add(os.path.join(log_dir.name, "debug.log"), level="DEBUG", format="{time} | {level} | {message}", serialize=True)
+
+    modes = [("per_token", None)] + [(f"renderer_{fps:g}fps", fps) for fps in args.fps]
+    results = []
+    for name, fps in modes:
+        placeholder = RecordingPlaceholder()
+        if fps is None:
+            renderer = PerTokenRenderer(placeholder)
+        else:
+            renderer = StreamRenderer(placeholder, fps=fps, max_pending_chars=args.max_pending_chars,
+                                      clock=time.perf_counter)
+        lags, cpu = replay(stream, renderer, placeholder)
+        results.append({
+            "mode": name,
+            "tokens": len(stream),
+            "paints": len(placeholder.paints),
+            "cpu_s": round(cpu, 3),
+            "bytes_sent": placeholder.bytes_sent,
+            "lag_ms_mean": round(float(lags.mean()) * 1000, 2),
+            "lag_ms_p95": round(float(np.percentile(lags, 95)) * 1000, 2),
+            "lag_ms_max": round(float(lags.max()) * 1000, 2),
+            "final_lag_ms": round(float(lags[-1]) * 1000, 2),
+        })
+        print(json.dumps(results[-1]))
+
+    log_dir.cleanup()
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""
+Recall and latency of the VectorIndex exact and IVF search modes.
+
+Vectors are drawn from a Gaussian mixture so the IVF lists are meaningful. For each
+corpus size the benchmark reports build, save and load time, per-query latency of
+batched exact search and of IVF search at several nprobe values, and IVF recall@k
+against the exact results.
+
+Usage:
+    uv run python benchmarks/bench_vector_index.py --sizes 10000 100000 1000000
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+from loguru import logger
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from brain.vector_index import VectorIndex
+
+
+def make_corpus(size, dim, clusters, rng):
+    centers = rng.standard_normal((clusters, dim)).astype(np.float32)
+    labels = rng.integers(0, clusters, size)
+    vectors = np.empty((size, dim), dtype=np.float32)
+    for start in range(0, size, 100000):
+        block = labels[start:start + 100000]
+        vectors[start:start + len(block)] = centers[block] + 0.5 * rng.standard_normal((len(block), dim)).astype(np.float32)
+    return vectors
+
+
+def timed(fn):
+    start = time.perf_counter()
+    result = fn()
+    return result, time.perf_counter() - start
+
+
+def recall(approximate, exact):
+    hits = sum(len(set(a[a >= 0]) & set(e[e >= 0])) for a, e in zip(approximate, exact))
+    return hits / exact.size
+
+
+def bench_size(size, args, rng):
+    vectors = make_corpus(size, args.dim, args.clusters, rng)
+    queries = vectors[rng.choice(size, args.queries, replace=False)] + 0.1 * rng.standard_normal((args.queries, args.dim)).astype(np.float32)
+
+    index = VectorIndex(args.dim)
+    _, add_s = timed(lambda: index.add(vectors, metadata=[{"shard": i % 10} for i in range(size)]))
+    _, build_s = timed(lambda: index.build_ivf())
+
+    with tempfile.TemporaryDirectory() as path:
+        _, save_s = timed(lambda: index.save(path))
+        loaded, load_s = timed(lambda: VectorIndex.load(path))
+
+        (exact_ids, _), exact_s = timed(lambda: loaded.search(queries, k=args.k))
+        result = {
+            "size": size,
+            "dim": args.dim,
+            "add_s": round(add_s, 3),
+            "ivf_build_s": round(build_s, 3),
+            "save_s": round(save_s, 3),
+            "load_ms": round(load_s * 1000, 2),
+            "exact_ms_per_query": round(exact_s * 1000 / args.queries, 3),
+            "ivf": [],
+        }
+        (_, _), filtered_s = timed(lambda: loaded.search(queries, k=args.k, filters={"shard": 3}))
+        result["exact_filtered_ms_per_query"] = round(filtered_s * 1000 / args.queries, 3)
+
+        for nprobe in args.nprobe:
+            (ivf_ids, _), ivf_s = timed(lambda: loaded.search(queries, k=args.k, mode="ivf", nprobe=nprobe))
+            result["ivf"].append({
+                "nprobe": nprobe,
+                "ms_per_query": round(ivf_s * 1000 / args.queries, 3),
+                f"recall_at_{args.k}": round(recall(ivf_ids, exact_ids), 4),
+            })
+        del loaded
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000, 1000000])
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--clusters", type=int, default=256)
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[4, 16, 64])
+    parser.add_argument("--output", help="Write results as JSON to this file")
+    args = parser.parse_args()
+
+    logger.remove()
+    rng = np.random.default_rng(0)
+    results = []
+    for size in args.sizes:
+        results.append(bench_size(size, args, rng))
+        print(json.dumps(results[-1]))
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,250 @@
+"""
+A deterministic local stand-in for Ollama and OpenAI-compatible backends.
+
+Embedding vectors are derived from a hash of the input text, so every run returns
+the same vectors. A fixed per-request latency and a per-input cost simulate the
+round trip and compute time of a real backend.
+
+Chat is served on /api/chat (Ollama, NDJSON when streaming) and /v1/chat/completions
+(OpenAI, server-sent events when streaming). Answers are derived from a hash of the
+request, streamed at a fixed token rate after the per-request latency. A failure
+probability makes a matching share of requests answer 500. Which requests fail is also
+decided by the request hash, so repeated runs fail the same requests.
+
+Usage:
+    uv run python benchmarks/fake_llm_server.py --port 11435 --latency 0.02 --token-rate 50 --failure-rate 0.01
+"""
+import argparse
+import hashlib
+import json
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+
+def fake_embedding(text, dim):
+    """Deterministic unit vector for a text."""
+    seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+    vector = np.random.default_rng(seed).standard_normal(dim).astype(np.float32)
+    return (vector / np.linalg.norm(vector)).tolist()
+
+
+WORDS = ("the", "model", "streams", "a", "deterministic", "answer", "of", "fake", "tokens", "for",
+         "load", "testing", "brain", "server", "under", "concurrent", "dialogs", "with", "steady", "rate")
+
+
+def request_hash(request):
+    """Stable 64-bit hash of a chat request."""
+    canonical = json.dumps(request.get("messages", []), sort_keys=True, separators=(",", ":"))
+    return int.from_bytes(hashlib.sha256(canonical.encode("utf-8")).digest()[:8], "little")
+
+
+def fake_tokens(seed, count):
+    """Deterministic answer tokens for a request."""
+    return [("" if i == 0 else " ") + WORDS[(seed + i * 7) % len(WORDS)] for i in range(count)]
+
+
+class FakeLLMHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def _read_json(self):
+        length = int(self.headers.get("Content-Length", 0))
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def _send_json(self, payload, status=200):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _simulate_work(self, items):
+        settings = self.server.settings
+        time.sleep(settings["latency"] + settings["per_item_cost"] * items)
+
+    def _start_chunked(self, content_type):
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+    def _write_chunk(self, data):
+        self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+    def _end_chunked(self):
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+    def _stream_tokens(self, tokens, write_token):
+        """Write tokens at the configured rate, returning False if the client went away."""
+        interval = 1 / self.server.settings["token_rate"] if self.server.settings["token_rate"] > 0 else 0
+        try:
+            for token in tokens:
+                if interval:
+                    time.sleep(interval)
+                write_token(token)
+        except (BrokenPipeError, ConnectionResetError):
+            self.server.count_request("disconnected")
+            return False
+        return True
+
+    def _chat(self, request, openai_format):
+        settings = self.server.settings
+        seed = request_hash(request)
+        time.sleep(settings["latency"])
+        # Fails the same requests on every run
+        if settings["failure_rate"] > 0 and (seed % 10000) / 10000 < settings["failure_rate"]:
+            self.server.count_request("failed")
+            self._send_json({"error": "simulated backend failure"}, status=500)
+            return
+        tokens = fake_tokens(seed, settings["tokens"])
+        model = request.get("model")
+        created_at = datetime.now(timezone.utc).isoformat()
+
+        if openai_format:
+            created = int(time.time())
+
+            def completion_chunk(delta, finish_reason=None):
+                return {"id": f"chatcmpl-{seed:x}", "object": "chat.completion.chunk", "created": created, "model": model,
+                        "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]}
+
+            if not request.get("stream"):
+                time.sleep(len(tokens) / settings["token_rate"] if settings["token_rate"] > 0 else 0)
+                self._send_json({
+                    "id": f"chatcmpl-{seed:x}", "object": "chat.completion", "created": created, "model": model,
+                    "choices": [{"index": 0, "message": {"role": "assistant", "content": "".join(tokens)}, "finish_reason": "stop"}],
+                    "usage": {"prompt_tokens": 0, "completion_tokens": len(tokens), "total_tokens": len(tokens)},
+                })
+                return
+            self._start_chunked("text/event-stream")
+            send = lambda payload: self._write_chunk(f"data: {json.dumps(payload)}\n\n".encode("utf-8"))
+            if self._stream_tokens(tokens, lambda token: send(completion_chunk({"content": token}))):
+                send(completion_chunk({}, "stop"))
+                self._write_chunk(b"data: [DONE]\n\n")
+                self._end_chunked()
+            return
+
+        def chat_chunk(content, done):
+            chunk = {"model": model, "created_at": created_at,
+                     "message": {"role": "assistant", "content": content}, "done": done}
+            if done:
+                chunk.update({"done_reason": "stop", "eval_count": len(tokens)})
+            return chunk
+
+        if not request.get("stream", True):
+            time.sleep(len(tokens) / settings["token_rate"] if settings["token_rate"] > 0 else 0)
+            self._send_json(chat_chunk("".join(tokens), True))
+            return
+        self._start_chunked("application/x-ndjson")
+        send = lambda payload: self._write_chunk(json.dumps(payload).encode("utf-8") + b"\n")
+        if self._stream_tokens(tokens, lambda token: send(chat_chunk(token, False))):
+            send(chat_chunk("", True))
+            self._end_chunked()
+
+    def do_GET(self):
+        # Health checks and model listings
+        if self.path == "/api/version":
+            self._send_json({"version": "0.0.0-fake"})
+        elif self.path == "/api/tags":
+            self._send_json({"models": [{"name": "fake", "model": "fake"}]})
+        elif self.path in ("/v1/models", "/models"):
+            self._send_json({"object": "list", "data": [{"id": "fake", "object": "model", "created": 0, "owned_by": "fake"}]})
+        else:
+            self._send_json({"error": f"unknown path {self.path}"}, status=404)
+
+    def do_POST(self):
+        request = self._read_json()
+        dim = self.server.settings["dim"]
+        self.server.count_request(self.path)
+
+        if self.path == "/api/chat":
+            self._chat(request, openai_format=False)
+        elif self.path in ("/v1/chat/completions", "/chat/completions"):
+            self._chat(request, openai_format=True)
+        elif self.path == "/api/generate":
+            # Only used without a prompt, to load a model
+            self._simulate_work(0)
+            self._send_json({"model": request.get("model"), "created_at": datetime.now(timezone.utc).isoformat(),
+                             "response": "", "done": True, "done_reason": "load"})
+        elif self.path == "/api/embed":
+            inputs = request.get("input", [])
+            inputs = [inputs] if isinstance(inputs, str) else inputs
+            self._simulate_work(len(inputs))
+            self._send_json({"model": request.get("model"), "embeddings": [fake_embedding(t, dim) for t in inputs]})
+        elif self.path == "/api/embeddings":
+            self._simulate_work(1)
+            self._send_json({"embedding": fake_embedding(request.get("prompt", ""), dim)})
+        elif self.path in ("/v1/embeddings", "/embeddings"):
+            inputs = request.get("input", [])
+            inputs = [inputs] if isinstance(inputs, str) else inputs
+            self._simulate_work(len(inputs))
+            self._send_json({
+                "object": "list",
+                "model": request.get("model"),
+                "data": [
+                    {"object": "embedding", "index": i, "embedding": fake_embedding(t, dim)}
+                    for i, t in enumerate(inputs)
+                ],
+                "usage": {"prompt_tokens": 0, "total_tokens": 0},
+            })
+        else:
+            self._send_json({"error": f"unknown path {self.path}"}, status=404)
+
+
+class FakeLLMServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, latency=0.02, per_item_cost=0.0005, dim=768,
+                 tokens=64, token_rate=50.0, failure_rate=0.0):
+        super().__init__(address, FakeLLMHandler)
+        self.settings = {"latency": latency, "per_item_cost": per_item_cost, "dim": dim,
+                         "tokens": tokens, "token_rate": token_rate, "failure_rate": failure_rate}
+        self.request_counts = {}
+        self._counts_lock = threading.Lock()
+
+    def count_request(self, path):
+        with self._counts_lock:
+            self.request_counts[path] = self.request_counts.get(path, 0) + 1
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+
+def start_fake_server(port=0, **settings):
+    """Start a fake backend in a daemon thread and return the server."""
+    server = FakeLLMServer(("127.0.0.1", port), **settings)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=11435)
+    parser.add_argument("--latency", type=float, default=0.02, help="Seconds added to every request")
+    parser.add_argument("--per-item-cost", type=float, default=0.0005, help="Seconds added per embedded text")
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--tokens", type=int, default=64, help="Tokens per chat answer")
+    parser.add_argument("--token-rate", type=float, default=50.0, help="Streamed tokens per second, 0 for no delay")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="Share of chat requests answered with 500")
+    args = parser.parse_args()
+
+    server = FakeLLMServer(("127.0.0.1", args.port), latency=args.latency,
+                           per_item_cost=args.per_item_cost, dim=args.dim, tokens=args.tokens,
+                           token_rate=args.token_rate, failure_rate=args.failure_rate)
+    print(f"Fake LLM backend listening on {server.url}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
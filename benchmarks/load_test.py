@@ -0,0 +1,321 @@
+"""
+Load test of the brain server's /<dialog_id> SSE endpoint against a fake LLM backend.
+
+A fake Ollama- or OpenAI-compatible backend (fake_llm_server.py) and the brain server
+run in their own processes, with every persona pointed at the fake backend. Each of N
+concurrent simulated users then holds a conversation of --turns turns on its own
+dialog_id, as the interface does. The first turn sends the full history, and later
+turns send only the new message and the dialog version.
+
+For every concurrency level the report gives p50/p95/p99 time to first token and
+request duration, token and request throughput, peak server RSS and memory per
+stream, and the error rate. It also includes the server's own error, fallback and
+rejection counters from /metrics. Results are written as JSON with the git commit,
+so runs of different versions can be compared.
+
+Usage:
+    uv run python benchmarks/load_test.py --concurrency 10 100 --turns 3 --output load.json
+    uv run python benchmarks/load_test.py --mode flask --failure-rate 0.02 --token-rate 100
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+import httpx
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+from benchmarks.bench_server_modes import ProcessSampler, free_port, wait_for_port
+
+# Server-side counters summed from /metrics into each result
+SERVER_COUNTERS = {
+    "model_errors": "artmind_model_errors_total",
+    "fallback_responses": "artmind_fallback_responses_total",
+    "rejected": "artmind_rejected_requests_total",
+    "tokens": "artmind_tokens_total",
+}
+
+
+def serve(mode, port, llm_host, backend_url, backend_concurrency, max_queue):
+    """Run the brain server in this process with every persona pointed at the fake backend."""
+    os.chdir(REPO_ROOT)
+    from config.logging_setup import setup_logging
+    setup_logging(log_dir=os.path.join(tempfile.gettempdir(), "artmind_load_test_logs"))
+    if mode == "flask":
+        import brain_server as server_module
+    else:
+        import brain_server_async as server_module
+
+    router = server_module.domain_router
+    for persona_config in router.config.persona_models.values():
+        persona_config.llm_host = llm_host
+        persona_config.base_url = backend_url
+        persona_config.api_key = persona_config.api_key or "load-test"
+    if backend_concurrency:
+        router.config.scheduler.backend_concurrency = backend_concurrency
+    if max_queue and router.scheduler is not None:
+        router.scheduler.max_queue = max_queue
+
+    if mode == "flask":
+        from werkzeug.serving import make_server
+        make_server("127.0.0.1", port, server_module.app, threaded=True).serve_forever()
+    else:
+        asyncio.run(server_module.serve(port))
+
+
+def percentile(sorted_values, q):
+    """Nearest-rank percentile of an ascending list, None when it is empty."""
+    if not sorted_values:
+        return None
+    index = max(0, min(len(sorted_values) - 1, round(q / 100 * len(sorted_values) + 0.5) - 1))
+    return sorted_values[index]
+
+
+def millis(seconds):
+    return round(seconds * 1000, 1) if seconds is not None else None
+
+
+async def one_turn(client, url, dialog_id, payload):
+    """Send one dialog request and read its SSE stream; return the turn's measurements."""
+    start = time.perf_counter()
+    turn = {"status": "ok", "ttft": None, "chunks": 0, "reply": "", "version": None}
+    try:
+        async with client.stream("POST", f"{url}/{dialog_id}", data=payload) as response:
+            if response.status_code != 200:
+                await response.aread()
+                turn["status"] = f"http_{response.status_code}"
+                return turn
+            done = False
+            async for line in response.aiter_lines():
+                if not line.startswith("data: "):
+                    continue
+                if line == "data: [DONE]":
+                    done = True
+                    break
+                event = json.loads(line[len("data: "):])
+                if event.get("is_chunk"):
+                    if turn["ttft"] is None:
+                        turn["ttft"] = time.perf_counter() - start
+                    turn["chunks"] += 1
+                else:
+                    turn["reply"] = event.get("message", "")
+                    turn["version"] = event.get("version")
+            if not done:
+                turn["status"] = "incomplete"
+            elif turn["reply"].startswith("Error generating response"):
+                # OllamaModel's error chunk, streamed like an answer
+                turn["status"] = "model_error"
+    except httpx.HTTPError as e:
+        turn["status"] = type(e).__name__
+    finally:
+        turn["duration"] = time.perf_counter() - start
+    return turn
+
+
+async def conversation(client, url, run_id, user, concurrency, args):
+    """One simulated user holding a conversation of args.turns turns."""
+    dialog_id = f"load-{run_id}-{user}"
+    filler = " ".join(["lorem"] * (args.prompt_chars // 6))
+    history = []
+    version = None
+    turns = []
+    await asyncio.sleep(args.ramp_seconds * user / concurrency)
+    for index in range(args.turns):
+        message = {"role": "user", "content": f"user {user} turn {index} {filler}"}
+        payload = {"sender": f"load-user-{user}", "persona_selected": args.persona}
+        if version is None:
+            payload["messages"] = json.dumps(history + [message])
+        else:
+            payload["new_messages"] = json.dumps([message])
+            payload["version"] = str(version)
+        turn = await one_turn(client, url, dialog_id, payload)
+        turns.append(turn)
+        if turn["status"] == "ok":
+            history += [message, {"role": "assistant", "content": turn["reply"]}]
+            version = turn["version"]  # None after a conflict, so the next turn resyncs
+        else:
+            version = None
+        if args.think_time:
+            await asyncio.sleep(args.think_time)
+    return turns
+
+
+async def drive(url, concurrency, run_id, args):
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(limits=limits, timeout=httpx.Timeout(args.request_timeout)) as client:
+        conversations = await asyncio.gather(*(conversation(client, url, run_id, user, concurrency, args)
+                                               for user in range(concurrency)))
+    return [turn for turns in conversations for turn in turns]
+
+
+def scrape_counters(url):
+    """Sum the server counters of SERVER_COUNTERS over all their labels."""
+    try:
+        text = httpx.get(f"{url}/metrics", timeout=10).text
+    except httpx.HTTPError:
+        return {}
+    counters = {key: 0.0 for key in SERVER_COUNTERS}
+    for line in text.splitlines():
+        if line.startswith("#"):
+            continue
+        name, _, value = line.rpartition(" ")
+        name = name.split("{", 1)[0]
+        for key, metric in SERVER_COUNTERS.items():
+            if name == metric:
+                counters[key] += float(value)
+    return counters
+
+
+def subtract(after, before):
+    return {key: after[key] - before.get(key, 0.0) for key in after}
+
+
+def start_process(arguments, port):
+    process = subprocess.Popen([sys.executable] + arguments, cwd=REPO_ROOT,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_for_port(port)
+    except RuntimeError:
+        process.kill()
+        raise
+    return process
+
+
+def stop_process(process):
+    process.terminate()
+    try:
+        process.wait(timeout=10)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+
+def run_level(url, server_pid, concurrency, run_id, args):
+    counters_before = scrape_counters(url)
+    sampler = ProcessSampler(server_pid)
+    sampler.start()
+    time.sleep(0.2)
+    start = time.perf_counter()
+    turns = asyncio.run(drive(url, concurrency, run_id, args))
+    wall = time.perf_counter() - start
+    sampler.stop()
+    server_counters = subtract(scrape_counters(url), counters_before) if counters_before else {}
+
+    ok = [turn for turn in turns if turn["status"] == "ok"]
+    errors = {}
+    for turn in turns:
+        if turn["status"] != "ok":
+            errors[turn["status"]] = errors.get(turn["status"], 0) + 1
+    ttfts = sorted(turn["ttft"] for turn in ok if turn["ttft"] is not None)
+    durations = sorted(turn["duration"] for turn in ok)
+    tokens = sum(turn["chunks"] for turn in ok)
+    rss_delta_kb = sampler.peak_rss_kb - (sampler.baseline_rss_kb or 0)
+    return {
+        "mode": args.mode,
+        "backend": args.llm_host,
+        "concurrency": concurrency,
+        "turns": args.turns,
+        "requests": len(turns),
+        "completed": len(ok),
+        "errors": errors,
+        "error_rate": round(1 - len(ok) / len(turns), 4) if turns else None,
+        "wall_s": round(wall, 3),
+        "ttft_p50_ms": millis(percentile(ttfts, 50)),
+        "ttft_p95_ms": millis(percentile(ttfts, 95)),
+        "ttft_p99_ms": millis(percentile(ttfts, 99)),
+        "duration_p50_ms": millis(percentile(durations, 50)),
+        "duration_p95_ms": millis(percentile(durations, 95)),
+        "duration_p99_ms": millis(percentile(durations, 99)),
+        "tokens_per_s": round(tokens / wall, 1),
+        "requests_per_s": round(len(ok) / wall, 2),
+        "peak_rss_mb": round(sampler.peak_rss_kb / 1024, 1),
+        "rss_per_stream_kb": round(rss_delta_kb / concurrency, 1),
+        "peak_threads": sampler.peak_threads,
+        "server": server_counters,
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mode", choices=["flask", "async"], default="async")
+    parser.add_argument("--llm-host", choices=["ollama", "openai"], default="ollama", help="Backend API the fake serves")
+    parser.add_argument("--persona", default="Chat")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[10, 50, 100])
+    parser.add_argument("--turns", type=int, default=3, help="Turns per simulated conversation")
+    parser.add_argument("--prompt-chars", type=int, default=200, help="Approximate length of each user message")
+    parser.add_argument("--think-time", type=float, default=0.0, help="Seconds a user waits between turns")
+    parser.add_argument("--ramp-seconds", type=float, default=0.0, help="Spread user start times over this many seconds")
+    parser.add_argument("--request-timeout", type=float, default=120.0)
+    parser.add_argument("--tokens", type=int, default=64, help="Tokens per fake answer")
+    parser.add_argument("--token-rate", type=float, default=50.0, help="Fake backend tokens per second per stream")
+    parser.add_argument("--latency", type=float, default=0.05, help="Fake backend seconds before the first token")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="Share of fake backend requests that fail")
+    parser.add_argument("--backend-concurrency", type=int, default=0,
+                        help="Override the scheduler's generations per backend, 0 keeps config.yaml")
+    parser.add_argument("--max-queue", type=int, default=0, help="Override the scheduler queue size, 0 keeps config.yaml")
+    parser.add_argument("--output", help="Write results as JSON to this file")
+    parser.add_argument("--serve", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--port", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--backend-url", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.mode, args.port, args.llm_host, args.backend_url, args.backend_concurrency, args.max_queue)
+        return
+
+    backend_port = free_port()
+    backend = start_process([os.path.join("benchmarks", "fake_llm_server.py"), "--port", str(backend_port),
+                             "--latency", str(args.latency), "--tokens", str(args.tokens),
+                             "--token-rate", str(args.token_rate), "--failure-rate", str(args.failure_rate)],
+                            backend_port)
+    backend_url = f"http://127.0.0.1:{backend_port}"
+    if args.llm_host == "openai":
+        backend_url += "/v1"
+    started_at = datetime.now(timezone.utc).isoformat()
+    port = free_port()
+    try:
+        server = start_process([os.path.abspath(__file__), "--serve", "--mode", args.mode, "--port", str(port),
+                                "--llm-host", args.llm_host, "--backend-url", backend_url,
+                                "--backend-concurrency", str(args.backend_concurrency),
+                                "--max-queue", str(args.max_queue)],
+                               port)
+        try:
+            run_id = f"{int(time.time())}"
+            results = []
+            for concurrency in args.concurrency:
+                result = run_level(f"http://127.0.0.1:{port}", server.pid, concurrency, run_id, args)
+                results.append(result)
+                print(json.dumps(result))
+        finally:
+            stop_process(server)
+    finally:
+        stop_process(backend)
+
+    if args.output:
+        settings = {key: value for key, value in vars(args).items()
+                    if key not in ("serve", "port", "backend_url", "output")}
+        with open(args.output, "w") as f:
+            json.dump({
+                "commit": git_commit(),
+                "started_at": started_at,
+                "settings": settings,
+                "results": results,
+            }, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
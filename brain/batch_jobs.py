@@ -0,0 +1,457 @@
+import argparse
+import asyncio
+import json
+import os
+import threading
+import time
+import uuid
+from loguru import logger
+from brain.event_loop import BackgroundLoop
+from brain.scheduler import Overloaded, RequestInfo, current_request
+
+JOB_FILE = "job.json"
+INPUT_FILE = "input.jsonl"
+OUTPUT_FILE = "output.jsonl"
+CHECKPOINT_FILE = "checkpoint.json"
+
+
+def read_lines(input_path):
+    """Yield (line number, text) for every non-empty line of a JSONL job file, numbered from 1."""
+    with open(input_path, encoding="utf-8") as f:
+        for line_number, line in enumerate(f, start=1):
+            if line.strip():
+                yield line_number, line
+
+
+def count_lines(input_path):
+    """Number of non-empty lines of a JSONL job file."""
+    with open(input_path, encoding="utf-8") as f:
+        return sum(1 for line in f if line.strip())
+
+
+def write_json_atomic(path, data):
+    """Replace a JSON file in one step, so a crash leaves either the old or the new version."""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+class BatchJob:
+    """One batch job, its files and its progress."""
+
+    def __init__(self, job_id, job_dir, concurrency, input_path=None, output_path=None):
+        self.job_id = job_id
+        self.job_dir = job_dir
+        self.concurrency = concurrency
+        self.input_path = input_path or os.path.join(job_dir, INPUT_FILE)
+        self.output_path = output_path or os.path.join(job_dir, OUTPUT_FILE)
+        self.checkpoint_path = os.path.join(job_dir, CHECKPOINT_FILE)
+        self.status = "queued"  # queued, running, completed, failed or cancelled
+        self.error = None
+        self.total = 0
+        self.done = 0
+        self.failed = 0
+        self.resumed = 0
+        self.tokens = 0
+        self.started_at = None
+        self.finished_at = None
+        self.future = None
+        self.task = None  # the job's task on the event loop, once it runs
+        self.checkpoint_bytes = 0  # output size of the last checkpoint written
+        self._checkpoint_lock = threading.Lock()
+
+    @classmethod
+    def load(cls, job_dir):
+        with open(os.path.join(job_dir, JOB_FILE), encoding="utf-8") as f:
+            data = json.load(f)
+        job = cls(data["job_id"], job_dir, data["concurrency"], data["input_path"], data["output_path"])
+        job.status = data["status"]
+        return job
+
+    def save(self):
+        write_json_atomic(os.path.join(self.job_dir, JOB_FILE), {
+            "job_id": self.job_id,
+            "concurrency": self.concurrency,
+            "input_path": self.input_path,
+            "output_path": self.output_path,
+            "status": self.status,
+        })
+
+    def stats(self) -> dict:
+        end = self.finished_at or time.time()
+        elapsed = end - self.started_at if self.started_at else 0.0
+        processed = self.done - self.resumed
+        remaining = self.total - self.done
+        rate = processed / elapsed if elapsed > 0 else 0.0
+        return {
+            "job_id": self.job_id,
+            "status": self.status,
+            "error": self.error,
+            "total": self.total,
+            "done": self.done,
+            "failed": self.failed,
+            "resumed": self.resumed,
+            "tokens": self.tokens,
+            "elapsed_seconds": round(elapsed, 1),
+            "jobs_per_second": round(rate, 2),
+            "tokens_per_second": round(self.tokens / elapsed, 1) if elapsed > 0 else 0.0,
+            "eta_seconds": round(remaining / rate, 1) if rate > 0 and self.status == "running" else None,
+            "output_path": self.output_path,
+        }
+
+
+class BatchRunner:
+    """
+    Runs JSONL files of (persona, messages) jobs through the router's chat models.
+
+    Each input line is a JSON object with "persona" and "messages", and optionally an
+    "id" echoed in the output (the line number otherwise). Results are appended to the
+    output JSONL as they finish, one line per input line, in completion order.
+
+    Generations run with "batch" priority, so the scheduler keeps them to their share of
+    each backend and admits interactive dialogs first. On top of that, a job runs at most
+    `concurrency` generations at once, and all jobs together at most backend_concurrency
+    (or its backend_limits override) per backend. Jobs run on the event loop that drives
+    the server's streams, since the scheduler serves a single loop; without one, as from
+    the command line, the runner starts its own.
+
+    A checkpoint file records the finished lines and the size of the output up to them.
+    After a crash, resuming cuts the output back to that size and skips the finished
+    lines, so every line ends up in the output exactly once. Jobs live in work_dir, one
+    directory each, and the ones unfinished when the brain stopped are picked up by
+    resume_jobs().
+    """
+
+    def __init__(self, router, config, context_manager=None, loop=None):
+        self.router = router
+        self.config = config.batch
+        self.context_manager = context_manager
+        self.work_dir = self.config.work_dir
+        os.makedirs(self.work_dir, exist_ok=True)
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self.loop = loop
+        self._own_loop = None  # BackgroundLoop started when no loop was given
+        self._job_slots = None  # limits jobs running at once, created on the loop
+        self._backend_slots = {}  # backend key -> semaphore, shared by all jobs
+
+    def run_on(self, loop):
+        """Run jobs on the given event loop; call it before any job starts."""
+        self.loop = loop
+
+    def _get_loop(self):
+        with self._lock:
+            if self.loop is None:
+                self._own_loop = BackgroundLoop(name="batch-event-loop")
+                self.loop = self._own_loop.loop
+            return self.loop
+
+    def submit(self, input_path=None, input_lines=None, output_path=None, concurrency=None):
+        """
+        Queue a job reading input_path, or the uploaded input_lines, and return it.
+
+        Raises:
+            ValueError: If no input is given or the input file does not exist
+        """
+        job_id = uuid.uuid4().hex
+        job_dir = os.path.join(self.work_dir, job_id)
+        if input_lines is None and (input_path is None or not os.path.isfile(input_path)):
+            raise ValueError(f"Batch input file not found: {input_path}")
+        os.makedirs(job_dir)
+        if input_lines is not None:
+            input_path = os.path.join(job_dir, INPUT_FILE)
+            with open(input_path, "wb") as f:
+                f.write(input_lines)
+        job = BatchJob(job_id, job_dir, concurrency or self.config.concurrency,
+                       os.path.abspath(input_path), os.path.abspath(output_path) if output_path else None)
+        job.save()
+        self._start(job)
+        logger.info(f"Queued batch job {job_id} reading {job.input_path}")
+        return job
+
+    def resume_jobs(self):
+        """Resume the jobs that had not finished when the brain last stopped."""
+        resumed = 0
+        for job_id in sorted(os.listdir(self.work_dir)):
+            job_dir = os.path.join(self.work_dir, job_id)
+            if not os.path.isfile(os.path.join(job_dir, JOB_FILE)):
+                continue
+            try:
+                job = BatchJob.load(job_dir)
+            except (OSError, ValueError, KeyError) as e:
+                logger.warning(f"Skipping unreadable batch job {job_id}: {str(e)}")
+                continue
+            if job.status in ("queued", "running"):
+                self._start(job)
+                resumed += 1
+            else:
+                with self._lock:
+                    self._jobs[job_id] = job
+        if resumed:
+            logger.info(f"Resuming {resumed} unfinished batch jobs")
+        return resumed
+
+    def _start(self, job):
+        with self._lock:
+            self._jobs[job.job_id] = job
+        job.future = asyncio.run_coroutine_threadsafe(self._run_job(job), self._get_loop())
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def cancel(self, job_id):
+        """Stop a job; its checkpoint is kept, but it is not resumed at startup."""
+        job = self.get(job_id)
+        if job is None or job.future is None or job.future.done():
+            return False
+        job.status = "cancelled"
+        job.save()
+        job.future.cancel()
+        return True
+
+    def _load_checkpoint(self, job):
+        """Return the finished lines and cut the output back to the checkpointed size."""
+        try:
+            with open(job.checkpoint_path, encoding="utf-8") as f:
+                checkpoint = json.load(f)
+        except FileNotFoundError:
+            # A new job appends to whatever the output file already holds, and records
+            # that size first so a resume never cuts the file below it
+            output_bytes = os.path.getsize(job.output_path) if os.path.exists(job.output_path) else 0
+            checkpoint = {"done_lines": [], "output_bytes": output_bytes, "failed": 0, "tokens": 0}
+            write_json_atomic(job.checkpoint_path, checkpoint)
+        if os.path.exists(job.output_path):
+            # Results written after the last checkpoint are produced again
+            with open(job.output_path, "r+b") as f:
+                f.truncate(checkpoint["output_bytes"])
+        job.failed = checkpoint["failed"]
+        job.tokens = checkpoint["tokens"]
+        job.checkpoint_bytes = checkpoint["output_bytes"]
+        return set(checkpoint["done_lines"])
+
+    async def _save_checkpoint(self, job, output, done_lines):
+        # Taken on the loop, between whole output lines; the fsyncs run in a thread so
+        # they do not hold up the streams sharing the loop
+        output.flush()
+        checkpoint = {
+            "done_lines": sorted(done_lines),
+            "output_bytes": output.tell(),
+            "failed": job.failed,
+            "tokens": job.tokens,
+        }
+        await asyncio.to_thread(self._write_checkpoint, job, output.fileno(), checkpoint)
+
+    @staticmethod
+    def _write_checkpoint(job, output_fd, checkpoint):
+        # A cancelled worker's checkpoint may still be writing when the job's last one starts
+        with job._checkpoint_lock:
+            if checkpoint["output_bytes"] < job.checkpoint_bytes:
+                return
+            os.fsync(output_fd)
+            write_json_atomic(job.checkpoint_path, checkpoint)
+            job.checkpoint_bytes = checkpoint["output_bytes"]
+
+    def _backend_slot(self, persona_config):
+        base_urls = [endpoint.base_url for endpoint in persona_config.endpoints] or [persona_config.base_url]
+        # Taken before a balanced persona picks its endpoint, so it covers all of them
+        backend = f"{persona_config.llm_host}:{','.join(base_urls)}"
+        slot = self._backend_slots.get(backend)
+        if slot is None:
+            limit = sum(self.config.backend_limits.get(base_url, self.config.backend_concurrency)
+                        for base_url in base_urls)
+            slot = self._backend_slots[backend] = asyncio.Semaphore(max(1, limit))
+        return slot
+
+    async def _run_job(self, job):
+        job.task = asyncio.current_task()
+        if self._job_slots is None:
+            self._job_slots = asyncio.Semaphore(max(1, self.config.max_running_jobs))
+        try:
+            async with self._job_slots:
+                await self._process(job)
+        except asyncio.CancelledError:
+            job.finished_at = time.time()
+            logger.info(f"Batch job {job.job_id} cancelled after {job.done} of {job.total} lines")
+            raise
+        except Exception as e:
+            job.status = "failed"
+            job.error = str(e)
+            job.finished_at = time.time()
+            job.save()
+            logger.error(f"Batch job {job.job_id} failed: {str(e)}")
+
+    async def _process(self, job):
+        done_lines = self._load_checkpoint(job)
+        # Counted without parsing, the lines themselves are read as workers need them
+        job.total = await asyncio.to_thread(count_lines, job.input_path)
+        job.done = job.resumed = len(done_lines)
+        job.status = "running"
+        job.started_at = time.time()
+        job.save()
+        if done_lines:
+            logger.info(f"Resuming batch job {job.job_id} at {job.done} of {job.total} lines")
+
+        # Batch generations queue behind interactive ones in the scheduler
+        current_request.set(RequestInfo(f"batch:{job.job_id}", "batch"))
+        pending = ((line, text) for line, text in read_lines(job.input_path) if line not in done_lines)
+        last_checkpoint = last_progress = time.monotonic()
+        with open(job.output_path, "a", encoding="utf-8") as output:
+
+            async def worker():
+                nonlocal last_checkpoint, last_progress
+                # The workers share one iterator and the loop thread, so lines are read
+                # and written whole, one at a time
+                for line, text in pending:
+                    result = await self._run_line(line, text)
+                    output.write(json.dumps(result) + "\n")
+                    done_lines.add(line)
+                    job.done += 1
+                    job.tokens += result.get("tokens", 0)
+                    if result.get("error"):
+                        job.failed += 1
+                    now = time.monotonic()
+                    if now - last_checkpoint >= self.config.checkpoint_seconds:
+                        last_checkpoint = now
+                        await self._save_checkpoint(job, output, done_lines)
+                    if now - last_progress >= self.config.progress_seconds:
+                        stats = job.stats()
+                        logger.info(f"Batch job {job.job_id}: {stats['done']}/{stats['total']} lines, "
+                                    f"{stats['failed']} failed, {stats['tokens_per_second']} tokens/s, "
+                                    f"eta {stats['eta_seconds']}s")
+                        last_progress = now
+
+            try:
+                await asyncio.gather(*(worker() for _ in range(max(1, job.concurrency))))
+            finally:
+                await self._save_checkpoint(job, output, done_lines)
+
+        job.status = "completed"
+        job.finished_at = time.time()
+        job.save()
+        stats = job.stats()
+        logger.info(f"Batch job {job.job_id} completed: {stats['done']} lines, {stats['failed']} failed, "
+                    f"{stats['tokens_per_second']} tokens/s in {stats['elapsed_seconds']}s")
+
+    async def _run_line(self, line, text):
+        """Generate the answer of one input line and return its output record."""
+        result = {"id": line, "persona": None}
+        started = time.perf_counter()
+        try:
+            # A malformed line becomes an error record rather than stopping the job
+            record = json.loads(text)
+            result.update(id=record.get("id", line), persona=record.get("persona"))
+            persona = record["persona"]
+            persona_config = self.router.config.persona_models[persona]
+            messages = record["messages"]
+            handler = self.router.get_chat_model(persona)
+            if self.context_manager is not None:
+                # Token counting over long histories stays off the loop
+                messages = await asyncio.to_thread(self.context_manager.prepare, persona, handler, messages)
+            async with self._backend_slot(persona_config):
+                content, tokens = await self._generate(handler, messages)
+            result.update(response=content, tokens=tokens)
+        except Exception as e:
+            result["error"] = f"{type(e).__name__}: {str(e)}"
+        result["seconds"] = round(time.perf_counter() - started, 3)
+        return result
+
+    async def _generate(self, handler, messages):
+        """Collect a streamed answer, waiting and retrying while the scheduler is full."""
+        while True:
+            content = []
+            stream = handler.chat(messages, stream=True)
+            try:
+                async for chunk in stream:
+                    if chunk.get('is_error'):
+                        raise RuntimeError(chunk['message'])
+                    if chunk.get('is_chunk'):
+                        content.append(chunk['message'])
+                return "".join(content), len(content)
+            except Overloaded as e:
+                await asyncio.sleep(e.retry_after)
+            finally:
+                await stream.aclose()
+
+    def stats(self) -> dict:
+        with self._lock:
+            jobs = list(self._jobs.values())
+        return {
+            "jobs": len(jobs),
+            "running": sum(1 for job in jobs if job.status == "running"),
+            "queued": sum(1 for job in jobs if job.status == "queued"),
+        }
+
+    def close(self):
+        """Stop running jobs; they resume from their checkpoint at the next start."""
+        with self._lock:
+            jobs = [job for job in self._jobs.values() if job.future is not None and not job.future.done()]
+            loop = self.loop
+        if jobs and not loop.is_closed():
+            try:
+                if loop.is_running():
+                    asyncio.run_coroutine_threadsafe(self._stop_jobs(jobs), loop).result(timeout=10)
+                else:
+                    # The server's loop has stopped serving, e.g. during async mode cleanup
+                    loop.run_until_complete(self._stop_jobs(jobs))
+            except Exception as e:
+                logger.error(f"Error stopping batch jobs: {str(e)}")
+        if self._own_loop is not None:
+            self._own_loop.close()
+
+    @staticmethod
+    async def _stop_jobs(jobs):
+        """Cancel the jobs' tasks, leaving the loop's other tasks alone, and wait for their last checkpoint."""
+        tasks = []
+        for job in jobs:
+            if job.task is not None:
+                job.task.cancel()
+                tasks.append(job.task)
+            else:
+                job.future.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+def main():
+    from config.config_setup import init_config
+    from config.logging_setup import setup_logging
+    from brain.domain_router import DomainRouter
+    from brain.context_manager import ContextManager
+
+    parser = argparse.ArgumentParser(description="Run a JSONL file of (persona, messages) jobs through the brain")
+    parser.add_argument("input", help="JSONL file, one {\"persona\", \"messages\"} object per line")
+    parser.add_argument("--output", required=True, help="JSONL file the results are appended to")
+    parser.add_argument("--concurrency", type=int, help="Generations at once, defaults to batch.concurrency")
+    parser.add_argument("--resume", help="Job id of an interrupted run to resume instead")
+    args = parser.parse_args()
+
+    setup_logging()
+    config = init_config()
+    router = DomainRouter(config)
+    # Summaries and jobs share one loop, the only one the scheduler serves
+    loop = BackgroundLoop(name="batch-event-loop")
+    context_manager = ContextManager(config, loop=loop.loop)
+    runner = BatchRunner(router, config, context_manager, loop=loop.loop)
+    try:
+        if args.resume:
+            job = BatchJob.load(os.path.join(runner.work_dir, args.resume))
+            runner._start(job)
+        else:
+            job = runner.submit(input_path=args.input, output_path=args.output, concurrency=args.concurrency)
+        print(f"Batch job {job.job_id}, resume with --resume {job.job_id} if interrupted")
+        job.future.result()
+        print(json.dumps(job.stats()))
+    except KeyboardInterrupt:
+        print(f"Interrupted, resume with --resume {job.job_id}")
+    finally:
+        runner.close()
+        context_manager.close()
+        router.close()
+        loop.close()
+
+
+if __name__ == "__main__":
+    main()
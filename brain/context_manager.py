@@ -0,0 +1,261 @@
+import asyncio
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from loguru import logger
+from brain.event_loop import BackgroundLoop
+from brain.scheduler import RequestInfo, current_request
+
+CHARS_PER_TOKEN = 4
+MESSAGE_OVERHEAD_TOKENS = 4  # role and template tokens wrapped around every message
+PREFETCH_WATERMARK = 0.75  # share of the budget after which the next summary block is prepared
+SUMMARY_PREFIX = "Summary of the earlier conversation:\n"
+SUMMARY_INSTRUCTIONS = (
+    "Summarize the conversation below so the summary can replace it in a chat history. "
+    "Keep facts, names, numbers, decisions and open questions. "
+    "Reply with the summary only, in at most {max_words} words."
+)
+
+
+def estimate_tokens(text):
+    """Approximate token count of a text, without loading a tokenizer."""
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def message_tokens(message):
+    """Approximate token count of a chat message, including per-message overhead."""
+    return estimate_tokens(message.get("content") or "") + MESSAGE_OVERHEAD_TOKENS
+
+
+class ContextManager:
+    """
+    Fits a dialog's message history into the persona's token budget before it reaches the model.
+
+    System messages and the most recent messages are always kept. When the history is over
+    budget, the oldest turns are folded into a rolling summary, which is computed once in the
+    background and cached by the digest of the messages it covers. The cut between summarized
+    and verbatim turns only moves in whole blocks of messages, so between moves every request
+    starts with the same bytes (system prompt, summary, then the verbatim turns) and the
+    backend's prefix cache keeps hitting.
+
+    Summaries are streamed through the persona's scheduled chat model at batch priority,
+    so they wait behind interactive dialogs and count against the backend's limits. They
+    run on the event loop that drives the server's streams, since the scheduler serves a
+    single loop; without one, the manager starts its own.
+    """
+
+    def __init__(self, config, loop=None):
+        self.config = config
+        settings = config.context_window
+        self.block_messages = settings.summary_block_messages
+        self.summary_max_tokens = settings.summary_max_tokens
+        self.cache_entries = settings.summary_cache_entries
+        self.summary_workers = max(1, settings.summary_workers)
+        self._summaries = OrderedDict()  # digest of summarized messages -> summary text
+        self._pending = {}  # digest -> future of a summary being computed
+        self._lock = threading.Lock()
+        self.loop = loop
+        self._own_loop = None  # BackgroundLoop started when no loop was given
+        self._summary_slots = None  # limits summaries at once, created on the loop
+        self._tasks = set()  # summary tasks running on the loop
+        self.requests = 0
+        self.trimmed_requests = 0
+        self.summary_hits = 0
+        self.summaries_computed = 0
+        self.tokens_saved = 0
+
+    def run_on(self, loop):
+        """Compute summaries on the given event loop; call it before the first request."""
+        self.loop = loop
+
+    def _get_loop(self):
+        with self._lock:
+            if self.loop is None:
+                self._own_loop = BackgroundLoop(name="context-summary-loop")
+                self.loop = self._own_loop.loop
+            return self.loop
+
+    def prepare(self, persona, handler, messages):
+        """
+        Return the messages to send to the model for this turn.
+
+        Args:
+            persona: Persona selected for the dialog, used to look up its budget
+            handler: The persona's model handler, also used to compute summaries
+            messages: Full message history as sent by the interface
+
+        Returns:
+            The history unchanged if it fits the budget, otherwise the system messages,
+            a summary of the oldest turns (once available) and the turns after it
+        """
+        persona_config = self.config.persona_models[persona]
+        budget = persona_config.context_budget_tokens - persona_config.response_reserve_tokens
+        with self._lock:
+            self.requests += 1
+
+        system = [m for m in messages if m.get("role") == "system"]
+        dialog = [m for m in messages if m.get("role") != "system"]
+        if not system and persona_config.persona_prompt:
+            system = [{"role": "system", "content": persona_config.persona_prompt}]
+            messages = system + messages
+
+        dialog_tokens = [message_tokens(m) for m in dialog]
+        fixed_tokens = sum(message_tokens(m) for m in system)
+        total_tokens = fixed_tokens + sum(dialog_tokens)
+        if total_tokens <= budget:
+            return messages
+
+        # Smallest block-aligned cut that leaves the verbatim tail (plus a summary) within budget
+        keep_recent = max(1, persona_config.keep_recent_messages)
+        max_cut = max(0, len(dialog) - keep_recent) // self.block_messages * self.block_messages
+        summary_tokens = self.summary_max_tokens + MESSAGE_OVERHEAD_TOKENS if persona_config.summarize_history else 0
+        cut = 0
+        tail_tokens = sum(dialog_tokens)
+        while cut < max_cut and fixed_tokens + summary_tokens + tail_tokens > budget:
+            tail_tokens -= sum(dialog_tokens[cut:cut + self.block_messages])
+            cut += self.block_messages
+
+        summary, summarized = None, 0
+        if persona_config.summarize_history and cut:
+            # Start the next block's summary early, so it is ready when the cut moves again
+            next_cut = cut
+            if fixed_tokens + summary_tokens + tail_tokens > budget * PREFETCH_WATERMARK:
+                next_cut = min(cut + self.block_messages, max(cut, len(dialog) - 1) // self.block_messages * self.block_messages)
+            summary, summarized = self._summary_for(persona, handler, dialog, cut, next_cut)
+
+        # Turns the cached summary does not cover yet are sent as they are until it does;
+        # without summaries they are dropped
+        start = summarized if persona_config.summarize_history else cut
+        if summary is None:
+            prepared = system + dialog[start:]
+        else:
+            prepared = system + [{"role": "system", "content": SUMMARY_PREFIX + summary}] + dialog[start:]
+
+        prepared_tokens = sum(message_tokens(m) for m in prepared)
+        if prepared_tokens > budget:
+            logger.warning(f"Context for persona {persona} is {prepared_tokens} tokens after trimming, over its budget of {budget}")
+        with self._lock:
+            self.trimmed_requests += 1
+            self.tokens_saved += max(0, total_tokens - prepared_tokens)
+        logger.debug(f"Trimmed context for persona {persona} from {total_tokens} to {prepared_tokens} tokens, "
+                     f"{summarized} messages summarized and {start - summarized} dropped")
+        return prepared
+
+    def _block_digests(self, persona, dialog, cut):
+        """Digests of dialog[:n] for every block boundary n up to the block-aligned cut, as {n: digest}."""
+        running = hashlib.sha256(persona.encode("utf-8"))
+        digests = {}
+        for n, message in enumerate(dialog[:cut], start=1):
+            running.update(json.dumps([message.get("role"), message.get("content")]).encode("utf-8"))
+            if n % self.block_messages == 0:
+                digests[n] = running.hexdigest()
+        return digests
+
+    def _summary_for(self, persona, handler, dialog, cut, next_cut):
+        """
+        Return (summary, messages covered) for the longest cached summary of dialog[:n], n <= cut.
+
+        Summaries of dialog[:cut] and dialog[:next_cut] that are not cached yet are built in the
+        background, each from the longest cached summary before it plus the messages after that,
+        so every message is summarized once. Until the summary of dialog[:cut] is ready the
+        messages between the best cached summary and the cut are sent verbatim.
+        """
+        digests = self._block_digests(persona, dialog, max(cut, next_cut))
+        loop = self._get_loop()
+        with self._lock:
+            cached = [n for n in sorted(digests) if n <= cut and digests[n] in self._summaries]
+            for target in sorted({cut, next_cut}):
+                digest = digests[target]
+                if digest in self._summaries or digest in self._pending:
+                    continue
+                previous_cut, previous_summary = 0, None
+                for n in sorted(digests, reverse=True):
+                    if n < target and digests[n] in self._summaries:
+                        previous_cut, previous_summary = n, self._summaries[digests[n]]
+                        break
+                self._pending[digest] = asyncio.run_coroutine_threadsafe(
+                    self._summarize(persona, handler, digest, previous_summary, dialog[previous_cut:target]),
+                    loop)
+            if not cached:
+                return None, 0
+            summarized = cached[-1]
+            self._summaries.move_to_end(digests[summarized])
+            self.summary_hits += 1
+            return self._summaries[digests[summarized]], summarized
+
+    async def _summarize(self, persona, handler, digest, previous_summary, messages):
+        """Compute one rolling summary as a batch priority generation and cache it."""
+        task = asyncio.current_task()
+        self._tasks.add(task)
+        try:
+            transcript = "\n".join(f"{m.get('role')}: {m.get('content')}" for m in messages)
+            if previous_summary:
+                transcript = f"{SUMMARY_PREFIX}{previous_summary}\n\n{transcript}"
+            max_words = max(1, self.summary_max_tokens * 3 // 4)
+            # Each summary runs in its own task, so this only applies to its generation
+            current_request.set(RequestInfo(f"summary:{persona}", "batch"))
+            if self._summary_slots is None:
+                self._summary_slots = asyncio.Semaphore(self.summary_workers)
+            content = []
+            async with self._summary_slots:
+                stream = handler.chat([
+                    {"role": "system", "content": SUMMARY_INSTRUCTIONS.format(max_words=max_words)},
+                    {"role": "user", "content": transcript},
+                ], stream=True)
+                try:
+                    async for chunk in stream:
+                        if chunk.get('is_error') or chunk.get('is_fallback'):
+                            raise RuntimeError(chunk['message'])
+                        if chunk.get('is_chunk'):
+                            content.append(chunk['message'])
+                finally:
+                    await stream.aclose()
+            summary = "".join(content).strip()
+            if not summary:
+                return
+            with self._lock:
+                self._summaries[digest] = summary
+                while len(self._summaries) > self.cache_entries:
+                    self._summaries.popitem(last=False)
+                self.summaries_computed += 1
+            logger.debug(f"Computed context summary of {len(messages)} messages ({estimate_tokens(summary)} tokens)")
+        except Exception as e:
+            logger.error(f"Error computing context summary: {str(e)}")
+        finally:
+            self._tasks.discard(task)
+            with self._lock:
+                self._pending.pop(digest, None)
+
+    def stats(self) -> dict:
+        """Return trimming and summary counters for monitoring."""
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "trimmed_requests": self.trimmed_requests,
+                "summary_hits": self.summary_hits,
+                "summaries_computed": self.summaries_computed,
+                "summaries_cached": len(self._summaries),
+                "tokens_saved": self.tokens_saved,
+            }
+
+    def close(self):
+        """Cancel the summaries in flight; requests compute them again later."""
+        loop = self.loop
+        if self._tasks and loop is not None and not loop.is_closed():
+            try:
+                if loop.is_running():
+                    asyncio.run_coroutine_threadsafe(self._cancel_summaries(), loop).result(timeout=5)
+                else:
+                    # The server's loop has stopped serving, e.g. during async mode cleanup
+                    loop.run_until_complete(self._cancel_summaries())
+            except Exception as e:
+                logger.error(f"Error cancelling context summaries: {str(e)}")
+        if self._own_loop is not None:
+            self._own_loop.close()
+
+    async def _cancel_summaries(self):
+        tasks = list(self._tasks)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
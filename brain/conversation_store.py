@@ -0,0 +1,261 @@
+import json
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy import text
+from loguru import logger
+from config.database_setup import get_sessionmaker
+
+# Seconds between clean-ups of expired spilled conversations
+SPILL_CLEANUP_INTERVAL = 3600
+
+
+class VersionConflict(Exception):
+    """The client's version does not match the stored conversation, so it has to resync."""
+
+    def __init__(self, dialog_id, version):
+        super().__init__(f"Dialog {dialog_id} is at version {version}")
+        self.dialog_id = dialog_id
+        self.version = version
+
+
+class Conversation:
+    """Message history of one dialog, with a version bumped on every change."""
+
+    def __init__(self, sender, messages, version=1):
+        self.sender = sender
+        self.messages = messages
+        self.version = version
+        self.chars = sum(len(m.get("content") or "") for m in messages)
+
+
+def create_dialog_state_table(session):
+    """Create the table evicted conversations spill to, if it doesn't exist."""
+    create_table_query = text("""
+    CREATE TABLE IF NOT EXISTS dialog_state (
+        dialog_id TEXT PRIMARY KEY,
+        sender TEXT NOT NULL,
+        version INTEGER NOT NULL,
+        messages JSONB NOT NULL,
+        updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+    );
+    CREATE INDEX IF NOT EXISTS dialog_state_updated_idx ON dialog_state (updated_at);
+    """)
+    session.execute(create_table_query)
+    session.commit()
+
+
+class ConversationStore:
+    """
+    Server-side conversation state keyed by dialog_id, so clients only send new messages.
+
+    Conversations live in a bounded in-memory LRU. With a database URL, evicted
+    conversations are written to the dialog_state table in the background and read
+    back on a miss; without one, an evicted dialog makes the client resync.
+    """
+
+    def __init__(self, max_dialogs=1000, max_chars=50_000_000, database_url=None, pool_config=None, spill_ttl_seconds=7 * 24 * 3600):
+        self.max_dialogs = max_dialogs
+        self.max_chars = max_chars
+        self.spill_ttl_seconds = spill_ttl_seconds
+        self._conversations = OrderedDict()
+        self._chars = 0
+        self._lock = threading.Lock()
+        self._spilling = {}  # dialog_id -> conversation being written to the database
+        self._last_cleanup = 0.0
+        self.hits = 0
+        self.misses = 0
+        self.conflicts = 0
+        self.evictions = 0
+        self.spill_loads = 0
+
+        self.Session = None
+        self._spill_executor = None
+        if database_url:
+            self.Session = get_sessionmaker(database_url, pool_config)
+            with self.Session() as session:
+                create_dialog_state_table(session)
+            self._spill_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="dialog-spill")
+
+    def get(self, dialog_id, sender):
+        """Return the stored conversation of a dialog, or None if the server does not have it."""
+        with self._lock:
+            conversation = self._conversations.get(dialog_id)
+            if conversation is not None:
+                self._conversations.move_to_end(dialog_id)
+                restored = False
+            else:
+                conversation = self._spilling.get(dialog_id)
+                restored = conversation is not None
+        if conversation is None and self.Session is not None:
+            conversation = self._load_spilled(dialog_id)
+            restored = conversation is not None
+        if restored:
+            self._store(dialog_id, conversation)
+
+        with self._lock:
+            if conversation is None or conversation.sender != sender:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return conversation
+
+    def replace(self, dialog_id, sender, messages):
+        """Store the full history sent by the client and return the new version."""
+        with self._lock:
+            previous = self._conversations.get(dialog_id)
+            version = previous.version + 1 if previous is not None else 1
+        conversation = Conversation(sender, list(messages), version)
+        self._store(dialog_id, conversation)
+        return conversation.version
+
+    def append(self, dialog_id, sender, messages, version):
+        """
+        Append messages to a dialog the client last saw at the given version.
+
+        Returns:
+            The full message history and the new version
+
+        Raises:
+            VersionConflict: The dialog is unknown, belongs to another sender or moved on
+        """
+        conversation = self.get(dialog_id, sender)
+        with self._lock:
+            if conversation is None or conversation.version != version:
+                self.conflicts += 1
+                raise VersionConflict(dialog_id, conversation.version if conversation is not None else None)
+            conversation.messages.extend(messages)
+            added_chars = sum(len(m.get("content") or "") for m in messages)
+            conversation.chars += added_chars
+            conversation.version += 1
+            if self._conversations.get(dialog_id) is conversation:
+                self._chars += added_chars
+            history, new_version = list(conversation.messages), conversation.version
+        self._evict()
+        return history, new_version
+
+    def sync(self, dialog_id, sender, messages=None, new_messages=None, version=None):
+        """
+        Bring the stored dialog up to date with one client request.
+
+        Args:
+            messages: Full history, sent on the first turn or to resync
+            new_messages: Messages added since the client's version, sent otherwise
+            version: Version of the dialog the client last received
+
+        Returns:
+            The full message history and its version
+
+        Raises:
+            VersionConflict: Only new messages were sent and the stored dialog does not match
+        """
+        if messages is not None:
+            return list(messages), self.replace(dialog_id, sender, messages)
+        return self.append(dialog_id, sender, new_messages or [], version)
+
+    def record_reply(self, dialog_id, sender, reply, version):
+        """Append the assistant's reply to the history at the given version and return the new version, or None."""
+        if not reply.get("content"):
+            # The interface does not keep empty replies either, so it resyncs on its next turn
+            return None
+        try:
+            return self.append(dialog_id, sender, [reply], version)[1]
+        except VersionConflict as e:
+            # Another request changed the dialog meanwhile, the client resyncs on its next turn
+            logger.info(f"Reply not recorded: {str(e)}")
+            return None
+
+    def _store(self, dialog_id, conversation):
+        with self._lock:
+            previous = self._conversations.pop(dialog_id, None)
+            if previous is not None:
+                self._chars -= previous.chars
+            self._conversations[dialog_id] = conversation
+            self._chars += conversation.chars
+        self._evict()
+
+    def _evict(self):
+        """Drop least recently used dialogs beyond the limits, spilling them when configured."""
+        evicted = []
+        with self._lock:
+            while len(self._conversations) > 1 and (len(self._conversations) > self.max_dialogs or self._chars > self.max_chars):
+                dialog_id, conversation = self._conversations.popitem(last=False)
+                self._chars -= conversation.chars
+                evicted.append((dialog_id, conversation))
+                if self._spill_executor is not None:
+                    self._spilling[dialog_id] = conversation
+            self.evictions += len(evicted)
+        if evicted and self._spill_executor is not None:
+            self._spill_executor.submit(self._spill, evicted)
+
+    def _spill(self, evicted):
+        """Write evicted conversations to the database, run on the spill thread."""
+        upsert_query = text("""
+        INSERT INTO dialog_state (dialog_id, sender, version, messages, updated_at)
+        VALUES (:dialog_id, :sender, :version, :messages, CURRENT_TIMESTAMP)
+        ON CONFLICT (dialog_id) DO UPDATE
+        SET sender = EXCLUDED.sender, version = EXCLUDED.version,
+            messages = EXCLUDED.messages, updated_at = EXCLUDED.updated_at;
+        """)
+        try:
+            with self.Session() as session:
+                session.execute(upsert_query, [
+                    {"dialog_id": dialog_id, "sender": conversation.sender,
+                     "version": conversation.version, "messages": json.dumps(conversation.messages)}
+                    for dialog_id, conversation in evicted
+                ])
+                if time.monotonic() - self._last_cleanup > SPILL_CLEANUP_INTERVAL:
+                    session.execute(
+                        text("DELETE FROM dialog_state WHERE updated_at < CURRENT_TIMESTAMP - make_interval(secs => :ttl);"),
+                        {"ttl": self.spill_ttl_seconds}
+                    )
+                    self._last_cleanup = time.monotonic()
+                session.commit()
+            logger.debug(f"Spilled {len(evicted)} conversations to the database")
+        except Exception as e:
+            logger.error(f"Error spilling conversations: {str(e)}")
+        finally:
+            with self._lock:
+                for dialog_id, conversation in evicted:
+                    if self._spilling.get(dialog_id) is conversation:
+                        del self._spilling[dialog_id]
+
+    def _load_spilled(self, dialog_id):
+        select_query = text("SELECT sender, version, messages FROM dialog_state WHERE dialog_id = :dialog_id;")
+        try:
+            with self.Session() as session:
+                row = session.execute(select_query, {"dialog_id": dialog_id}).first()
+        except Exception as e:
+            logger.error(f"Error loading spilled conversation {dialog_id}: {str(e)}")
+            return None
+        if row is None:
+            return None
+        with self._lock:
+            self.spill_loads += 1
+        return Conversation(row.sender, row.messages, row.version)
+
+    def stats(self) -> dict:
+        """Return store counters for monitoring."""
+        with self._lock:
+            return {
+                "dialogs": len(self._conversations),
+                "chars": self._chars,
+                "hits": self.hits,
+                "misses": self.misses,
+                "conflicts": self.conflicts,
+                "evictions": self.evictions,
+                "spill_loads": self.spill_loads,
+            }
+
+    def close(self):
+        """Spill every in-memory conversation, when configured, and wait for the writes."""
+        if self._spill_executor is None:
+            return
+        with self._lock:
+            remaining = list(self._conversations.items())
+            self._conversations.clear()
+            self._chars = 0
+        if remaining:
+            self._spill_executor.submit(self._spill, remaining)
+        self._spill_executor.shutdown(wait=True)
@@ -0,0 +1,55 @@
+import json
+from loguru import logger
+from brain.scheduler import Overloaded
+
+async def stream_dialog(handler, messages, dialog_id, sender, on_complete=None):
+    """
+    Stream a chat response from the handler as server-sent events.
+
+    Args:
+        handler: The model handler selected for the persona
+        messages: Full message history to send to the model
+        dialog_id: Dialog identifier echoed back in every event
+        sender: Sender name echoed back in every event
+        on_complete: Optional callback receiving the accumulated assistant message,
+            returning extra fields for the final event
+
+    Yields:
+        SSE formatted strings, one per chunk, followed by the final message and [DONE]
+    """
+    accumulated_message = {'role': 'assistant', 'content': ''}
+    response_stream = handler.chat(messages, stream=True)
+    try:
+        async for chunk in response_stream:
+            if isinstance(chunk, dict) and 'message' in chunk:
+                if chunk.get('is_chunk', False):
+                    content = chunk['message']
+                    accumulated_message['content'] += content
+                    response_data = {
+                        'dialog_id': dialog_id, 
+                        'message': content, 
+                        'sender': sender, 
+                        'is_chunk': True
+                    }
+                    yield f"data: {json.dumps(response_data)}\n\n"
+
+        # Final message
+        final_data = {
+            'dialog_id': dialog_id, 
+            'message': accumulated_message['content'], 
+            'sender': sender, 
+            'is_chunk': False
+        }
+        if on_complete is not None:
+            final_data.update(on_complete(accumulated_message) or {})
+        yield f"data: {json.dumps(final_data)}\n\n"
+        yield "data: [DONE]\n\n"
+    except Overloaded:
+        # Not admitted by the scheduler, the server answers 429
+        raise
+    except Exception as e:
+        logger.error(f"Error in processing stream: {str(e)}")
+        raise
+    finally:
+        # Also reached when the client goes away, so the backend stops generating
+        await response_stream.aclose()
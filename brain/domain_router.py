@@ -1,11 +1,61 @@
 from brain.models.base_model import BaseModel
 from .model_factory import ModelFactory
+from .embedding_cache import EmbeddingCache, CachedEmbeddingModel
+from .response_cache import ResponseCache, CachedResponseModel
+from .single_flight import SingleFlight, CoalescedChatModel
+from .scheduler import Scheduler, ScheduledChatModel
+from .metrics import registry, InstrumentedModel
+from .load_balancer import Endpoint, BalancedModel, EndpointMonitor
+from .warmup import ModelWarmer
+from .handler_lease import HandlerLease, LeasedModel
 from loguru import logger
+import threading
+
+# Config sections used to build handlers; a change to any of them rebuilds every persona's handler
+HANDLER_SETTINGS = ("load_balancing", "warmup", "metrics_enabled")
+# Config sections read once when the router and the server's components are created, changes apply on restart
+RESTART_SETTINGS = ("embedding_cache", "response_cache", "coalesce_requests", "scheduler",
+                    "context_window", "conversation_store", "batch")
 
 class DomainRouter:
     def __init__(self, config):
         """Initialize the router with configuration."""
         self.config = config
+        # Long-lived handlers keyed by persona, so pooled clients are reused across requests
+        self._handlers = {}
+        self._leases = {}  # persona -> HandlerLease of its current handler
+        self._lock = threading.Lock()
+        self.pool_hits = 0
+        self.pool_misses = 0
+        self._embedders = {}
+        self.embedding_cache = None
+        cache_config = config.embedding_cache
+        if cache_config.enabled:
+            self.embedding_cache = EmbeddingCache(cache_config.cache_dir,
+                                                  memory_entries=cache_config.memory_entries,
+                                                  disk_entries=cache_config.disk_entries)
+        self._chat_models = {}
+        self.response_cache = None
+        response_config = config.response_cache
+        if response_config.enabled:
+            self.response_cache = ResponseCache(memory_entries=response_config.memory_entries,
+                                                memory_bytes=response_config.memory_bytes,
+                                                cache_dir=response_config.cache_dir or None,
+                                                disk_bytes=response_config.disk_bytes)
+        self.single_flight = SingleFlight() if config.coalesce_requests else None
+        self.scheduler = None
+        scheduler_config = config.scheduler
+        if scheduler_config.enabled:
+            self.scheduler = Scheduler(max_queue=scheduler_config.max_queue,
+                                       max_queue_per_sender=scheduler_config.max_queue_per_sender,
+                                       max_wait_seconds=scheduler_config.max_wait_seconds)
+        self._balancers = {}
+        balancing_config = config.load_balancing
+        self.endpoint_monitor = EndpointMonitor(balancing_config.health_check_interval_seconds,
+                                                balancing_config.health_check_timeout_seconds)
+        self.warmer = ModelWarmer(config, self._create_model) if config.warmup.enabled else None
+        if config.metrics_enabled:
+            self._register_metrics()
 
     
     def get_handler(self, persona: str = None) -> BaseModel:
@@ -18,10 +68,265 @@ class DomainRouter:
         Returns:
             A handler instance for the persona
         """
-        logger.debug(f"Getting handler for persona: {persona}")
-        return ModelFactory.create(self.config.persona_models[persona].llm_host,
-                            base_url=self.config.persona_models[persona].base_url,
-                            model=self.config.persona_models[persona].model,
-                            api_key=self.config.persona_models[persona].api_key)
+        with self._lock:
+            return self._get_handler(persona)
+
+    def _get_handler(self, persona):
+        """Return the pooled handler of a persona, creating it; the caller holds self._lock."""
+        handler = self._handlers.get(persona)
+        if handler is not None:
+            self.pool_hits += 1
+            return handler
+
+        self.pool_misses += 1
+        logger.debug(f"Creating handler for persona: {persona}")
+        persona_config = self.config.persona_models[persona]
+        if len(persona_config.endpoints) > 1:
+            handler = self._create_balanced_handler(persona, persona_config)
+        else:
+            base_url = persona_config.endpoints[0].base_url if persona_config.endpoints else persona_config.base_url
+            handler = self._create_model(persona_config, base_url)
+        if self.config.metrics_enabled:
+            handler = InstrumentedModel(handler, persona)
+        self._handlers[persona] = handler
+        return handler
+
+    def _get_lease(self, persona, handler):
+        """Return the lease of a persona's current handler; the caller holds self._lock."""
+        lease = self._leases.get(persona)
+        if lease is None or lease.handler is not handler:
+            lease = HandlerLease(persona, handler)
+            self._leases[persona] = lease
+        return lease
+
+    def _create_model(self, persona_config, base_url):
+        warmup_config = self.config.warmup
+        return ModelFactory.create(persona_config.llm_host,
+                                   base_url=base_url,
+                                   model=persona_config.model,
+                                   api_key=persona_config.api_key,
+                                   embed_batch_size=persona_config.embed_batch_size,
+                                   embed_concurrency=persona_config.embed_concurrency,
+                                   # Every request renews the residency the warmer started
+                                   keep_alive=warmup_config.keep_alive_seconds if warmup_config.enabled else None)
+
+    def _create_balanced_handler(self, persona, persona_config):
+        """Create a model per endpoint and balance the persona's requests over them."""
+        balancing_config = self.config.load_balancing
+        endpoints = []
+        for endpoint_config in persona_config.endpoints:
+            backend, backend_limit = self._backend_slot(persona_config, endpoint_config.base_url)
+            endpoints.append(Endpoint(self._create_model(persona_config, endpoint_config.base_url),
+                                      endpoint_config.base_url, endpoint_config.weight,
+                                      failure_threshold=balancing_config.failure_threshold,
+                                      open_seconds=balancing_config.open_seconds,
+                                      backend=backend, backend_limit=backend_limit))
+        # Each generation takes its slot on the endpoint it runs on, in the same bucket as
+        # any other persona on that host
+        balancer = BalancedModel(endpoints, persona, scheduler=self.scheduler,
+                                 persona_limit=persona_config.max_concurrency)
+        self._balancers[persona] = balancer
+        self.endpoint_monitor.watch(endpoints)
+        logger.info(f"Balancing persona {persona} over {len(endpoints)} endpoints")
+        return balancer
+
+    def _backend_slot(self, persona_config, base_url):
+        """Return the scheduler key of one of a persona's hosts and the generations it may run at once."""
+        scheduler_config = self.config.scheduler
+        backend_limit = scheduler_config.backend_limits.get(base_url, scheduler_config.backend_concurrency)
+        return f"{persona_config.llm_host}:{base_url}", backend_limit
+
+    def get_embedder(self, persona: str = None) -> BaseModel:
+        """
+        Get the model used to embed texts for the given persona.
+
+        When the embedding cache is enabled the persona's handler is wrapped, so
+        texts that were embedded before never reach the backend again.
+        """
+        if self.warmer is not None:
+            self.warmer.touch(persona)
+        with self._lock:
+            handler = self._get_handler(persona)
+            wrapped_handler, embedder = self._embedders.get(persona, (None, None))
+            if wrapped_handler is not handler:
+                embedder = handler
+                if self.embedding_cache is not None:
+                    embedder = CachedEmbeddingModel(handler, self.embedding_cache)
+                embedder = LeasedModel(embedder, self._get_lease(persona, handler))
+                self._embedders[persona] = (handler, embedder)
+            return embedder
+
+    def get_chat_model(self, persona: str = None) -> BaseModel:
+        """
+        Get the model that answers dialog requests for the given persona.
+
+        With the scheduler enabled, every generation first waits for a slot on its backend
+        and persona. With coalesce_requests, identical concurrent requests share one
+        generation. When the response cache is enabled and the persona has a
+        response_cache_ttl_seconds, identical later requests replay the stored answer instead.
+        """
+        if self.warmer is not None:
+            self.warmer.touch(persona)
+        with self._lock:
+            # Under the lock, so a concurrent reload cannot retire the handler before it is leased
+            handler = self._get_handler(persona)
+            wrapped_handler, chat_model = self._chat_models.get(persona, (None, None))
+            if wrapped_handler is not handler:
+                persona_config = self.config.persona_models[persona]
+                ttl_seconds = persona_config.response_cache_ttl_seconds
+                chat_model = handler
+                # Balanced personas are scheduled per endpoint by their BalancedModel
+                if self.scheduler is not None and len(persona_config.endpoints) <= 1:
+                    base_url = persona_config.endpoints[0].base_url if persona_config.endpoints else persona_config.base_url
+                    backend, backend_limit = self._backend_slot(persona_config, base_url)
+                    chat_model = ScheduledChatModel(chat_model, self.scheduler, persona, backend,
+                                                    backend_limit, persona_config.max_concurrency)
+                if self.single_flight is not None:
+                    chat_model = CoalescedChatModel(chat_model, self.single_flight, persona)
+                if self.response_cache is not None and ttl_seconds > 0:
+                    chat_model = CachedResponseModel(chat_model, self.response_cache, persona, ttl_seconds)
+                chat_model = LeasedModel(chat_model, self._get_lease(persona, handler))
+                self._chat_models[persona] = (handler, chat_model)
+            return chat_model
+
+    def reload(self, config):
+        """
+        Switch to a reloaded config, rebuilding only the handlers whose settings changed.
+
+        The handlers of personas that were changed or removed are retired: later requests
+        get new handlers, while streams already running finish on the old ones, which are
+        closed when their last call ends. Sections in RESTART_SETTINGS apply on restart.
+        """
+        old_config = self.config
+        rebuild_all = any(getattr(old_config, name) != getattr(config, name) for name in HANDLER_SETTINGS)
+        personas = set(old_config.persona_models) | set(config.persona_models)
+        changed = sorted(persona for persona in personas
+                         if rebuild_all or old_config.persona_models.get(persona) != config.persona_models.get(persona))
+        retired = []
+        with self._lock:
+            self.config = config
+            for persona in changed:
+                self._handlers.pop(persona, None)
+                self._embedders.pop(persona, None)
+                self._chat_models.pop(persona, None)
+                balancer = self._balancers.pop(persona, None)
+                if balancer is not None:
+                    self.endpoint_monitor.unwatch(balancer.endpoints)
+                lease = self._leases.pop(persona, None)
+                if lease is not None:
+                    retired.append(lease)
+        for lease in retired:
+            lease.retire()
+
+        if self.warmer is not None and (rebuild_all or changed):
+            # Models that stayed the same are warm already, warming them again is cheap
+            running = self.warmer.running
+            self.warmer.close()
+            self.warmer = ModelWarmer(config, self._create_model) if config.warmup.enabled else None
+            if running and self.warmer is not None:
+                self.warmer.start()
+
+        restart_sections = [name for name in RESTART_SETTINGS if getattr(old_config, name) != getattr(config, name)]
+        if restart_sections:
+            logger.warning(f"Config sections {restart_sections} changed, they apply after a restart")
+        logger.info(f"Applied reloaded config, rebuilt handlers of personas {changed}")
+
+    def start_warmup(self):
+        """Start loading the personas' models in the background, without waiting for them."""
+        if self.warmer is not None:
+            self.warmer.start()
+
+    def readiness(self) -> dict:
+        """Report which models are loaded; the brain serves requests either way."""
+        if self.warmer is None:
+            return {"ready": True, "warm": True, "warming": False, "models": []}
+        return {"ready": True, **self.warmer.status()}
+
+    def _register_metrics(self):
+        """Export the pool, cache and scheduler counters on /metrics, read at scrape time."""
+        registry.callback("artmind_handlers", "Pooled persona handlers", lambda: len(self._handlers))
+        registry.callback("artmind_handler_pool_hits_total", "get_handler calls served by a pooled handler",
+                          lambda: self.pool_hits, metric_type="counter")
+        registry.callback("artmind_handler_pool_misses_total", "get_handler calls that created a handler",
+                          lambda: self.pool_misses, metric_type="counter")
+        if self.response_cache is not None:
+            registry.callback("artmind_response_cache_hits_total", "Dialog requests answered from the response cache",
+                              lambda: self.response_cache.stats()["hits"], metric_type="counter")
+            registry.callback("artmind_response_cache_misses_total", "Dialog requests not found in the response cache",
+                              lambda: self.response_cache.stats()["misses"], metric_type="counter")
+        if self.single_flight is not None:
+            registry.callback("artmind_coalesced_requests_total", "Dialog requests that joined an identical in-flight generation",
+                              lambda: self.single_flight.stats()["joined"], metric_type="counter")
+        if self.scheduler is not None:
+            registry.callback("artmind_queue_depth", "Generations waiting for a scheduler slot",
+                              lambda: self.scheduler.stats()["queue_depth"])
+            registry.callback("artmind_running_generations", "Generations holding a scheduler slot, per backend",
+                              lambda: {(backend,): running for backend, running in self.scheduler.stats()["running"].items()},
+                              labelnames=("backend",))
+            registry.callback("artmind_rejected_requests_total", "Generations rejected by the scheduler as overloaded",
+                              lambda: self.scheduler.stats()["rejected"], metric_type="counter")
+        registry.callback("artmind_endpoint_outstanding", "Requests in flight per balanced endpoint",
+                          lambda: self._endpoint_values("outstanding"), labelnames=("persona", "endpoint"))
+        registry.callback("artmind_endpoint_available", "1 if a balanced endpoint is in rotation",
+                          lambda: self._endpoint_values("available"), labelnames=("persona", "endpoint"))
+        registry.callback("artmind_failovers_total", "Requests retried on another endpoint before their first token",
+                          lambda: {(persona,): balancer.failovers for persona, balancer in list(self._balancers.items())},
+                          labelnames=("persona",), metric_type="counter")
+        registry.callback("artmind_endpoint_errors_total", "Failed requests per balanced endpoint",
+                          lambda: self._endpoint_values("errors"), labelnames=("persona", "endpoint"),
+                          metric_type="counter")
+        if self.warmer is not None:
+            registry.callback("artmind_model_warm", "1 if a model is loaded on its backend by the warmer",
+                              lambda: self.warmer.warm_values() if self.warmer is not None else {},
+                              labelnames=("llm_host", "base_url", "model"))
+
+    def _endpoint_values(self, stat):
+        """Per persona and endpoint values of a balanced endpoint stat, for /metrics."""
+        with self._lock:
+            balancers = list(self._balancers.items())
+        return {(persona, base_url): float(endpoint[stat])
+                for persona, balancer in balancers
+                for base_url, endpoint in balancer.stats()["endpoints"].items()}
+
+    def stats(self) -> dict:
+        """Return handler pool counters for monitoring."""
+        with self._lock:
+            stats = {
+                "handlers": len(self._handlers),
+                "pool_hits": self.pool_hits,
+                "pool_misses": self.pool_misses,
+            }
+        if self.embedding_cache is not None:
+            stats["embedding_cache"] = self.embedding_cache.stats()
+        if self.response_cache is not None:
+            stats["response_cache"] = self.response_cache.stats()
+        if self.single_flight is not None:
+            stats["single_flight"] = self.single_flight.stats()
+        if self.scheduler is not None:
+            stats["scheduler"] = self.scheduler.stats()
+        with self._lock:
+            balancers = list(self._balancers.items())
+        if balancers:
+            stats["load_balancing"] = {persona: balancer.stats() for persona, balancer in balancers}
+        if self.warmer is not None:
+            stats["warmup"] = self.warmer.status()
+        return stats
 
+    def close(self):
+        """Close all pooled handlers and their client connections."""
+        with self._lock:
+            handlers = list(self._handlers.items())
+            self._handlers.clear()
+            self._embedders.clear()
+            self._chat_models.clear()
+            self._balancers.clear()
+        self.endpoint_monitor.close()
+        if self.warmer is not None:
+            self.warmer.close()
 
+        for persona, handler in handlers:
+            try:
+                handler.close()
+            except Exception as e:
+                logger.error(f"Error closing handler for persona {persona}: {str(e)}")
+        logger.info(f"Closed {len(handlers)} pooled handlers")
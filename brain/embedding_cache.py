@@ -0,0 +1,308 @@
+import fcntl
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import numpy as np
+from loguru import logger
+
+from brain.models.base_model import ModelWrapper
+
+KEY_BYTES = 32  # sha256 digest of the text
+
+
+def text_digest(text):
+    """Content address of a text."""
+    return hashlib.sha256(text.encode("utf-8")).digest()
+
+
+class DiskTier:
+    """
+    Append-only on-disk vectors for one (backend, model) namespace.
+
+    vectors.f32 holds float32 rows and keys.bin the matching 32-byte digests, row for row.
+    Vectors are read through a memory map, so lookups return zero-copy views. Writes are
+    appends, and eviction rewrites both files and swaps them in with os.replace, so a
+    reader holding the previous map keeps a valid view. Several processes may share the
+    directory: writers hold an exclusive lock on the lock file and first load rows other
+    processes appended, so row numbers stay in step, and loads hold a shared lock so they
+    never pair one compaction's keys with another's vectors.
+    """
+
+    def __init__(self, path, backend, model, max_entries):
+        self.path = path
+        self.max_entries = max_entries
+        self.backend = backend
+        self.model = model
+        self.dim = None
+        self._lock = threading.RLock()
+        self._index = {}
+        self._ticks = np.zeros(0, dtype=np.int64)  # last access per row, for LRU eviction
+        self._clock = 0
+        self._vectors = None
+        self._mapped_rows = 0
+        self._keys_inode = None
+        os.makedirs(path, exist_ok=True)
+        with self._file_lock(fcntl.LOCK_SH):
+            self._load()
+
+    @property
+    def _vectors_file(self):
+        return os.path.join(self.path, "vectors.f32")
+
+    @property
+    def _keys_file(self):
+        return os.path.join(self.path, "keys.bin")
+
+    @property
+    def _meta_file(self):
+        return os.path.join(self.path, "meta.json")
+
+    @contextmanager
+    def _file_lock(self, operation):
+        """Hold a shared or exclusive lock on the directory, across processes."""
+        with open(os.path.join(self.path, "lock"), "a") as f:
+            fcntl.flock(f, operation)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def __len__(self):
+        return len(self._index)
+
+    def _load(self):
+        """(Re)build the key index and vector map from disk."""
+        self._index = {}
+        self._vectors = None
+        self._mapped_rows = 0
+        if not os.path.exists(self._meta_file):
+            return
+        with open(self._meta_file) as f:
+            self.dim = json.load(f)["dim"]
+
+        keys = np.fromfile(self._keys_file, dtype=np.uint8) if os.path.exists(self._keys_file) else np.zeros(0, np.uint8)
+        vector_rows = os.path.getsize(self._vectors_file) // (4 * self.dim) if os.path.exists(self._vectors_file) else 0
+        # A crash between the two appends can leave one file longer than the other
+        rows = min(len(keys) // KEY_BYTES, vector_rows)
+        keys = keys[:rows * KEY_BYTES].reshape(rows, KEY_BYTES)
+        self._index = {keys[row].tobytes(): row for row in range(rows)}
+        self._ticks = np.arange(rows, dtype=np.int64)
+        self._clock = rows
+        self._keys_inode = os.stat(self._keys_file).st_ino if os.path.exists(self._keys_file) else None
+        self._remap(rows)
+
+    def _remap(self, rows):
+        if rows:
+            self._vectors = np.memmap(self._vectors_file, dtype=np.float32, mode="r", shape=(rows, self.dim))
+        self._mapped_rows = rows
+
+    def _changed_on_disk(self):
+        if not os.path.exists(self._keys_file):
+            return False
+        stat = os.stat(self._keys_file)
+        return stat.st_ino != self._keys_inode or stat.st_size // KEY_BYTES != len(self._index)
+
+    def _refresh(self):
+        """Pick up rows appended, or a compaction done, by another process."""
+        if self._changed_on_disk():
+            with self._lock, self._file_lock(fcntl.LOCK_SH):
+                self._load()
+
+    def get(self, digest):
+        """Return a read-only view of the cached vector, or None."""
+        with self._lock:
+            row = self._index.get(digest)
+            if row is None:
+                return None
+            self._clock += 1
+            self._ticks[row] = self._clock
+            return self._vectors[row]
+
+    def put_many(self, digests, vectors):
+        """Append vectors whose digests are not stored yet."""
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        with self._lock, self._file_lock(fcntl.LOCK_EX):
+            if self._changed_on_disk():
+                # Appends go after the rows other processes wrote since we last loaded
+                self._load()
+            if self.dim is None:
+                self.dim = vectors.shape[1]
+                with open(self._meta_file, "w") as f:
+                    json.dump({"backend": self.backend, "model": self.model, "dim": self.dim}, f)
+            elif vectors.shape[1] != self.dim:
+                logger.warning(f"Skipping disk cache write, dimension {vectors.shape[1]} != {self.dim}")
+                return
+
+            new_rows = [i for i, digest in enumerate(digests) if digest not in self._index]
+            if not new_rows:
+                return
+            # Vectors first, then keys: a key is only visible once its row is on disk
+            with open(self._vectors_file, "ab") as f:
+                f.write(vectors[new_rows].tobytes())
+            with open(self._keys_file, "ab") as f:
+                f.write(b"".join(digests[i] for i in new_rows))
+            if self._keys_inode is None:
+                self._keys_inode = os.stat(self._keys_file).st_ino
+
+            start = len(self._index)
+            self._ticks = np.concatenate([self._ticks, np.zeros(len(new_rows), dtype=np.int64)])
+            for offset, i in enumerate(new_rows):
+                self._clock += 1
+                self._index[digests[i]] = start + offset
+                self._ticks[start + offset] = self._clock
+
+            if len(self._index) > self.max_entries:
+                return self._evict()
+            # Mapped while locked, a compaction by another process could replace the file later
+            self._remap(len(self._index))
+        return 0
+
+    def _evict(self):
+        """Keep the most recently used 90% of max_entries and swap in compacted files."""
+        keep_count = int(self.max_entries * 0.9)
+        rows = len(self._index)
+        keep = np.sort(np.argsort(self._ticks[:rows])[rows - keep_count:])
+        digests = [None] * rows
+        for digest, row in self._index.items():
+            digests[row] = digest
+
+        self._remap(rows)
+        kept_vectors = np.ascontiguousarray(self._vectors[keep])
+        tmp_vectors, tmp_keys = self._vectors_file + ".tmp", self._keys_file + ".tmp"
+        kept_vectors.tofile(tmp_vectors)
+        with open(tmp_keys, "wb") as f:
+            f.write(b"".join(digests[row] for row in keep))
+        os.replace(tmp_vectors, self._vectors_file)
+        os.replace(tmp_keys, self._keys_file)
+
+        self._index = {digests[row]: new_row for new_row, row in enumerate(keep)}
+        self._ticks = self._ticks[keep]
+        self._keys_inode = os.stat(self._keys_file).st_ino
+        self._remap(len(keep))
+        evicted = rows - len(keep)
+        logger.info(f"Evicted {evicted} vectors from disk embedding cache {self.path}")
+        return evicted
+
+
+class EmbeddingCache:
+    """
+    Content-addressed embedding cache keyed by (backend, model, sha256(text)).
+
+    Lookups go through a bounded in-memory LRU first, then the memory-mapped disk tier.
+    """
+
+    def __init__(self, cache_dir, memory_entries=10000, disk_entries=1000000):
+        self.cache_dir = cache_dir
+        self.memory_entries = memory_entries
+        self.disk_entries = disk_entries
+        self._memory = OrderedDict()
+        self._disk_tiers = {}
+        self._lock = threading.Lock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _disk_tier(self, backend, model):
+        namespace = hashlib.sha256(f"{backend}\0{model}".encode("utf-8")).hexdigest()[:16]
+        tier = self._disk_tiers.get(namespace)
+        if tier is None:
+            tier = DiskTier(os.path.join(self.cache_dir, namespace), backend, model, self.disk_entries)
+            self._disk_tiers[namespace] = tier
+        return tier
+
+    def get_many(self, backend, model, digests):
+        """Return a list with the cached vector, or None, for every digest."""
+        results = []
+        refreshed = False
+        with self._lock:
+            tier = self._disk_tier(backend, model)
+            for digest in digests:
+                key = (backend, model, digest)
+                vector = self._memory.get(key)
+                if vector is not None:
+                    self._memory.move_to_end(key)
+                    self.memory_hits += 1
+                else:
+                    vector = tier.get(digest)
+                    if vector is None and not refreshed:
+                        # Another process, e.g. ingestion, may have written it since we loaded the tier;
+                        # a stat per lookup batch is cheap next to the backend call a miss costs
+                        tier._refresh()
+                        refreshed = True
+                        vector = tier.get(digest)
+                    if vector is not None:
+                        self.disk_hits += 1
+                        self._remember(key, vector)
+                    else:
+                        self.misses += 1
+                results.append(vector)
+        return results
+
+    def put_many(self, backend, model, digests, vectors):
+        """Store freshly computed vectors in both tiers."""
+        with self._lock:
+            for digest, vector in zip(digests, vectors):
+                self._remember((backend, model, digest), vector)
+            evicted = self._disk_tier(backend, model).put_many(digests, vectors)
+            self.evictions += evicted or 0
+
+    def _remember(self, key, vector):
+        self._memory[key] = np.array(vector, dtype=np.float32)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def stats(self):
+        """Return hit/miss counters and tier sizes for monitoring."""
+        with self._lock:
+            lookups = self.memory_hits + self.disk_hits + self.misses
+            return {
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "memory_entries": len(self._memory),
+                "disk_entries": sum(len(tier) for tier in self._disk_tiers.values()),
+            }
+
+
+class CachedEmbeddingModel(ModelWrapper):
+    """Wraps a model so embed() only calls the backend for texts not seen before."""
+
+    def __init__(self, base_model, cache):
+        super().__init__(base_model)
+        self.cache = cache
+
+    def embed(self, input_texts, batch_size=None, concurrency=None):
+        if isinstance(input_texts, str):
+            input_texts = [input_texts]
+        if not input_texts:
+            return np.empty((0, 0), dtype=np.float32)
+
+        digests = [text_digest(text) for text in input_texts]
+        cached = self.cache.get_many(self.backend, self.model, digests)
+
+        # Embed each distinct missing text once
+        missing = {}
+        for text, digest, vector in zip(input_texts, digests, cached):
+            if vector is None and digest not in missing:
+                missing[digest] = text
+        if missing:
+            fresh = self.base_model.embed(list(missing.values()), batch_size=batch_size, concurrency=concurrency)
+            self.cache.put_many(self.backend, self.model, list(missing.keys()), fresh)
+            fresh_rows = {digest: row for row, digest in enumerate(missing)}
+        else:
+            fresh = None
+
+        dim = fresh.shape[1] if fresh is not None else len(next(v for v in cached if v is not None))
+        embeddings = np.empty((len(input_texts), dim), dtype=np.float32)
+        for row, (digest, vector) in enumerate(zip(digests, cached)):
+            embeddings[row] = vector if vector is not None else fresh[fresh_rows[digest]]
+        logger.deep_debug("Embedded {} texts with {} backend misses", len(input_texts), len(missing))
+        return embeddings
@@ -0,0 +1,71 @@
+import asyncio
+import concurrent.futures
+import threading
+from loguru import logger
+
+class BackgroundLoop:
+    """A single event loop running in a daemon thread, shared by sync request workers."""
+
+    def __init__(self, name="brain-event-loop"):
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def run(self, coroutine, timeout=None):
+        """Run a coroutine on the shared loop and wait for its result."""
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result(timeout)
+
+    def iterate(self, async_gen, idle_seconds=None, idle_item=None):
+        """
+        Drive an async generator on the shared loop from a sync caller.
+
+        The generator is closed on the loop if the caller stops early, so any
+        upstream stream it holds is released. A step still waiting for its item is
+        cancelled first, which stops the generator wherever it is waiting.
+
+        Args:
+            async_gen: The async generator to drive
+            idle_seconds: Yield idle_item whenever no item arrived for this long, so
+                the caller can notice a client that went away
+            idle_item: The item yielded while idle
+        """
+        step = None
+        try:
+            while True:
+                step = asyncio.run_coroutine_threadsafe(anext(async_gen), self.loop)
+                while True:
+                    try:
+                        item = step.result(idle_seconds)
+                        break
+                    except concurrent.futures.TimeoutError:
+                        yield idle_item
+                    except StopAsyncIteration:
+                        return
+                step = None
+                yield item
+        finally:
+            if step is not None:
+                step.cancel()
+            try:
+                self.run(self._aclose(async_gen))
+            except Exception as e:
+                logger.error(f"Error closing async generator: {str(e)}")
+
+    @staticmethod
+    async def _aclose(async_gen):
+        # A cancelled step unwinds on the loop; the generator can only be closed once it has
+        while async_gen.ag_running:
+            await asyncio.sleep(0.001)
+        await async_gen.aclose()
+
+    def close(self):
+        """Stop the loop and wait for its thread to exit."""
+        if self.loop.is_closed():
+            return
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join(timeout=5)
+        self.loop.close()
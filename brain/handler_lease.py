@@ -0,0 +1,94 @@
+import threading
+from loguru import logger
+from brain.models.base_model import ModelWrapper
+
+
+class HandlerLease:
+    """
+    A persona's handler and the number of calls using it.
+
+    When a config reload replaces the handler, the old one is retired: new requests
+    get the new handler, and the old one is closed once its last call ends, so streams
+    that started before the reload finish on the clients they started on.
+    """
+
+    def __init__(self, persona, handler):
+        self.persona = persona
+        self.handler = handler
+        self.active = 0
+        self.retired = False
+        self._closed = False
+        self._lock = threading.Lock()
+
+    def enter(self):
+        with self._lock:
+            self.active += 1
+
+    def exit(self):
+        with self._lock:
+            self.active -= 1
+            close = self.retired and self.active == 0
+        if close:
+            self._close()
+
+    def retire(self):
+        """Close the handler now if it is idle, otherwise when its last call ends."""
+        with self._lock:
+            self.retired = True
+            close = self.active == 0
+        if close:
+            self._close()
+        else:
+            logger.info(f"Closing the old handler of persona {self.persona} after {self.active} calls end")
+
+    def _close(self):
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+
+        def close():
+            try:
+                self.handler.close()
+                logger.debug(f"Closed retired handler of persona {self.persona}")
+            except Exception as e:
+                logger.error(f"Error closing retired handler of persona {self.persona}: {str(e)}")
+
+        # The last call may end on the event loop, which closing async clients must not block
+        threading.Thread(target=close, name="handler-close", daemon=True).start()
+
+
+class LeasedModel(ModelWrapper):
+    """Wraps the model given out for a persona so every call holds its handler lease."""
+
+    def __init__(self, base_model, lease):
+        super().__init__(base_model)
+        self.lease = lease
+
+    def chat(self, messages, stream=False):
+        # Entered before the stream starts, so a reload in between cannot close the handler
+        self.lease.enter()
+        if stream:
+            return self._leased_stream(messages)
+        try:
+            return self.base_model.chat(messages, stream=False)
+        finally:
+            self.lease.exit()
+
+    async def _leased_stream(self, messages):
+        try:
+            stream = self.base_model.chat(messages, stream=True)
+            try:
+                async for chunk in stream:
+                    yield chunk
+            finally:
+                await stream.aclose()
+        finally:
+            self.lease.exit()
+
+    def embed(self, input_texts, batch_size=None, concurrency=None):
+        self.lease.enter()
+        try:
+            return self.base_model.embed(input_texts, batch_size=batch_size, concurrency=concurrency)
+        finally:
+            self.lease.exit()
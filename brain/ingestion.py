@@ -0,0 +1,393 @@
+import argparse
+import hashlib
+import json
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+import pandas as pd
+import pymupdf
+from loguru import logger
+from pptx import Presentation
+from watchdog.events import FileSystemEventHandler
+from watchdog.observers import Observer
+
+from config.config_setup import init_config
+from config.logging_setup import setup_logging
+from brain.domain_router import DomainRouter
+from brain.vector_index import VectorIndex, open_vector_index
+
+SUPPORTED_SUFFIXES = (".pdf", ".pptx", ".csv")
+CSV_ROWS_PER_READ = 1000
+
+
+# ---------------------------------------------------------
+# Extraction and chunking, run inside the worker processes
+# ---------------------------------------------------------
+def extract_pdf_pages(path, first_page, last_page):
+    """Yield (page_number, text) for a page range, loading one page at a time."""
+    with pymupdf.open(path) as document:
+        for page_number in range(first_page, last_page):
+            yield page_number + 1, document.load_page(page_number).get_text()
+
+
+def extract_pptx_slides(path):
+    """Yield (slide_number, text) for every slide."""
+    for slide_number, slide in enumerate(Presentation(path).slides, start=1):
+        texts = [shape.text_frame.text for shape in slide.shapes if shape.has_text_frame]
+        yield slide_number, "\n".join(texts)
+
+
+def extract_csv_rows(path):
+    """Yield (first_row_number, text) per block of rows, reading the file in chunks."""
+    for block_number, frame in enumerate(pd.read_csv(path, chunksize=CSV_ROWS_PER_READ)):
+        lines = ("; ".join(f"{column}: {value}" for column, value in row.items()) for row in frame.to_dict("records"))
+        yield block_number * CSV_ROWS_PER_READ + 1, "\n".join(lines)
+
+
+def chunk_text(units, chunk_size, chunk_overlap):
+    """
+    Split a stream of (unit_number, text) into overlapping chunks.
+
+    Yields:
+        (unit_number, chunk_text) where unit_number is the page, slide or row the chunk starts in
+    """
+    step = max(1, chunk_size - chunk_overlap)
+    for unit_number, text in units:
+        text = text.strip()
+        for start in range(0, len(text), step):
+            chunk = text[start:start + chunk_size]
+            if chunk.strip():
+                yield unit_number, chunk
+            if start + chunk_size >= len(text):
+                break
+
+
+def extract_task(task):
+    """
+    Parse and chunk one unit of work: a PDF page range or a whole PPTX/CSV file.
+
+    Returns:
+        A dict with the chunks and the time spent in each stage
+    """
+    path, first_page, last_page, chunk_size, chunk_overlap = task
+    units_seen = 0
+    parse_seconds = 0.0
+
+    # Discovery matches suffixes case-insensitively, so REPORT.PDF is a PDF too
+    suffix = os.path.splitext(path)[1].lower()
+    if suffix == ".pdf":
+        units = extract_pdf_pages(path, first_page, last_page)
+    elif suffix == ".pptx":
+        units = extract_pptx_slides(path)
+    else:
+        units = extract_csv_rows(path)
+
+    def timed_units():
+        nonlocal units_seen, parse_seconds
+        iterator = iter(units)
+        while True:
+            start = time.perf_counter()
+            try:
+                unit = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                parse_seconds += time.perf_counter() - start
+            units_seen += 1
+            yield unit
+
+    start = time.perf_counter()
+    chunks = list(chunk_text(timed_units(), chunk_size, chunk_overlap))
+    total_seconds = time.perf_counter() - start
+    return {
+        "path": path,
+        "first_page": first_page,
+        "chunks": chunks,
+        "pages": units_seen,
+        "parse_seconds": parse_seconds,
+        "chunk_seconds": total_seconds - parse_seconds,
+    }
+
+
+# ---------------------------------------------------------
+# Pipeline driven from the brain process
+# ---------------------------------------------------------
+def file_sha256(path, block_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while block := f.read(block_size):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def discover_files(root):
+    """All supported files below root."""
+    for directory, _, files in os.walk(root):
+        for name in sorted(files):
+            if name.lower().endswith(SUPPORTED_SUFFIXES) and not name.startswith("."):
+                yield os.path.join(directory, name)
+
+
+class StageStats:
+    """Units processed and time spent per pipeline stage."""
+
+    def __init__(self):
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def record(self, stage, pages, seconds, items=0):
+        with self._lock:
+            entry = self._stats.setdefault(stage, {"pages": 0, "items": 0, "seconds": 0.0})
+            entry["pages"] += pages
+            entry["items"] += items
+            entry["seconds"] += seconds
+
+    def report(self):
+        with self._lock:
+            return {
+                stage: {**entry, "pages_per_s": entry["pages"] / entry["seconds"] if entry["seconds"] else 0.0}
+                for stage, entry in self._stats.items()
+            }
+
+
+class IndexSink:
+    """Embeds chunks in batches and adds them to the vector index, with chunk texts in a sidecar file."""
+
+    def __init__(self, embedder, index_path, batch_size=256):
+        self.embedder = embedder
+        self.index_path = index_path
+        self.batch_size = batch_size
+        self.index = open_vector_index(index_path)
+        self._pending = []
+
+    def add(self, source, chunks):
+        """Queue chunks of a file and flush full batches."""
+        self._pending.extend((source, unit, text) for unit, text in chunks)
+        while len(self._pending) >= self.batch_size:
+            self.flush(self.batch_size)
+
+    def flush(self, count=None):
+        """Embed and index up to count queued chunks, or all of them."""
+        count = len(self._pending) if count is None else count
+        batch, self._pending = self._pending[:count], self._pending[count:]
+        if not batch:
+            return []
+        vectors = self.embedder.embed([text for _, _, text in batch])
+        if self.index is None:
+            self.index = VectorIndex(vectors.shape[1])
+        ids = self.index.add(vectors, metadata=[{"source": source, "page": unit} for source, unit, _ in batch])
+        # Ids are never reused, so the append-only text log stays valid across re-ingestion
+        os.makedirs(self.index_path, exist_ok=True)
+        with open(os.path.join(self.index_path, "chunks.jsonl"), "a") as f:
+            for chunk_id, (source, unit, text) in zip(ids, batch):
+                f.write(json.dumps({"id": int(chunk_id), "source": source, "page": unit, "text": text}) + "\n")
+        return ids
+
+    def delete_source(self, source):
+        """Remove every chunk of a file from the index."""
+        if self.index is None:
+            return 0
+        return self.index.delete_where({"source": source})
+
+    def save(self):
+        self.flush()
+        if self.index is not None:
+            self.index.save(self.index_path)
+
+
+class IngestionPipeline:
+    """
+    Incremental ingestion of config.file_storage into the vector index.
+
+    Files are hashed and compared with a manifest so only new or changed files are
+    parsed. Parsing and chunking run in a process pool with a bounded number of tasks
+    in flight, and large PDFs are split into page ranges so no task holds a whole
+    document in memory.
+    """
+
+    def __init__(self, root, sink, manifest_path, workers=None, chunk_size=1000,
+                 chunk_overlap=200, pages_per_task=16):
+        self.root = root
+        self.sink = sink
+        self.manifest_path = manifest_path
+        self.workers = workers or os.cpu_count()
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.pages_per_task = pages_per_task
+        self.stats = StageStats()
+        self.manifest = self._load_manifest()
+        self._lock = threading.Lock()
+
+    def _load_manifest(self):
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path) as f:
+                return json.load(f)
+        return {}
+
+    def _save_manifest(self):
+        os.makedirs(os.path.dirname(self.manifest_path) or ".", exist_ok=True)
+        tmp = self.manifest_path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(self.manifest, f, indent=1)
+        os.replace(tmp, self.manifest_path)
+
+    def _relative(self, path):
+        return os.path.relpath(path, self.root)
+
+    def changed_files(self, paths):
+        """Paths whose content hash differs from the manifest, with their new hashes."""
+        start = time.perf_counter()
+        changed = {}
+        for path in paths:
+            digest = file_sha256(path)
+            if self.manifest.get(self._relative(path), {}).get("sha256") != digest:
+                changed[path] = digest
+        self.stats.record("hash", 0, time.perf_counter() - start, items=len(paths))
+        return changed
+
+    def _tasks(self, path, failed):
+        if os.path.splitext(path)[1].lower() == ".pdf":
+            try:
+                with pymupdf.open(path) as document:
+                    page_count = document.page_count
+            except Exception as e:
+                logger.error(f"Skipping unreadable file {path}: {str(e)}")
+                failed.add(path)
+                return
+            for first_page in range(0, page_count, self.pages_per_task):
+                yield (path, first_page, min(first_page + self.pages_per_task, page_count),
+                       self.chunk_size, self.chunk_overlap)
+        else:
+            yield path, 0, 0, self.chunk_size, self.chunk_overlap
+
+    def run(self, paths=None):
+        """Ingest the given files, or every changed file under root."""
+        with self._lock:
+            full_scan = paths is None
+            paths = list(discover_files(self.root)) if full_scan else list(paths)
+            self._forget_missing(paths, full_scan)
+            changed = self.changed_files([path for path in paths if os.path.exists(path)])
+            if not changed:
+                logger.info("Ingestion: no new or changed files")
+                return self.stats.report()
+
+            for path in changed:
+                self.sink.delete_source(self._relative(path))
+
+            chunk_counts = {path: 0 for path in changed}
+            # Files with a failed task keep their old manifest entry, so the next run retries them
+            failed = set()
+            tasks = (task for path in changed for task in self._tasks(path, failed))
+            with ProcessPoolExecutor(max_workers=self.workers) as pool:
+                in_flight = {}
+                for task in tasks:
+                    in_flight[pool.submit(extract_task, task)] = task[0]
+                    if len(in_flight) >= self.workers * 2:
+                        done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                        self._consume(done, in_flight, chunk_counts, failed)
+                self._consume(wait(in_flight)[0], in_flight, chunk_counts, failed)
+
+            start = time.perf_counter()
+            self.sink.save()
+            self.stats.record("save", 0, time.perf_counter() - start)
+            for path, digest in changed.items():
+                if path not in failed:
+                    self.manifest[self._relative(path)] = {"sha256": digest, "chunks": chunk_counts[path]}
+            self._save_manifest()
+
+            report = self.stats.report()
+            logger.info(f"Ingested {len(changed) - len(failed)} files, {len(failed)} failed: {report}")
+            return report
+
+    def _consume(self, futures, in_flight, chunk_counts, failed):
+        for future in futures:
+            path = in_flight.pop(future)
+            try:
+                result = future.result()
+            except Exception as e:
+                logger.error(f"Ingestion task for {path} failed: {str(e)}")
+                failed.add(path)
+                continue
+            self.stats.record("parse", result["pages"], result["parse_seconds"])
+            self.stats.record("chunk", result["pages"], result["chunk_seconds"], items=len(result["chunks"]))
+            start = time.perf_counter()
+            self.sink.add(self._relative(result["path"]), result["chunks"])
+            self.stats.record("embed_index", result["pages"], time.perf_counter() - start, items=len(result["chunks"]))
+            chunk_counts[result["path"]] += len(result["chunks"])
+
+    def _forget_missing(self, paths, full_scan):
+        """Drop manifest entries and chunks of files that no longer exist."""
+        if full_scan:
+            present = {self._relative(path) for path in paths}
+            removed = [name for name in self.manifest if name not in present]
+        else:
+            removed = [self._relative(path) for path in paths if not os.path.exists(path)]
+        for name in removed:
+            if self.manifest.pop(name, None) is not None:
+                self.sink.delete_source(name)
+                logger.info(f"Removed deleted file from index: {name}")
+        if removed:
+            self._save_manifest()
+
+    def watch(self, debounce_seconds=2.0):
+        """Ingest new and modified files as watchdog reports them, until interrupted."""
+        pending = {}  # path -> time of its last event
+        pending_lock = threading.Lock()
+
+        class Handler(FileSystemEventHandler):
+            def on_any_event(self, event):
+                if event.is_directory:
+                    return
+                for path in (event.src_path, getattr(event, "dest_path", "")):
+                    if path and path.lower().endswith(SUPPORTED_SUFFIXES):
+                        with pending_lock:
+                            pending[os.path.abspath(path)] = time.monotonic()
+
+        self.root = os.path.abspath(self.root)
+        self.run()
+        observer = Observer()
+        observer.schedule(Handler(), self.root, recursive=True)
+        observer.start()
+        logger.info(f"Watching {self.root} for changes")
+        try:
+            while True:
+                time.sleep(debounce_seconds / 2)
+                # Only pick up files that have been quiet for a while, so half-written files are skipped
+                quiet_since = time.monotonic() - debounce_seconds
+                with pending_lock:
+                    batch = sorted(path for path, last_event in pending.items() if last_event <= quiet_since)
+                    for path in batch:
+                        del pending[path]
+                if batch:
+                    self.run(batch)
+        finally:
+            observer.stop()
+            observer.join()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Ingest documents from config.file_storage into the vector index")
+    parser.add_argument("--watch", action="store_true", help="Keep running and ingest files as they change")
+    args = parser.parse_args()
+
+    setup_logging()
+    config = init_config()
+    ingestion = config.ingestion
+    router = DomainRouter(config)
+    sink = IndexSink(router.get_embedder(ingestion.embed_persona), config.vector_index_path)
+    pipeline = IngestionPipeline(config.file_storage, sink, ingestion.manifest_path,
+                                 workers=ingestion.workers, chunk_size=ingestion.chunk_size,
+                                 chunk_overlap=ingestion.chunk_overlap, pages_per_task=ingestion.pages_per_task)
+    try:
+        if args.watch:
+            pipeline.watch()
+        else:
+            pipeline.run()
+    finally:
+        router.close()
+
+
+if __name__ == "__main__":
+    main()
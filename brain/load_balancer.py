@@ -0,0 +1,268 @@
+import threading
+import time
+from loguru import logger
+from brain.models.base_model import BaseModel, ModelWrapper
+from brain.scheduler import Overloaded, current_request
+
+
+class Endpoint:
+    """
+    One inference host of a persona, with its load and circuit breaker state.
+
+    After failure_threshold consecutive failures the circuit opens and the endpoint is
+    left out of rotation for open_seconds. After that, a single trial request is let
+    through. A success closes the circuit again, and a failure opens it for another
+    open_seconds. An endpoint that fails its background health check is also left out,
+    until a check passes again.
+    """
+
+    def __init__(self, model, base_url, weight=1.0, failure_threshold=3, open_seconds=30,
+                 backend=None, backend_limit=0):
+        self.model = model
+        self.base_url = base_url
+        # Scheduler key and slots of the host, shared with other personas on it
+        self.backend = backend or base_url
+        self.backend_limit = backend_limit
+        self.weight = weight if weight > 0 else 1.0
+        self.failure_threshold = failure_threshold
+        self.open_seconds = open_seconds
+        self.outstanding = 0
+        self.requests = 0
+        self.errors = 0
+        self.consecutive_failures = 0
+        self.open_until = 0.0
+        self.healthy = True
+
+    def available(self, now):
+        return self.healthy and self.open_until <= now
+
+    def record_success(self):
+        if self.consecutive_failures >= self.failure_threshold:
+            logger.info(f"Endpoint {self.base_url} is back in rotation")
+        self.consecutive_failures = 0
+        self.open_until = 0.0
+
+    def record_failure(self, now):
+        self.errors += 1
+        self.consecutive_failures += 1
+        if self.consecutive_failures >= self.failure_threshold:
+            if self.open_until <= now:
+                logger.warning(f"Endpoint {self.base_url} failed {self.consecutive_failures} times in a row, "
+                               f"taking it out of rotation for {self.open_seconds}s")
+            self.open_until = now + self.open_seconds
+
+    def stats(self) -> dict:
+        return {
+            "outstanding": self.outstanding,
+            "requests": self.requests,
+            "errors": self.errors,
+            "healthy": self.healthy,
+            "available": self.available(time.monotonic()),
+        }
+
+
+class BalancedModel(ModelWrapper):
+    """
+    Spreads a persona's requests over several endpoints of the same model.
+
+    Each request goes to the available endpoint with the fewest outstanding requests
+    relative to its weight. A request that fails before its first token, either by
+    raising or by streaming an error chunk first, is retried on the next best endpoint
+    that has not been tried yet. Once a token has been sent, the stream stays on its
+    endpoint. With a scheduler, each streaming attempt first waits for a slot on its
+    endpoint's host; a request the scheduler turns away is not an endpoint failure.
+    """
+
+    def __init__(self, endpoints, persona, scheduler=None, persona_limit=0):
+        # Endpoints serve the same model, so attributes such as backend come from the first
+        super().__init__(endpoints[0].model)
+        self.endpoints = endpoints
+        self.persona = persona
+        self.scheduler = scheduler
+        self.persona_limit = persona_limit
+        self.failovers = 0
+        self._lock = threading.Lock()
+
+    def _acquire(self, tried):
+        """Reserve the best untried endpoint, or return None if no untried one is available."""
+        now = time.monotonic()
+        with self._lock:
+            candidates = [endpoint for endpoint in self.endpoints
+                          if endpoint not in tried and endpoint.available(now)]
+            if not candidates and not tried:
+                # Every circuit is open; try the least loaded endpoint rather than fail outright
+                candidates = self.endpoints
+            if not candidates:
+                return None
+            endpoint = min(candidates, key=lambda e: ((e.outstanding + 1) / e.weight, e.requests / e.weight))
+            if endpoint.consecutive_failures >= endpoint.failure_threshold:
+                # Half-open: this is the trial request, keep others away until it finishes
+                endpoint.open_until = now + endpoint.open_seconds
+            endpoint.outstanding += 1
+            endpoint.requests += 1
+            return endpoint
+
+    def _release(self, endpoint, succeeded):
+        with self._lock:
+            endpoint.outstanding -= 1
+            if succeeded is True:
+                endpoint.record_success()
+            elif succeeded is False:
+                endpoint.record_failure(time.monotonic())
+
+    def _failover(self, endpoint, tried, error):
+        """Return the next endpoint to retry on, or None."""
+        retry = self._acquire(tried)
+        if retry is not None:
+            with self._lock:
+                self.failovers += 1
+            logger.warning(f"Retrying {self.persona} request on {retry.base_url} after {endpoint.base_url} failed: {error}")
+        return retry
+
+    def chat(self, messages, stream=False):
+        if stream:
+            return self._balanced_chat(messages)
+        return self._call(lambda model: model.chat(messages, stream=False))
+
+    async def _balanced_chat(self, messages):
+        tried = set()
+        endpoint = self._acquire(tried)
+        while endpoint is not None:
+            tried.add(endpoint)
+            retry = None
+            succeeded = None  # unknown if the client goes away mid-stream
+            started = False
+            ticket = None
+            stream = None
+            try:
+                try:
+                    if self.scheduler is not None:
+                        ticket = await self.scheduler.acquire(endpoint.backend, endpoint.backend_limit, self.persona,
+                                                              self.persona_limit, current_request.get())
+                    stream = endpoint.model.chat(messages, stream=True)
+                    async for chunk in stream:
+                        if chunk.get('is_error'):
+                            succeeded = False
+                            if not started:
+                                retry = self._failover(endpoint, tried, chunk['message'])
+                                if retry is not None:
+                                    break
+                        started = True
+                        yield chunk
+                    else:
+                        succeeded = succeeded is not False
+                except Overloaded:
+                    raise
+                except Exception as e:
+                    succeeded = False
+                    if started:
+                        raise
+                    retry = self._failover(endpoint, tried, str(e))
+                    if retry is None:
+                        raise
+            finally:
+                if stream is not None:
+                    await stream.aclose()
+                if ticket is not None:
+                    self.scheduler.release(ticket)
+                self._release(endpoint, succeeded)
+            endpoint = retry
+
+    def _call(self, fn):
+        """Run a blocking call on the best endpoint, retrying failures on the others."""
+        tried = set()
+        endpoint = self._acquire(tried)
+        while True:
+            tried.add(endpoint)
+            try:
+                result = fn(endpoint.model)
+            except Exception as e:
+                self._release(endpoint, False)
+                endpoint = self._failover(endpoint, tried, str(e))
+                if endpoint is None:
+                    raise
+                continue
+            self._release(endpoint, True)
+            return result
+
+    def embed(self, input_texts, batch_size=None, concurrency=None):
+        # Batched here, so each batch goes to the best endpoint and fails over on its own
+        return BaseModel.embed(self, input_texts, batch_size=batch_size, concurrency=concurrency)
+
+    def _embed_batch(self, input_texts):
+        return self._call(lambda model: model._embed_batch(input_texts))
+
+    def warm(self):
+        for endpoint in self.endpoints:
+            endpoint.model.warm()
+
+    def health_check(self, timeout):
+        """Raise if none of the endpoints can be reached."""
+        error = None
+        for endpoint in self.endpoints:
+            try:
+                endpoint.model.health_check(timeout)
+                return
+            except Exception as e:
+                error = e
+        raise error
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "failovers": self.failovers,
+                "endpoints": {endpoint.base_url: endpoint.stats() for endpoint in self.endpoints},
+            }
+
+    def close(self):
+        for endpoint in self.endpoints:
+            endpoint.model.close()
+
+
+class EndpointMonitor:
+    """Checks the health of every watched endpoint from a background thread."""
+
+    def __init__(self, interval_seconds=10, timeout_seconds=2):
+        self.interval_seconds = interval_seconds
+        self.timeout_seconds = timeout_seconds
+        self._endpoints = []
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def watch(self, endpoints):
+        with self._lock:
+            self._endpoints.extend(endpoints)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="endpoint-monitor", daemon=True)
+                self._thread.start()
+
+    def unwatch(self, endpoints):
+        with self._lock:
+            self._endpoints = [endpoint for endpoint in self._endpoints if endpoint not in endpoints]
+
+    def check(self, endpoint):
+        try:
+            endpoint.model.health_check(self.timeout_seconds)
+        except Exception as e:
+            if endpoint.healthy:
+                logger.warning(f"Health check of {endpoint.base_url} failed: {str(e)}")
+            endpoint.healthy = False
+            return
+        if not endpoint.healthy:
+            logger.info(f"Health check of {endpoint.base_url} passed again")
+        endpoint.healthy = True
+
+    def _run(self):
+        while not self._stop_event.wait(self.interval_seconds):
+            with self._lock:
+                endpoints = list(self._endpoints)
+            for endpoint in endpoints:
+                if self._stop_event.is_set():
+                    return
+                self.check(endpoint)
+
+    def close(self):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.timeout_seconds + 1)
@@ -0,0 +1,323 @@
+import threading
+import time
+from bisect import bisect_left
+from loguru import logger
+from brain.models.base_model import BaseModel, ModelWrapper, Overloaded
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Seconds, from a cached reply to a long generation on a busy backend
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+# Seconds between streamed tokens
+TOKEN_GAP_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labelnames, labelvalues, extra=""):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, labelvalues)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    """A named metric with one child per combination of label values."""
+
+    type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+
+    def labels(self, *labelvalues):
+        """Return the child for these label values; keep it to skip the lookup on hot paths."""
+        child = self._children.get(labelvalues)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(labelvalues, self._new_child())
+        return child
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        for labelvalues, child in list(self._children.items()):
+            lines.extend(self._render_child(labelvalues, child))
+        return lines
+
+
+class _CounterChild:
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def _render_child(self, labelvalues, child):
+        yield f"{self.name}{_format_labels(self.labelnames, labelvalues)} {_format_value(child.value)}"
+
+
+class _HistogramChild:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # per bucket, the last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+    def observe_many(self, values):
+        """Record several observations under one lock, e.g. the token gaps of a finished stream."""
+        indexes = [bisect_left(self.buckets, value) for value in values]
+        with self._lock:
+            for index in indexes:
+                self.counts[index] += 1
+            self.sum += sum(values)
+            self.count += len(values)
+
+    def snapshot(self):
+        with self._lock:
+            return list(self.counts), self.sum, self.count
+
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def _render_child(self, labelvalues, child):
+        counts, total, count = child.snapshot()
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+            cumulative += bucket_count
+            le = f'le="{_format_value(float(bound))}"'
+            yield f"{self.name}_bucket{_format_labels(self.labelnames, labelvalues, le)} {cumulative}"
+        yield f"{self.name}_sum{_format_labels(self.labelnames, labelvalues)} {_format_value(total)}"
+        yield f"{self.name}_count{_format_labels(self.labelnames, labelvalues)} {count}"
+
+
+class CallbackMetric(_Metric):
+    """
+    A gauge or counter read from a callback at scrape time, for values other parts of the
+    brain already keep, such as scheduler queue depth or cache hits.
+
+    The callback returns a number, or a dict from label value tuples to numbers.
+    """
+
+    def __init__(self, name, documentation, callback, labelnames=(), metric_type="gauge"):
+        super().__init__(name, documentation, labelnames)
+        self.callback = callback
+        self.type = metric_type
+
+    def render(self):
+        try:
+            values = self.callback()
+        except Exception as e:
+            logger.warning(f"Could not collect metric {self.name}: {str(e)}")
+            return []
+        if not isinstance(values, dict):
+            values = {(): values}
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        for labelvalues, value in values.items():
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labelvalues)} {_format_value(value)}")
+        return lines
+
+
+class MetricsRegistry:
+    """Metrics of this process, rendered in the Prometheus text format."""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        """Add a metric, replacing any earlier one of the same name."""
+        with self._lock:
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self.register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def callback(self, name, documentation, callback, labelnames=(), metric_type="gauge"):
+        return self.register(CallbackMetric(name, documentation, callback, labelnames, metric_type))
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+MODEL_LABELS = ("persona", "backend", "model")
+
+REQUEST_SECONDS = registry.histogram(
+    "artmind_request_seconds", "Dialog request latency, from receipt to the end of the response",
+    ("persona", "status"))
+TIME_TO_FIRST_TOKEN_SECONDS = registry.histogram(
+    "artmind_time_to_first_token_seconds", "Time from a streaming chat call to its first token", MODEL_LABELS)
+INTER_TOKEN_SECONDS = registry.histogram(
+    "artmind_inter_token_seconds", "Time between consecutive streamed tokens", MODEL_LABELS, buckets=TOKEN_GAP_BUCKETS)
+STREAM_SECONDS = registry.histogram(
+    "artmind_stream_seconds", "Duration of streaming chat calls", MODEL_LABELS)
+MODEL_CALL_SECONDS = registry.histogram(
+    "artmind_model_call_seconds", "Duration of non-streaming model calls", MODEL_LABELS + ("operation",))
+TOKENS = registry.counter(
+    "artmind_tokens_total", "Streamed tokens, one per backend chunk", MODEL_LABELS)
+EMBEDDED_TEXTS = registry.counter(
+    "artmind_embedded_texts_total", "Texts sent to the backend for embedding", MODEL_LABELS)
+MODEL_ERRORS = registry.counter(
+    "artmind_model_errors_total", "Model calls that failed or streamed an error", MODEL_LABELS + ("operation",))
+FALLBACKS = registry.counter(
+    "artmind_fallback_responses_total", "Streams answered with the default response because the model produced none",
+    MODEL_LABELS)
+CANCELLED_STREAMS = registry.counter(
+    "artmind_cancelled_streams_total", "Streams stopped before the end because nobody was reading them", MODEL_LABELS)
+TOKENS_SAVED = registry.counter(
+    "artmind_tokens_saved_total",
+    "Estimated tokens not generated thanks to cancelled streams, from the average length of complete answers",
+    MODEL_LABELS)
+QUEUE_WAIT_SECONDS = registry.histogram(
+    "artmind_queue_wait_seconds", "Time generations waited for a scheduler slot", ("backend", "priority"))
+
+
+def observe_request(persona, status, started):
+    """Record a dialog request that started at time.perf_counter() value `started`."""
+    REQUEST_SECONDS.labels(persona, str(status)).observe(time.perf_counter() - started)
+
+
+class InstrumentedModel(ModelWrapper):
+    """Wraps a persona's handler so its chat and embed calls are timed and counted."""
+
+    def __init__(self, base_model, persona):
+        super().__init__(base_model)
+        self.persona = persona
+        labels = (persona, self.backend, self.model)
+        # Children resolved once, so a stream only pays for the clock reads
+        self._ttft = TIME_TO_FIRST_TOKEN_SECONDS.labels(*labels)
+        self._gaps = INTER_TOKEN_SECONDS.labels(*labels)
+        self._stream = STREAM_SECONDS.labels(*labels)
+        self._chat_call = MODEL_CALL_SECONDS.labels(*labels, "chat")
+        self._embed_call = MODEL_CALL_SECONDS.labels(*labels, "embed")
+        self._tokens = TOKENS.labels(*labels)
+        self._embedded = EMBEDDED_TEXTS.labels(*labels)
+        self._chat_errors = MODEL_ERRORS.labels(*labels, "chat")
+        self._embed_errors = MODEL_ERRORS.labels(*labels, "embed")
+        self._fallbacks = FALLBACKS.labels(*labels)
+        self._cancelled = CANCELLED_STREAMS.labels(*labels)
+        self._tokens_saved = TOKENS_SAVED.labels(*labels)
+        self._average_tokens = None  # moving average of complete answers, to estimate tokens saved
+
+    def chat(self, messages, stream=False):
+        if stream:
+            return self._instrumented_stream(messages)
+        started = time.perf_counter()
+        try:
+            return self.base_model.chat(messages, stream=False)
+        except Exception:
+            self._chat_errors.inc()
+            raise
+        finally:
+            self._chat_call.observe(time.perf_counter() - started)
+
+    async def _instrumented_stream(self, messages):
+        started = last = time.perf_counter()
+        gaps = []
+        tokens = 0
+        failed = False
+        finished = False
+        rejected = False
+        stream = self.base_model.chat(messages, stream=True)
+        try:
+            async for chunk in stream:
+                if chunk.get('is_error'):
+                    failed = True
+                elif chunk.get('is_fallback'):
+                    self._fallbacks.inc()
+                elif chunk.get('is_chunk'):
+                    now = time.perf_counter()
+                    if tokens:
+                        gaps.append(now - last)
+                    else:
+                        self._ttft.observe(now - started)
+                    tokens += 1
+                    last = now
+                yield chunk
+            finished = True
+        except Exception as e:
+            # A balanced persona waits for its scheduler slot inside the handler,
+            # and a request turned away never reached the model
+            rejected = isinstance(e, Overloaded)
+            failed = not rejected
+            raise
+        finally:
+            await stream.aclose()
+            if finished and not failed and tokens:
+                self._average_tokens = tokens if self._average_tokens is None else 0.9 * self._average_tokens + 0.1 * tokens
+            elif not finished and not failed and not rejected:
+                # The client went away or stopped the generation
+                self._cancelled.inc()
+                if self._average_tokens is not None and self._average_tokens > tokens:
+                    self._tokens_saved.inc(round(self._average_tokens - tokens))
+            # Recorded once per stream, not per token
+            if gaps:
+                self._gaps.observe_many(gaps)
+            if tokens:
+                self._tokens.inc(tokens)
+            if failed:
+                self._chat_errors.inc()
+            if not rejected:
+                self._stream.observe(time.perf_counter() - started)
+
+    def embed(self, input_texts, batch_size=None, concurrency=None):
+        # Batched here rather than by the wrapped model, so every backend call goes through _embed_batch
+        return BaseModel.embed(self, input_texts, batch_size=batch_size, concurrency=concurrency)
+
+    def _embed_batch(self, input_texts):
+        # BaseModel.embed batches the texts, so every backend call is timed here
+        started = time.perf_counter()
+        try:
+            return self.base_model._embed_batch(input_texts)
+        except Exception:
+            self._embed_errors.inc()
+            raise
+        finally:
+            self._embed_call.observe(time.perf_counter() - started)
+            self._embedded.inc(len(input_texts))
@@ -4,16 +4,20 @@ from brain.models.ollama_model import OllamaModel
 class ModelFactory:
     @staticmethod
     def create(llm_host, **kwargs):
+        embed_kwargs = {key: kwargs[key] for key in ("embed_batch_size", "embed_concurrency") if kwargs.get(key)}
         if llm_host == "openai":
             return OpenAIModel(
                 base_url=kwargs.get("base_url"),                
                 model=kwargs.get("model"),
-                api_key=kwargs.get("api_key")
+                api_key=kwargs.get("api_key"),
+                **embed_kwargs
             )
         elif llm_host == "ollama":
             return OllamaModel(
                 base_url=kwargs.get("base_url"),                
-                model=kwargs.get("model")
+                model=kwargs.get("model"),
+                keep_alive=kwargs.get("keep_alive"),
+                **embed_kwargs
             )
         else:
             raise ValueError(f"Unsupported backend: {llm_host}")
@@ -1,10 +1,129 @@
 from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from loguru import logger
+
+DEFAULT_EMBED_BATCH_SIZE = 64
+DEFAULT_EMBED_CONCURRENCY = 4
 
 class BaseModel(ABC):
+    embed_batch_size = DEFAULT_EMBED_BATCH_SIZE
+    embed_concurrency = DEFAULT_EMBED_CONCURRENCY
+
     @abstractmethod
     def chat(self, messages, stream=False):
         pass
 
     @abstractmethod
-    def embed(self, input_texts):
+    def _embed_batch(self, input_texts):
+        """Embed one batch of texts with a single backend call, returning one vector per text."""
+        pass
+
+    def embed(self, input_texts, batch_size=None, concurrency=None):
+        """
+        Embed texts in batches with a bounded number of concurrent backend calls.
+
+        Args:
+            input_texts: A string or a list of strings
+            batch_size: Texts per backend call, defaults to the model's embed_batch_size
+            concurrency: Maximum backend calls in flight, defaults to the model's embed_concurrency
+
+        Returns:
+            A contiguous float32 matrix with one row per input text, in input order
+        """
+        if isinstance(input_texts, str):
+            input_texts = [input_texts]
+        batch_size = batch_size or self.embed_batch_size
+        concurrency = concurrency or self.embed_concurrency
+
+        batches = [input_texts[i:i + batch_size] for i in range(0, len(input_texts), batch_size)]
+        if not batches:
+            return np.empty((0, 0), dtype=np.float32)
+
+        if len(batches) == 1 or concurrency <= 1:
+            results = map(self._embed_batch, batches)
+            embeddings = self._stack_batches(results, len(input_texts))
+        else:
+            with ThreadPoolExecutor(max_workers=min(concurrency, len(batches))) as pool:
+                embeddings = self._stack_batches(pool.map(self._embed_batch, batches), len(input_texts))
+
+        logger.deep_debug("Generated {} embeddings of dimension {} in {} batches", embeddings.shape[0], embeddings.shape[1], len(batches))
+        return embeddings
+
+    @staticmethod
+    def _stack_batches(results, total):
+        """Copy ordered batch results into one preallocated float32 matrix."""
+        embeddings = None
+        row = 0
+        for vectors in results:
+            batch = np.asarray(vectors, dtype=np.float32)
+            if embeddings is None:
+                embeddings = np.empty((total, batch.shape[1]), dtype=np.float32)
+            embeddings[row:row + len(batch)] = batch
+            row += len(batch)
+        return embeddings
+
+    def warm(self):
+        """Load the model on the backend, so the first request does not pay for it."""
+        pass
+
+    def health_check(self, timeout):
+        """Raise if the backend cannot be reached within timeout seconds."""
+        pass
+
+    def close(self):
+        """Release any pooled connections held by the model."""
         pass
+
+
+class Overloaded(Exception):
+    """The request was not admitted; the client should retry after retry_after seconds."""
+
+    def __init__(self, reason, retry_after):
+        super().__init__(f"{reason}, retry after {retry_after}s")
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class ModelWrapper(BaseModel):
+    """
+    Base for models that add behaviour around another model.
+
+    Calls a wrapper does not override go to the wrapped model, and so do attributes it
+    does not set, such as backend and model, so wrappers can be stacked in any order.
+    """
+
+    def __init__(self, base_model):
+        self.base_model = base_model
+
+    def __getattr__(self, name):
+        # Only reached for attributes the wrapper does not have itself
+        if name == "base_model":
+            raise AttributeError(name)
+        return getattr(self.base_model, name)
+
+    @property
+    def embed_batch_size(self):
+        return self.base_model.embed_batch_size
+
+    @property
+    def embed_concurrency(self):
+        return self.base_model.embed_concurrency
+
+    def chat(self, messages, stream=False):
+        return self.base_model.chat(messages, stream=stream)
+
+    def _embed_batch(self, input_texts):
+        return self.base_model._embed_batch(input_texts)
+
+    def embed(self, input_texts, batch_size=None, concurrency=None):
+        return self.base_model.embed(input_texts, batch_size=batch_size, concurrency=concurrency)
+
+    def warm(self):
+        self.base_model.warm()
+
+    def health_check(self, timeout):
+        self.base_model.health_check(timeout)
+
+    def close(self):
+        self.base_model.close()
@@ -1,70 +1,119 @@
+import asyncio
+import threading
+import weakref
+import httpx
 import ollama
-from brain.models.base_model import BaseModel
+from brain.models.base_model import BaseModel, DEFAULT_EMBED_BATCH_SIZE, DEFAULT_EMBED_CONCURRENCY
 from loguru import logger
+from config.logging_setup import LogSampler, log_enabled
+
+# Connection pool limits shared by the sync and async clients of a model instance
+POOL_LIMITS = httpx.Limits(max_connections=100, max_keepalive_connections=20, keepalive_expiry=60)
 
 class OllamaModel(BaseModel):
-    def __init__(self, base_url="http://localhost:11434", model="llama3.2"):
+    backend = "ollama"
+
+    def __init__(self, base_url="http://localhost:11434", model="llama3.2",
+                 embed_batch_size=DEFAULT_EMBED_BATCH_SIZE, embed_concurrency=DEFAULT_EMBED_CONCURRENCY,
+                 keep_alive=None):
         self.base_url = base_url
-        self.client = ollama.Client(host=base_url)
+        self.client = ollama.Client(host=base_url, limits=POOL_LIMITS)
         self.model = model
+        # Seconds Ollama keeps the model loaded after each request, None uses the server default
+        self.keep_alive = keep_alive
+        self.embed_batch_size = embed_batch_size
+        self.embed_concurrency = embed_concurrency
+        # httpx async connections are bound to the event loop that opened them,
+        # so one pooled async client is kept per loop
+        self._async_clients = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+
+    def _get_async_client(self):
+        """Return the pooled async client for the running event loop."""
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            async_client = self._async_clients.get(loop)
+            if async_client is None:
+                async_client = ollama.AsyncClient(host=self.base_url, limits=POOL_LIMITS)
+                self._async_clients[loop] = async_client
+        return async_client
 
     async def _async_chat(self, messages):
         """Async method to handle streaming responses"""
+        stream = None
         try:
-            self._has_yielded = False  # Initialize the flag
-            async_client = ollama.AsyncClient(host=self.base_url)
-            async for chunk in await async_client.chat(
+            # Per stream, since concurrent streams share this pooled instance
+            has_yielded = False
+            async_client = self._get_async_client()
+            # Checked once per stream; per-chunk events are sampled and formatted only when emitted
+            sample = LogSampler() if log_enabled("DEEPDEBUG") else None
+            stream = await async_client.chat(
                 model=self.model,
                 messages=messages,
-                stream=True
-            ):
-                logger.deep_debug(f"Received chunk from Ollama: {chunk}")
+                stream=True,
+                keep_alive=self.keep_alive
+            )
+            async for chunk in stream:
+                if sample is not None and sample():
+                    logger.deep_debug("Received chunk {} from Ollama: {}", sample.count, chunk)
                 if 'message' in chunk and chunk['message'].get('content'):
                     content = chunk['message']['content']
-                    logger.deep_debug(f"Yielding content: {content}")
-                    self._has_yielded = True  # Set flag when content is yielded
+                    has_yielded = True
                     yield {'message': content, 'is_chunk': True}
                 elif chunk.get('done', False):
                     # If we're done and haven't yielded anything, yield a default response
-                    if not self._has_yielded:
+                    if not has_yielded:
                         logger.warning("No content was yielded before done signal, sending default response")
-                        yield {'message': "I apologize, but I couldn't generate a valid response. Please try rephrasing your question.", 'is_chunk': True}
+                        yield {'message': "I apologize, but I couldn't generate a valid response. Please try rephrasing your question.", 'is_chunk': True, 'is_fallback': True}
         except Exception as e:
             logger.error(f"Error in _async_chat: {str(e)}")
-            yield {'message': f"Error generating response: {str(e)}", 'is_chunk': True}
+            yield {'message': f"Error generating response: {str(e)}", 'is_chunk': True, 'is_error': True}
+        finally:
+            # Closing the response drops the connection, which makes Ollama stop generating
+            if stream is not None:
+                await stream.aclose()
 
     def chat(self, messages, stream=False):
         if stream:
-            logger.deep_debug(f"Sending streaming request to model: {self.model}")
+            logger.deep_debug("Sending streaming request to model: {}", self.model)
             # Return async generator for streaming
             return self._async_chat(messages)        
         else:
-            logger.deep_debug(f"Sending non-streaming request to model: {self.model}")
-            logger.deep_debug(f"Messages sent: {messages}")
+            logger.deep_debug("Sending non-streaming request to model: {}", self.model)
+            logger.deep_debug("Messages sent: {}", messages)
             response = self.client.chat(
                 model=self.model,
                 messages=messages,
-                stream=False
+                stream=False,
+                keep_alive=self.keep_alive
             )
-            logger.deep_debug(f"Response received: {response}")
+            logger.deep_debug("Response received: {}", response)
             return {'message': {'role': 'assistant', 'content': response['message']['content']}}
 
-    def embed(self, input_texts):
-        if isinstance(input_texts, str):
-            input_texts = [input_texts]
+    def _embed_batch(self, input_texts):
+        # Multi-input embed endpoint on the configured host, one round trip per batch
+        response = self.client.embed(model=self.model, input=input_texts, keep_alive=self.keep_alive)
+        return response["embeddings"]
 
-        embeddings = []
-        for text in input_texts:
-            response = ollama.embeddings(
-                model=self.model,
-                prompt=text
-            )
-            embeddings.append(response["embedding"])
-        
-        # Log some debugging info
-        if embeddings:
-            logger.deep_debug(f"Generated {len(embeddings)} embeddings")
-            logger.deep_debug(f"Embedding dimension: {len(embeddings[0])}")
-            logger.deep_debug(f"Sample values: {embeddings[0][:5]}") 
-        
-        return embeddings
\ No newline at end of file
+    def warm(self):
+        """Load the model into memory; a request without a prompt only loads it."""
+        self.client.generate(model=self.model, keep_alive=self.keep_alive)
+
+    def health_check(self, timeout):
+        """Raise if the Ollama server cannot be reached within timeout seconds."""
+        self.client._client.get("/api/version", timeout=timeout).raise_for_status()
+
+    def close(self):
+        """Close the pooled sync and async clients."""
+        self.client._client.close()
+        with self._lock:
+            async_clients = list(self._async_clients.items())
+            self._async_clients.clear()
+        for loop, async_client in async_clients:
+            if loop.is_closed():
+                continue
+            if loop.is_running():
+                # Loop is owned by another thread, e.g. the shared background loop
+                asyncio.run_coroutine_threadsafe(async_client._client.aclose(), loop).result(timeout=5)
+            else:
+                loop.run_until_complete(async_client._client.aclose())
@@ -1,46 +1,117 @@
+import asyncio
+import threading
+import weakref
+import httpx
 import openai
-from .base_model import BaseModel
+from .base_model import BaseModel, DEFAULT_EMBED_BATCH_SIZE, DEFAULT_EMBED_CONCURRENCY
 from loguru import logger
+from config.logging_setup import LogSampler, log_enabled
 
-# ToDo: Rewrite this once the ollama_model.py is tested
+# Connection pool limits shared by the sync and async clients of a model instance
+POOL_LIMITS = httpx.Limits(max_connections=100, max_keepalive_connections=20, keepalive_expiry=60)
+
+# OpenAI-compatible local servers usually ignore the key, but the client requires one
+LOCAL_API_KEY = "not-needed"
 
 class OpenAIModel(BaseModel):
-    def __init__(self, base_url, model, api_key):
-        if api_key is None:
-            raise ValueError("OpenAI API key is required.")
-        openai.api_key = api_key
+    backend = "openai"
+
+    def __init__(self, base_url, model, api_key,
+                 embed_batch_size=DEFAULT_EMBED_BATCH_SIZE, embed_concurrency=DEFAULT_EMBED_CONCURRENCY):
+        if not api_key:
+            if not base_url:
+                raise ValueError("OpenAI API key is required.")
+            api_key = LOCAL_API_KEY
+        # Per-instance clients, so personas with different keys or servers never share settings
+        self.base_url = base_url or None
+        self.api_key = api_key
+        self.client = openai.OpenAI(api_key=api_key, base_url=self.base_url,
+                                    http_client=openai.DefaultHttpxClient(limits=POOL_LIMITS))
         self.model = model
-        if base_url:
-            openai.base_url = base_url 
+        self.embed_batch_size = embed_batch_size
+        self.embed_concurrency = embed_concurrency
+        # httpx async connections are bound to the event loop that opened them,
+        # so one pooled async client is kept per loop
+        self._async_clients = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+
+    def _get_async_client(self):
+        """Return the pooled async client for the running event loop."""
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            async_client = self._async_clients.get(loop)
+            if async_client is None:
+                async_client = openai.AsyncOpenAI(api_key=self.api_key, base_url=self.base_url,
+                                                  http_client=openai.DefaultAsyncHttpxClient(limits=POOL_LIMITS))
+                self._async_clients[loop] = async_client
+        return async_client
+
+    async def _async_chat(self, messages):
+        """Async method to handle streaming responses"""
+        try:
+            has_yielded = False
+            async_client = self._get_async_client()
+            # Checked once per stream; per-chunk events are sampled and formatted only when emitted
+            sample = LogSampler() if log_enabled("DEEPDEBUG") else None
+            stream = await async_client.chat.completions.create(
+                model=self.model,
+                messages=messages,
+                stream=True
+            )
+            async with stream:
+                async for chunk in stream:
+                    if sample is not None and sample():
+                        logger.deep_debug("Received chunk {} from OpenAI: {}", sample.count, chunk)
+                    # Usage-only chunks of some servers have no choices
+                    content = chunk.choices[0].delta.content if chunk.choices else None
+                    if content:
+                        has_yielded = True
+                        yield {'message': content, 'is_chunk': True}
+            if not has_yielded:
+                logger.warning("No content was yielded before the stream ended, sending default response")
+                yield {'message': "I apologize, but I couldn't generate a valid response. Please try rephrasing your question.", 'is_chunk': True, 'is_fallback': True}
+        except Exception as e:
+            logger.error(f"Error in _async_chat: {str(e)}")
+            yield {'message': f"Error generating response: {str(e)}", 'is_chunk': True, 'is_error': True}
 
     def chat(self, messages, stream=False):
-        response = openai.ChatCompletion.create(
-            model=self.model,
-            messages=messages,
-            stream=stream
-        )
         if stream:
-            full_response = ""
-            for chunk in response:
-                content = chunk.choices[0].delta.get("content", "")
-                print(content, end="", flush=True)
-                full_response += content
-            print()
-            return full_response
+            logger.deep_debug("Sending streaming request to model: {}", self.model)
+            # Return async generator for streaming
+            return self._async_chat(messages)
         else:
-            return response.choices[0].message["content"]
-        
+            logger.deep_debug("Sending non-streaming request to model: {}", self.model)
+            logger.deep_debug("Messages sent: {}", messages)
+            response = self.client.chat.completions.create(
+                model=self.model,
+                messages=messages,
+                stream=False
+            )
+            logger.deep_debug("Response received: {}", response)
+            return {'message': {'role': 'assistant', 'content': response.choices[0].message.content or ""}}
 
-    def embed(self, input_texts):
-        if isinstance(input_texts, str):
-            input_texts = [input_texts]
-        response = openai.Embedding.create(
+    def _embed_batch(self, input_texts):
+        response = self.client.embeddings.create(
             model=self.model,
             input=input_texts
         )
-        embeddings = [item["embedding"] for item in response["data"]]
-        if embeddings:
-            logger.deep_debug(f"Generated {len(embeddings)} embeddings")
-            logger.deep_debug(f"Embedding dimension: {len(embeddings[0])}")
-            logger.deep_debug(f"Sample values: {embeddings[0][:5]}") 
-        return embeddings
+        return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+
+    def health_check(self, timeout):
+        """Raise if the server cannot be reached within timeout seconds."""
+        self.client.with_options(timeout=timeout, max_retries=0).models.list()
+
+    def close(self):
+        """Close the pooled sync and async clients."""
+        self.client.close()
+        with self._lock:
+            async_clients = list(self._async_clients.items())
+            self._async_clients.clear()
+        for loop, async_client in async_clients:
+            if loop.is_closed():
+                continue
+            if loop.is_running():
+                # Loop is owned by another thread, e.g. the shared background loop
+                asyncio.run_coroutine_threadsafe(async_client.close(), loop).result(timeout=5)
+            else:
+                loop.run_until_complete(async_client.close())
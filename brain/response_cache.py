@@ -0,0 +1,212 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from loguru import logger
+from brain.models.base_model import ModelWrapper
+
+# Characters per SSE chunk when a cached answer is replayed
+REPLAY_CHUNK_CHARS = 256
+
+
+def response_key(persona, model, messages):
+    """Canonical hash of a chat request, insensitive to dict key order and whitespace in the JSON."""
+    canonical = json.dumps(
+        [persona, model, [[m.get("role"), m.get("content")] for m in messages]],
+        ensure_ascii=False, separators=(",", ":")
+    )
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """
+    Exact-match cache of complete chat answers, keyed by response_key.
+
+    Entries expire after the TTL given when they are stored. An in-memory LRU is bounded
+    by entry count and bytes; with a cache_dir, entries also go to one small JSON file
+    each, so answers survive restarts and are shared by processes on the same host.
+    """
+
+    def __init__(self, memory_entries=1000, memory_bytes=64 * 1024 * 1024, cache_dir=None, disk_bytes=1024 * 1024 * 1024):
+        self.memory_entries = memory_entries
+        self.memory_bytes = memory_bytes
+        self.cache_dir = cache_dir
+        self.disk_bytes = disk_bytes
+        self._memory = OrderedDict()  # key -> (answer, expires_at)
+        self._memory_size = 0
+        self._disk_size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.bytes_saved = 0
+        self.evictions = 0
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+            self._disk_size = sum(size for _, size, _ in self._disk_files())
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key[:2], f"{key}.json")
+
+    def _disk_files(self):
+        """Yield (path, size, mtime) of every stored entry."""
+        for entry in os.scandir(self.cache_dir):
+            if entry.is_dir():
+                for file in os.scandir(entry.path):
+                    stat = file.stat()
+                    yield file.path, stat.st_size, stat.st_mtime
+
+    def get(self, key):
+        """Return the cached answer, or None if it is missing or expired."""
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None and entry[1] <= now:
+                self._forget(key)
+                entry = None
+            if entry is None and self.cache_dir:
+                entry = self._read_disk(key, now)
+                if entry is not None:
+                    self._remember(key, *entry)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._memory.move_to_end(key)
+            self.hits += 1
+            self.bytes_saved += len(entry[0].encode("utf-8"))
+            return entry[0]
+
+    def put(self, key, answer, ttl_seconds):
+        """Store a complete answer for ttl_seconds."""
+        if ttl_seconds <= 0 or not answer:
+            return
+        expires_at = time.time() + ttl_seconds
+        with self._lock:
+            self._remember(key, answer, expires_at)
+            if self.cache_dir:
+                self._write_disk(key, answer, expires_at)
+
+    def _remember(self, key, answer, expires_at):
+        if key in self._memory:
+            self._forget(key)
+        self._memory[key] = (answer, expires_at)
+        self._memory_size += len(answer)
+        while self._memory and (len(self._memory) > self.memory_entries or self._memory_size > self.memory_bytes):
+            old_key, (old_answer, _) = self._memory.popitem(last=False)
+            self._memory_size -= len(old_answer)
+            self.evictions += 1
+
+    def _forget(self, key):
+        answer, _ = self._memory.pop(key)
+        self._memory_size -= len(answer)
+
+    def _read_disk(self, key, now):
+        path = self._path(key)
+        try:
+            with open(path, encoding="utf-8") as f:
+                stored = json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable response cache entry {path}: {str(e)}")
+            return None
+        if stored["expires_at"] <= now:
+            self._remove_disk(path)
+            return None
+        os.utime(path)  # recency for disk eviction
+        return stored["answer"], stored["expires_at"]
+
+    def _write_disk(self, key, answer, expires_at):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"answer": answer, "expires_at": expires_at}, f, ensure_ascii=False)
+            previous_size = os.path.getsize(path) if os.path.exists(path) else 0
+            os.replace(tmp_path, path)
+            self._disk_size += os.path.getsize(path) - previous_size
+        except OSError as e:
+            logger.warning(f"Could not write response cache entry {path}: {str(e)}")
+            return
+        if self._disk_size > self.disk_bytes:
+            self._evict_disk()
+
+    def _remove_disk(self, path):
+        try:
+            size = os.path.getsize(path)
+            os.remove(path)
+            self._disk_size -= size
+        except OSError:
+            pass
+
+    def _evict_disk(self):
+        """Delete least recently used files down to 90% of disk_bytes."""
+        files = sorted(self._disk_files(), key=lambda file: file[2])
+        self._disk_size = sum(size for _, size, _ in files)
+        target = self.disk_bytes * 0.9
+        removed = 0
+        for path, size, _ in files:
+            if self._disk_size <= target:
+                break
+            self._remove_disk(path)
+            removed += 1
+        self.evictions += removed
+        logger.info(f"Evicted {removed} entries from response cache {self.cache_dir}")
+
+    def stats(self) -> dict:
+        """Return hit-rate and size counters for monitoring."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "bytes_saved": self.bytes_saved,
+                "evictions": self.evictions,
+                "memory_entries": len(self._memory),
+                "memory_bytes": self._memory_size,
+                "disk_bytes": self._disk_size,
+            }
+
+
+class CachedResponseModel(ModelWrapper):
+    """Wraps a persona's model so repeated streaming requests replay the stored answer."""
+
+    def __init__(self, base_model, cache, persona, ttl_seconds):
+        super().__init__(base_model)
+        self.cache = cache
+        self.persona = persona
+        self.ttl_seconds = ttl_seconds
+
+    def chat(self, messages, stream=False):
+        if not stream:
+            return self.base_model.chat(messages, stream=False)
+        return self._cached_chat(messages)
+
+    async def _cached_chat(self, messages):
+        """Replay a cached answer in the model's chunk protocol, or stream and store a complete one."""
+        key = response_key(self.persona, self.model, messages)
+        answer = self.cache.get(key)
+        if answer is not None:
+            logger.debug(f"Replaying cached response for persona {self.persona}")
+            for start in range(0, len(answer), REPLAY_CHUNK_CHARS):
+                yield {'message': answer[start:start + REPLAY_CHUNK_CHARS], 'is_chunk': True}
+            return
+
+        parts = []
+        complete = True
+        stream = self.base_model.chat(messages, stream=True)
+        try:
+            async for chunk in stream:
+                if chunk.get('is_error') or chunk.get('is_fallback'):
+                    complete = False
+                elif chunk.get('is_chunk'):
+                    parts.append(chunk['message'])
+                yield chunk
+        finally:
+            await stream.aclose()
+        # Only answers streamed to the end without errors are stored
+        if complete and parts:
+            self.cache.put(key, "".join(parts), self.ttl_seconds)
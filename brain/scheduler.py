@@ -0,0 +1,236 @@
+import asyncio
+import math
+import threading
+import time
+from collections import OrderedDict, deque
+from contextvars import ContextVar
+from brain.models.base_model import ModelWrapper, Overloaded
+from brain.metrics import QUEUE_WAIT_SECONDS
+
+# Priority classes: (rank, share of a backend's slots the class may use). Lower ranks are admitted first,
+# and batch work never takes more than half of a backend, so interactive requests always find room
+PRIORITY_CLASSES = {
+    "interactive": (0, 1.0),
+    "batch": (1, 0.5),
+}
+DEFAULT_PRIORITY = "interactive"
+
+
+class RequestInfo:
+    """Who a generation is for, used to schedule it fairly."""
+
+    def __init__(self, sender="", priority=DEFAULT_PRIORITY):
+        self.sender = sender
+        self.priority = priority if priority in PRIORITY_CLASSES else DEFAULT_PRIORITY
+
+
+# Set by the servers for each dialog request, read when the generation asks for a slot
+current_request = ContextVar("current_request", default=RequestInfo())
+
+
+class Ticket:
+    """A generation waiting for or holding a slot."""
+
+    def __init__(self, backend, backend_limit, persona, persona_limit, request):
+        self.backend = backend
+        self.backend_limit = backend_limit
+        self.persona = persona
+        self.persona_limit = persona_limit
+        self.sender = request.sender
+        self.priority = request.priority
+        self.rank, self.share = PRIORITY_CLASSES[request.priority]
+        self.enqueued_at = time.monotonic()
+        self.admitted_at = None
+        self.future = None
+
+
+class Scheduler:
+    """
+    Admission control for model generations.
+
+    Each generation needs a slot on its backend (llm_host and base_url) and, when the
+    persona has max_concurrency, on its persona. Requests that cannot start wait in a
+    bounded queue: per priority class, senders take turns, so one sender's burst does not
+    delay everyone else, and a sender's own requests start in order. Requests are
+    rejected with Overloaded, without waiting, when the queue or the sender's share of it
+    is full, and after max_wait_seconds in the queue.
+
+    All methods except stats() run on the event loop that drives the streams.
+    """
+
+    def __init__(self, max_queue=64, max_queue_per_sender=8, max_wait_seconds=30):
+        self.max_queue = max_queue
+        self.max_queue_per_sender = max_queue_per_sender
+        self.max_wait_seconds = max_wait_seconds
+        self._waiting = {}  # rank -> OrderedDict(sender -> deque of tickets), in turn order
+        self._queued = 0
+        self._queued_by_sender = {}
+        self._running_by_backend = {}
+        self._running_by_class = {}  # (backend, priority) -> running
+        self._running_by_persona = {}
+        self._hold_seconds = {}  # backend -> moving average of slot hold time
+        self._lock = threading.Lock()  # guards counters read by stats() from other threads
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+
+    async def acquire(self, backend, backend_limit, persona, persona_limit, request):
+        """Wait for a slot and return its ticket, or raise Overloaded."""
+        ticket = Ticket(backend, backend_limit, persona, persona_limit, request)
+        if not self._queued and self._can_run(ticket):
+            self._start(ticket)
+            return ticket
+
+        if self._queued >= self.max_queue:
+            self._reject(ticket, "Queue is full")
+        if self._queued_by_sender.get(ticket.sender, 0) >= self.max_queue_per_sender:
+            self._reject(ticket, f"Too many queued requests for {ticket.sender}")
+
+        ticket.future = asyncio.get_running_loop().create_future()
+        self._enqueue(ticket)
+        self._dispatch()
+        try:
+            await asyncio.wait_for(asyncio.shield(ticket.future), self.max_wait_seconds)
+        except asyncio.TimeoutError:
+            if ticket.future.done():
+                return ticket
+            self._dequeue(ticket)
+            with self._lock:
+                self.timed_out += 1
+            self._reject(ticket, f"Waited {self.max_wait_seconds}s for {backend}")
+        except asyncio.CancelledError:
+            # The client went away while queued, or was admitted just as it did
+            if ticket.future.done():
+                self.release(ticket)
+            else:
+                self._dequeue(ticket)
+            raise
+        return ticket
+
+    def release(self, ticket):
+        """Give back a ticket's slot and admit waiting requests that can now run."""
+        if ticket.admitted_at is None:
+            return
+        held = time.monotonic() - ticket.admitted_at
+        ticket.admitted_at = None
+        with self._lock:
+            self._running_by_backend[ticket.backend] -= 1
+            self._running_by_class[(ticket.backend, ticket.priority)] -= 1
+            self._running_by_persona[ticket.persona] -= 1
+            previous = self._hold_seconds.get(ticket.backend, held)
+            self._hold_seconds[ticket.backend] = 0.8 * previous + 0.2 * held
+        self._dispatch()
+
+    def _can_run(self, ticket):
+        backend_running = self._running_by_backend.get(ticket.backend, 0)
+        if backend_running >= ticket.backend_limit:
+            return False
+        class_limit = max(1, math.floor(ticket.backend_limit * ticket.share))
+        if self._running_by_class.get((ticket.backend, ticket.priority), 0) >= class_limit:
+            return False
+        return not ticket.persona_limit or self._running_by_persona.get(ticket.persona, 0) < ticket.persona_limit
+
+    def _start(self, ticket):
+        ticket.admitted_at = time.monotonic()
+        waited = ticket.admitted_at - ticket.enqueued_at
+        with self._lock:
+            self._running_by_backend[ticket.backend] = self._running_by_backend.get(ticket.backend, 0) + 1
+            key = (ticket.backend, ticket.priority)
+            self._running_by_class[key] = self._running_by_class.get(key, 0) + 1
+            self._running_by_persona[ticket.persona] = self._running_by_persona.get(ticket.persona, 0) + 1
+            self.admitted += 1
+            self.wait_seconds_total += waited
+            self.wait_seconds_max = max(self.wait_seconds_max, waited)
+        QUEUE_WAIT_SECONDS.labels(ticket.backend, ticket.priority).observe(waited)
+
+    def _enqueue(self, ticket):
+        senders = self._waiting.setdefault(ticket.rank, OrderedDict())
+        senders.setdefault(ticket.sender, deque()).append(ticket)
+        with self._lock:
+            self._queued += 1
+            self._queued_by_sender[ticket.sender] = self._queued_by_sender.get(ticket.sender, 0) + 1
+
+    def _dequeue(self, ticket):
+        senders = self._waiting.get(ticket.rank, {})
+        queue = senders.get(ticket.sender)
+        if queue is None or ticket not in queue:
+            return
+        queue.remove(ticket)
+        if not queue:
+            del senders[ticket.sender]
+        with self._lock:
+            self._queued -= 1
+            self._queued_by_sender[ticket.sender] -= 1
+            if not self._queued_by_sender[ticket.sender]:
+                del self._queued_by_sender[ticket.sender]
+
+    def _dispatch(self):
+        """Admit waiting requests in priority order, taking turns between senders within a class."""
+        admitted = True
+        while admitted:
+            admitted = False
+            for rank in sorted(self._waiting):
+                senders = self._waiting[rank]
+                for sender in list(senders):
+                    ticket = senders[sender][0]
+                    if ticket.future.done() or not self._can_run(ticket):
+                        continue
+                    self._dequeue(ticket)
+                    if sender in senders:
+                        senders.move_to_end(sender)  # this sender's next request waits for the others
+                    self._start(ticket)
+                    ticket.future.set_result(None)
+                    admitted = True
+
+    def _reject(self, ticket, reason):
+        with self._lock:
+            self.rejected += 1
+        raise Overloaded(reason, self.retry_after(ticket.backend, ticket.backend_limit))
+
+    def retry_after(self, backend, backend_limit):
+        """Seconds until the queue in front of a new request is likely to have drained."""
+        hold = self._hold_seconds.get(backend, 1.0)
+        return max(1, math.ceil(hold * (self._queued + 1) / max(1, backend_limit)))
+
+    def stats(self) -> dict:
+        """Return queue depth, running slots and wait times for monitoring."""
+        with self._lock:
+            return {
+                "queue_depth": self._queued,
+                "running": {backend: running for backend, running in self._running_by_backend.items() if running},
+                "admitted": self.admitted,
+                "rejected": self.rejected,
+                "timed_out": self.timed_out,
+                "wait_seconds_avg": self.wait_seconds_total / self.admitted if self.admitted else 0.0,
+                "wait_seconds_max": self.wait_seconds_max,
+            }
+
+
+class ScheduledChatModel(ModelWrapper):
+    """Wraps a persona's model so every streaming generation holds a scheduler slot."""
+
+    def __init__(self, base_model, scheduler, persona, backend, backend_limit, persona_limit=0):
+        super().__init__(base_model)
+        self.scheduler = scheduler
+        self.persona = persona
+        self.backend_key = backend
+        self.backend_limit = backend_limit
+        self.persona_limit = persona_limit
+
+    def chat(self, messages, stream=False):
+        if not stream:
+            return self.base_model.chat(messages, stream=False)
+        return self._scheduled_chat(messages)
+
+    async def _scheduled_chat(self, messages):
+        ticket = await self.scheduler.acquire(self.backend_key, self.backend_limit, self.persona,
+                                              self.persona_limit, current_request.get())
+        stream = self.base_model.chat(messages, stream=True)
+        try:
+            async for chunk in stream:
+                yield chunk
+        finally:
+            await stream.aclose()
+            self.scheduler.release(ticket)
@@ -0,0 +1,139 @@
+import asyncio
+import threading
+import weakref
+from loguru import logger
+from brain.models.base_model import ModelWrapper
+from brain.response_cache import response_key
+
+
+class Flight:
+    """One upstream generation and the chunks it has produced so far."""
+
+    def __init__(self, key):
+        self.key = key
+        self.chunks = []
+        self.done = False
+        self.error = None
+        self.subscribers = 0
+        self.task = None
+        self._changed = asyncio.get_running_loop().create_future()
+
+    def publish(self, chunk=None, done=False, error=None):
+        if chunk is not None:
+            self.chunks.append(chunk)
+        self.done = self.done or done
+        self.error = error or self.error
+        changed, self._changed = self._changed, asyncio.get_running_loop().create_future()
+        changed.set_result(None)
+
+    async def wait(self):
+        """Wait until a chunk is published or the generation ends."""
+        await asyncio.shield(self._changed)
+
+
+class SingleFlight:
+    """
+    Coalesces identical in-flight generations into one upstream stream.
+
+    The first request for a key starts the upstream generation in a task that appends
+    every chunk to a fan-out buffer. Concurrent requests for the same key subscribe to
+    that buffer and first replay the chunks produced so far. The generation is cancelled
+    only when its last subscriber goes away. Flights are kept per event loop, since
+    their futures and tasks belong to the loop they were created on.
+    """
+
+    def __init__(self):
+        self._flights = weakref.WeakKeyDictionary()  # event loop -> {key: Flight}
+        self._lock = threading.Lock()
+        self.started = 0
+        self.joined = 0
+        self.cancelled = 0
+
+    def _loop_flights(self):
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            return self._flights.setdefault(loop, {})
+
+    async def subscribe(self, key, make_stream):
+        """
+        Yield the chunks of the generation for key, starting it with make_stream() if none is running.
+        """
+        flights = self._loop_flights()
+        flight = flights.get(key)
+        if flight is None:
+            flight = Flight(key)
+            flight.task = asyncio.ensure_future(self._run(flights, flight, make_stream()))
+            flights[key] = flight
+            with self._lock:
+                self.started += 1
+        else:
+            with self._lock:
+                self.joined += 1
+            logger.debug(f"Joined in-flight generation with {flight.subscribers} subscribers and {len(flight.chunks)} chunks")
+
+        flight.subscribers += 1
+        try:
+            position = 0
+            while True:
+                while position < len(flight.chunks):
+                    yield flight.chunks[position]
+                    position += 1
+                if flight.done:
+                    break
+                await flight.wait()
+            if flight.error is not None:
+                raise flight.error
+        finally:
+            flight.subscribers -= 1
+            if flight.subscribers == 0 and not flight.done:
+                # Nobody is listening any more, stop the backend generation
+                flight.task.cancel()
+                if flights.get(key) is flight:
+                    del flights[key]
+                with self._lock:
+                    self.cancelled += 1
+
+    async def _run(self, flights, flight, stream):
+        """Drive the upstream stream and publish its chunks to the flight's subscribers."""
+        error = None
+        try:
+            async for chunk in stream:
+                flight.publish(chunk)
+        except asyncio.CancelledError:
+            error = asyncio.CancelledError()
+            raise
+        except Exception as e:
+            # Re-raised to every subscriber, which reports it
+            logger.debug(f"Coalesced generation failed: {str(e)}")
+            error = e
+        finally:
+            # Finished flights are dropped, later requests start a new generation
+            if flights.get(flight.key) is flight:
+                del flights[flight.key]
+            await stream.aclose()
+            flight.publish(done=True, error=error)
+
+    def stats(self) -> dict:
+        """Return coalescing counters for monitoring."""
+        with self._lock:
+            return {
+                "in_flight": sum(len(flights) for flights in self._flights.values()),
+                "started": self.started,
+                "joined": self.joined,
+                "cancelled": self.cancelled,
+            }
+
+
+class CoalescedChatModel(ModelWrapper):
+    """Wraps a persona's model so identical concurrent streaming requests share one generation."""
+
+    def __init__(self, base_model, single_flight, persona):
+        super().__init__(base_model)
+        self.single_flight = single_flight
+        self.persona = persona
+
+    def chat(self, messages, stream=False):
+        if not stream:
+            return self.base_model.chat(messages, stream=False)
+        key = response_key(self.persona, self.model, messages)
+        return self.single_flight.subscribe(key, lambda: self.base_model.chat(messages, stream=True))
@@ -0,0 +1,393 @@
+import json
+import os
+import threading
+
+import numpy as np
+from loguru import logger
+
+# Rows scored per matrix multiply during a scan, bounds the temporary score matrix
+SCAN_BLOCK_ROWS = 65536
+
+
+def _normalize(vectors):
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def _top_k(scores, k):
+    """Column indices and scores of the k best entries of each row, best first."""
+    k = min(k, scores.shape[1])
+    if k == 0:
+        return np.empty((scores.shape[0], 0), dtype=np.int64), np.empty((scores.shape[0], 0), dtype=np.float32)
+    part = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    part_scores = np.take_along_axis(scores, part, axis=1)
+    order = np.argsort(-part_scores, axis=1)
+    return np.take_along_axis(part, order, axis=1), np.take_along_axis(part_scores, order, axis=1)
+
+
+class MetadataColumns:
+    """Columnar, dictionary-encoded metadata so filters are vectorized comparisons."""
+
+    def __init__(self, vocab=None, codes=None):
+        self.vocab = vocab or {}  # key -> list of distinct values, code = position
+        self.codes = codes or {}  # key -> int32 array, -1 where a row has no value
+        self._lookup = {key: {value: code for code, value in enumerate(values)} for key, values in self.vocab.items()}
+
+    def append(self, metadata, start_row, count):
+        keys = set(self.codes)
+        for item in metadata:
+            keys.update(item.keys())
+        for key in keys:
+            column = self.codes.get(key, np.full(start_row, -1, dtype=np.int32))
+            lookup = self._lookup.setdefault(key, {})
+            values = self.vocab.setdefault(key, [])
+            new_codes = np.full(count, -1, dtype=np.int32)
+            for row, item in enumerate(metadata):
+                if key in item:
+                    value = item[key]
+                    code = lookup.get(value)
+                    if code is None:
+                        code = lookup[value] = len(values)
+                        values.append(value)
+                    new_codes[row] = code
+            self.codes[key] = np.concatenate([column[:start_row], new_codes])
+
+    def row(self, row):
+        return {key: self.vocab[key][codes[row]] for key, codes in self.codes.items() if codes[row] >= 0}
+
+    def mask(self, filters, rows):
+        """Boolean mask of rows matching every key; a list value matches any of its items."""
+        mask = np.ones(rows, dtype=bool)
+        for key, wanted in filters.items():
+            if key not in self.codes:
+                return np.zeros(rows, dtype=bool)
+            wanted = wanted if isinstance(wanted, (list, tuple, set)) else [wanted]
+            wanted_codes = [self._lookup[key][value] for value in wanted if value in self._lookup[key]]
+            mask &= np.isin(self.codes[key][:rows], wanted_codes)
+        return mask
+
+    def take(self, rows):
+        return MetadataColumns({key: list(values) for key, values in self.vocab.items()},
+                               {key: codes[rows] for key, codes in self.codes.items()})
+
+
+class VectorIndex:
+    """
+    In-process vector index for embeddings produced by BaseModel.embed.
+
+    Supports exact batched top-k search and an approximate IVF mode (k-means coarse
+    quantizer with nprobe inverted lists), incremental add/delete, metadata filters,
+    and persistence to a directory whose vectors are memory-mapped on load.
+    """
+
+    def __init__(self, dim, metric="cosine"):
+        if metric not in ("cosine", "ip"):
+            raise ValueError(f"Unsupported metric: {metric}")
+        self.dim = dim
+        self.metric = metric
+        self._base = np.empty((0, dim), dtype=np.float32)  # memory-mapped after load
+        self._appended = []  # vectors added since the base was written
+        self._ids = np.empty(0, dtype=np.int64)
+        self._deleted = np.empty(0, dtype=bool)
+        self._metadata = MetadataColumns()
+        self._id_to_row = None
+        self._next_id = 0
+        self.centroids = None
+        self._assignments = np.empty(0, dtype=np.int32)
+        self._inverted = None
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return int(len(self._ids) - self._deleted.sum())
+
+    @property
+    def _rows(self):
+        return len(self._ids)
+
+    def _vectors(self):
+        """All stored vectors as one array, merging appended blocks into the base."""
+        if self._appended:
+            self._base = np.concatenate([np.asarray(self._base)] + self._appended)
+            self._appended = []
+        return self._base
+
+    def _blocks(self):
+        """Yield (first_row, vectors) blocks covering all rows without copying the base."""
+        for start in range(0, len(self._base), SCAN_BLOCK_ROWS):
+            yield start, self._base[start:start + SCAN_BLOCK_ROWS]
+        row = len(self._base)
+        for block in self._appended:
+            yield row, block
+            row += len(block)
+
+    def _prepare(self, vectors):
+        vectors = np.ascontiguousarray(np.atleast_2d(vectors), dtype=np.float32)
+        if vectors.shape[1] != self.dim:
+            raise ValueError(f"Expected vectors of dimension {self.dim}, got {vectors.shape[1]}")
+        return _normalize(vectors) if self.metric == "cosine" else vectors
+
+    def add(self, vectors, ids=None, metadata=None):
+        """
+        Add vectors to the index.
+
+        Args:
+            vectors: Matrix of shape (n, dim), e.g. the output of BaseModel.embed
+            ids: Optional int64 ids, assigned sequentially when omitted
+            metadata: Optional list of n dicts of scalar values usable in filters
+
+        Returns:
+            The ids of the added vectors
+        """
+        vectors = self._prepare(vectors)
+        count = len(vectors)
+        with self._lock:
+            if ids is None:
+                ids = np.arange(self._next_id, self._next_id + count, dtype=np.int64)
+            ids = np.asarray(ids, dtype=np.int64)
+            if len(ids) != count:
+                raise ValueError("ids and vectors must have the same length")
+            start = self._rows
+            self._appended.append(vectors)
+            self._ids = np.concatenate([self._ids, ids])
+            self._deleted = np.concatenate([self._deleted, np.zeros(count, dtype=bool)])
+            if metadata is not None or self._metadata.codes:
+                self._metadata.append(metadata or [{}] * count, start, count)
+            if self._id_to_row is not None:
+                self._id_to_row.update((int(i), start + row) for row, i in enumerate(ids))
+            self._next_id = max(self._next_id, int(ids.max()) + 1) if count else self._next_id
+            if self.centroids is not None:
+                self._assignments = np.concatenate([self._assignments, self._assign(vectors)])
+                self._inverted = None
+        return ids
+
+    def delete(self, ids):
+        """Mark vectors as deleted; their rows are dropped on the next compact()."""
+        with self._lock:
+            if self._id_to_row is None:
+                self._id_to_row = {int(i): row for row, i in enumerate(self._ids)}
+            deleted = 0
+            for i in np.atleast_1d(ids):
+                row = self._id_to_row.pop(int(i), None)
+                if row is not None and not self._deleted[row]:
+                    self._deleted[row] = True
+                    deleted += 1
+            return deleted
+
+    def delete_where(self, filters):
+        """Delete every vector whose metadata matches the filters."""
+        with self._lock:
+            mask = self._metadata.mask(filters, self._rows) & ~self._deleted
+            return self.delete(self._ids[mask])
+
+    def get_metadata(self, i):
+        """Metadata stored for an id."""
+        with self._lock:
+            if self._id_to_row is None:
+                self._id_to_row = {int(i): row for row, i in enumerate(self._ids)}
+            return self._metadata.row(self._id_to_row[int(i)])
+
+    def _assign(self, vectors):
+        return self._nearest(vectors, self.centroids)
+
+    @staticmethod
+    def _nearest(vectors, centroids):
+        """Index of the best-scoring centroid for every vector, computed in blocks."""
+        assignments = np.empty(len(vectors), dtype=np.int32)
+        block_rows = max(1, SCAN_BLOCK_ROWS * 64 // max(len(centroids), 64))
+        for start in range(0, len(vectors), block_rows):
+            block = np.asarray(vectors[start:start + block_rows])
+            assignments[start:start + len(block)] = np.argmax(block @ centroids.T, axis=1)
+        return assignments
+
+    def build_ivf(self, nlist=None, iterations=10, sample_size=None, seed=0):
+        """
+        Train the IVF coarse quantizer with spherical k-means on a sample of the vectors.
+
+        Args:
+            nlist: Number of inverted lists, defaults to about 4 * sqrt(n)
+            iterations: k-means iterations
+            sample_size: Training sample, defaults to min(n, 64 * nlist, 262144)
+        """
+        with self._lock:
+            vectors = self._vectors()
+            rows = len(vectors)
+            if rows == 0:
+                raise ValueError("Cannot build an IVF index over an empty index")
+            nlist = nlist or max(1, int(4 * np.sqrt(rows)))
+            nlist = min(nlist, rows)
+            sample_size = min(rows, sample_size or min(64 * nlist, 262144))
+            rng = np.random.default_rng(seed)
+            sample = np.asarray(vectors[np.sort(rng.choice(rows, sample_size, replace=False))])
+            centroids = sample[rng.choice(sample_size, nlist, replace=False)].copy()
+            for _ in range(iterations):
+                labels = self._nearest(sample, centroids)
+                order = np.argsort(labels, kind="stable")
+                counts = np.bincount(labels, minlength=nlist)
+                sums = np.zeros_like(centroids)
+                present = np.flatnonzero(counts)
+                starts = np.concatenate([[0], np.cumsum(counts[present])[:-1]])
+                sums[present] = np.add.reduceat(sample[order], starts, axis=0)
+                empty = counts == 0
+                sums[empty] = sample[rng.choice(sample_size, int(empty.sum()))]
+                centroids = _normalize(sums)
+            self.centroids = centroids.astype(np.float32)
+            self._assignments = self._assign(vectors)
+            self._inverted = None
+            logger.info(f"Built IVF index with {nlist} lists over {rows} vectors")
+
+    def _inverted_lists(self):
+        """Rows grouped by list: (row order, start offset of every list)."""
+        if self._inverted is None:
+            order = np.argsort(self._assignments, kind="stable")
+            offsets = np.searchsorted(self._assignments[order], np.arange(len(self.centroids) + 1))
+            self._inverted = (order, offsets)
+        return self._inverted
+
+    def search(self, queries, k=10, mode="exact", nprobe=8, filters=None):
+        """
+        Find the k best matches for each query.
+
+        Args:
+            queries: Matrix of shape (q, dim) or a single vector
+            k: Number of results per query
+            mode: "exact" scans every vector, "ivf" only the nprobe closest lists
+            nprobe: Lists scanned per query in ivf mode
+            filters: Optional {key: value or list of values} metadata filter
+
+        Returns:
+            (ids, scores) arrays of shape (q, k); missing results have id -1
+        """
+        queries = self._prepare(queries)
+        with self._lock:
+            if self._rows == 0:
+                return (np.full((len(queries), k), -1, dtype=np.int64),
+                        np.full((len(queries), k), -np.inf, dtype=np.float32))
+            valid = ~self._deleted
+            if filters:
+                valid &= self._metadata.mask(filters, self._rows)
+            if mode == "ivf" and self.centroids is not None:
+                rows, scores = self._search_ivf(queries, k, nprobe, valid)
+            else:
+                rows, scores = self._search_exact(queries, k, valid)
+            ids = np.where(rows >= 0, self._ids[np.maximum(rows, 0)], -1)
+        return ids, scores
+
+    def _search_exact(self, queries, k, valid):
+        best_rows = np.full((len(queries), 0), -1, dtype=np.int64)
+        best_scores = np.full((len(queries), 0), -np.inf, dtype=np.float32)
+        for start, block in self._blocks():
+            scores = queries @ np.asarray(block).T
+            scores[:, ~valid[start:start + len(block)]] = -np.inf
+            cols, top_scores = _top_k(scores, k)
+            best_rows = np.concatenate([best_rows, cols + start], axis=1)
+            best_scores = np.concatenate([best_scores, top_scores], axis=1)
+            cols, best_scores = _top_k(best_scores, k)
+            best_rows = np.take_along_axis(best_rows, cols, axis=1)
+        return self._pad(best_rows, best_scores, k)
+
+    def _search_ivf(self, queries, k, nprobe, valid):
+        order, offsets = self._inverted_lists()
+        vectors = self._vectors()
+        probes, _ = _top_k(queries @ self.centroids.T, min(nprobe, len(self.centroids)))
+        all_rows = np.full((len(queries), k), -1, dtype=np.int64)
+        all_scores = np.full((len(queries), k), -np.inf, dtype=np.float32)
+        for q, lists in enumerate(probes):
+            candidates = np.concatenate([order[offsets[l]:offsets[l + 1]] for l in lists])
+            candidates = candidates[valid[candidates]]
+            if len(candidates) == 0:
+                continue
+            scores = np.asarray(vectors[candidates]) @ queries[q]
+            cols, top_scores = _top_k(scores[None, :], k)
+            all_rows[q, :cols.shape[1]] = candidates[cols[0]]
+            all_scores[q, :cols.shape[1]] = top_scores[0]
+        return all_rows, all_scores
+
+    @staticmethod
+    def _pad(rows, scores, k):
+        rows = np.where(np.isfinite(scores), rows, -1)
+        if rows.shape[1] < k:
+            missing = k - rows.shape[1]
+            rows = np.pad(rows, ((0, 0), (0, missing)), constant_values=-1)
+            scores = np.pad(scores, ((0, 0), (0, missing)), constant_values=-np.inf)
+        return rows, scores
+
+    def compact(self):
+        """Drop deleted rows for good."""
+        with self._lock:
+            keep = np.flatnonzero(~self._deleted)
+            if len(keep) == self._rows:
+                return
+            self._base = np.ascontiguousarray(self._vectors()[keep])
+            self._ids = self._ids[keep]
+            self._deleted = np.zeros(len(keep), dtype=bool)
+            self._metadata = self._metadata.take(keep)
+            self._id_to_row = None
+            if self.centroids is not None:
+                self._assignments = self._assignments[keep]
+                self._inverted = None
+
+    def save(self, path):
+        """Write the index to a directory, replacing files atomically."""
+        with self._lock:
+            self.compact()
+            os.makedirs(path, exist_ok=True)
+
+            def write(name, writer):
+                tmp = os.path.join(path, name + ".tmp")
+                with open(tmp, "wb") as f:
+                    writer(f)
+                os.replace(tmp, os.path.join(path, name))
+
+            keys = list(self._metadata.vocab)
+            vectors = self._vectors()
+            write("vectors.f32", lambda f: f.write(np.ascontiguousarray(vectors).tobytes()))
+            write("ids.npy", lambda f: np.save(f, self._ids))
+            for position, key in enumerate(keys):
+                write(f"meta_{position}.npy", lambda f, key=key: np.save(f, self._metadata.codes[key]))
+            if self.centroids is not None:
+                write("centroids.npy", lambda f: np.save(f, self.centroids))
+                write("assignments.npy", lambda f: np.save(f, self._assignments))
+            manifest = {
+                "dim": self.dim,
+                "metric": self.metric,
+                "rows": self._rows,
+                "next_id": self._next_id,
+                "ivf": self.centroids is not None,
+                "metadata_keys": keys,
+                "metadata_vocab": [self._metadata.vocab[key] for key in keys],
+            }
+            # Written last, so a reader never sees a manifest ahead of its files
+            write("index.json", lambda f: f.write(json.dumps(manifest).encode("utf-8")))
+            logger.info(f"Saved vector index with {self._rows} vectors to {path}")
+
+    @classmethod
+    def load(cls, path):
+        """Open a saved index; vectors are memory-mapped, so loading does not read them."""
+        with open(os.path.join(path, "index.json")) as f:
+            manifest = json.load(f)
+        index = cls(manifest["dim"], manifest["metric"])
+        rows = manifest["rows"]
+        if rows:
+            index._base = np.memmap(os.path.join(path, "vectors.f32"), dtype=np.float32, mode="r",
+                                    shape=(rows, index.dim))
+        index._ids = np.load(os.path.join(path, "ids.npy"))
+        index._deleted = np.zeros(rows, dtype=bool)
+        index._next_id = manifest["next_id"]
+        keys = manifest["metadata_keys"]
+        index._metadata = MetadataColumns(
+            dict(zip(keys, manifest["metadata_vocab"])),
+            {key: np.load(os.path.join(path, f"meta_{position}.npy")) for position, key in enumerate(keys)}
+        )
+        if manifest["ivf"]:
+            index.centroids = np.load(os.path.join(path, "centroids.npy"))
+            index._assignments = np.load(os.path.join(path, "assignments.npy"))
+        logger.info(f"Loaded vector index with {rows} vectors from {path}")
+        return index
+
+
+def open_vector_index(path):
+    """Load the index at path if one has been saved there, otherwise return None."""
+    if not os.path.exists(os.path.join(path, "index.json")):
+        return None
+    return VectorIndex.load(path)
@@ -0,0 +1,162 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from loguru import logger
+
+
+class WarmModel:
+    """Warm-up state of one model on one backend, shared by every persona that uses it."""
+
+    def __init__(self, key, create_model):
+        self.key = key  # (llm_host, base_url, model)
+        self.create_model = create_model
+        self.model = None
+        self.personas = set()
+        self.state = "cold"  # cold, loading, warm, failed or unsupported
+        self.load_seconds = None
+        self.last_warmed = None
+        self.last_used = None
+        self.error = None
+
+    def status(self, now, keep_alive_seconds) -> dict:
+        llm_host, base_url, model = self.key
+        state = self.state
+        last_active = max(self.last_warmed or 0, self.last_used or 0)
+        if state == "warm" and now - last_active > keep_alive_seconds:
+            # The backend has unloaded it since
+            state = "cold"
+        return {
+            "llm_host": llm_host,
+            "base_url": base_url,
+            "model": model,
+            "personas": sorted(self.personas),
+            "state": state,
+            "load_seconds": self.load_seconds,
+            "seconds_since_used": None if self.last_used is None else round(now - self.last_used, 1),
+            "error": self.error,
+        }
+
+
+class ModelWarmer:
+    """
+    Loads the models of all personas when the brain starts and keeps the busy ones loaded.
+
+    Every distinct (llm_host, base_url, model) is warmed once, concurrently, from a
+    background thread, so the server accepts requests while the models load. Afterwards,
+    every refresh_seconds, the models of pinned personas and of personas used within
+    active_window_seconds are warmed again, which renews their keep-alive on the backend.
+    Models nobody uses are left to expire, freeing backend memory. Failed warm-ups are
+    retried on each refresh, but a model the factory cannot create, such as one on an
+    unsupported llm_host, is marked unsupported once and left out from then on.
+    """
+
+    def __init__(self, config, create_model):
+        self.config = config.warmup
+        self._models = {}  # (llm_host, base_url, model) -> WarmModel
+        self._persona_models = {}  # persona -> [WarmModel]
+        for persona, persona_config in config.persona_models.items():
+            base_urls = [endpoint.base_url for endpoint in persona_config.endpoints] or [persona_config.base_url]
+            for base_url in base_urls:
+                key = (persona_config.llm_host, base_url, persona_config.model)
+                warm_model = self._models.get(key)
+                if warm_model is None:
+                    warm_model = WarmModel(key, lambda persona_config=persona_config, base_url=base_url:
+                                           create_model(persona_config, base_url))
+                    self._models[key] = warm_model
+                warm_model.personas.add(persona)
+                self._persona_models.setdefault(persona, []).append(warm_model)
+        self._executor = ThreadPoolExecutor(max_workers=max(1, self.config.workers), thread_name_prefix="warmup")
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._started = False
+
+    def start(self):
+        """Warm every model in the background and keep refreshing the ones in use."""
+        if self._thread is not None:
+            return
+        logger.info(f"Warming {len(self._models)} models in the background")
+        self._thread = threading.Thread(target=self._run, name="model-warmer", daemon=True)
+        self._thread.start()
+
+    @property
+    def running(self):
+        return self._thread is not None
+
+    def touch(self, persona):
+        """Record that a persona's models were used, so they are kept loaded."""
+        now = time.monotonic()
+        for warm_model in self._persona_models.get(persona, ()):
+            warm_model.last_used = now
+
+    def _warm(self, warm_model):
+        warm_model.state = "loading"
+        started = time.perf_counter()
+        try:
+            if warm_model.model is None:
+                try:
+                    warm_model.model = warm_model.create_model()
+                except ValueError as e:
+                    # ModelFactory rejects the llm_host, retrying cannot help
+                    warm_model.state = "unsupported"
+                    warm_model.error = str(e)
+                    logger.warning(f"Not warming {warm_model.key[2]} on {warm_model.key[1]}: {str(e)}")
+                    return
+            warm_model.model.warm()
+        except Exception as e:
+            warm_model.state = "failed"
+            warm_model.error = str(e)
+            logger.warning(f"Could not warm {warm_model.key[2]} on {warm_model.key[1]}: {str(e)}")
+            return
+        warm_model.load_seconds = round(time.perf_counter() - started, 3)
+        warm_model.last_warmed = time.monotonic()
+        warm_model.state = "warm"
+        warm_model.error = None
+        logger.debug(f"Warmed {warm_model.key[2]} on {warm_model.key[1]} in {warm_model.load_seconds}s")
+
+    def _warm_all(self, warm_models):
+        wait([self._executor.submit(self._warm, warm_model) for warm_model in warm_models])
+
+    def _to_refresh(self):
+        """Return the models to warm again: pinned, recently used or failed."""
+        now = time.monotonic()
+        pinned = set(self.config.pinned_personas)
+        return [warm_model for warm_model in self._models.values()
+                if warm_model.state != "unsupported"
+                and (warm_model.state == "failed"
+                     or warm_model.personas & pinned
+                     or (warm_model.last_used is not None
+                         and now - warm_model.last_used < self.config.active_window_seconds))]
+
+    def _run(self):
+        started = time.perf_counter()
+        self._warm_all(list(self._models.values()))
+        self._started = True
+        warm = sum(1 for warm_model in self._models.values() if warm_model.state == "warm")
+        logger.info(f"Warmed {warm} of {len(self._models)} models in {time.perf_counter() - started:.1f}s")
+        while not self._stop_event.wait(self.config.refresh_seconds):
+            self._warm_all(self._to_refresh())
+
+    def status(self) -> dict:
+        """Return the warm-up state of every model, for the readiness endpoint."""
+        now = time.monotonic()
+        models = [warm_model.status(now, self.config.keep_alive_seconds) for warm_model in self._models.values()]
+        return {
+            "warm": self._started and all(model["state"] in ("warm", "unsupported") for model in models),
+            "warming": not self._started,
+            "models": models,
+        }
+
+    def warm_values(self):
+        """1 per loaded model and 0 otherwise, for /metrics."""
+        return {(model["llm_host"], model["base_url"], model["model"]): float(model["state"] == "warm")
+                for model in self.status()["models"]}
+
+    def close(self):
+        self._stop_event.set()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        for warm_model in self._models.values():
+            if warm_model.model is not None:
+                try:
+                    warm_model.model.close()
+                except Exception as e:
+                    logger.error(f"Error closing warm-up model {warm_model.key[2]}: {str(e)}")
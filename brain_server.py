@@ -1,102 +1,217 @@
-from flask import Flask, request, Response, jsonify
+from flask import Flask, request, Response, jsonify, send_file
 from flask_restful import Resource, Api
 from loguru import logger
 from config.logging_setup import setup_logging
-from config.config_setup import init_config
+from config.config_setup import ConfigService
 import json
-import asyncio
+import os
 from brain.domain_router import DomainRouter
+from brain.dialog_stream import stream_dialog
+from brain.context_manager import ContextManager
+from brain.conversation_store import ConversationStore, VersionConflict
+from brain.event_loop import BackgroundLoop
+from brain.batch_jobs import BatchRunner
+from brain.scheduler import Overloaded, RequestInfo, current_request
+from brain.metrics import registry, observe_request, CONTENT_TYPE
+import time
+import select
+import socket
 
 app = Flask(__name__)
 api = Api(app)
-# Load and validate configuration
-config = init_config()
+# Load and validate configuration, reloaded when config.yaml changes
+config_service = ConfigService()
+config = config_service.config
 
 # Initialize domain router with validated config
 domain_router = DomainRouter(config)
 
+# One event loop shared by all request threads, so pooled async clients are reused
+background_loop = BackgroundLoop()
+
+# Keeps each request's history within the persona's token budget, summarizing on the shared loop
+context_manager = ContextManager(config, loop=background_loop.loop)
+
+# Message history per dialog_id, so the interface only sends new messages
+store_config = config.conversation_store
+conversation_store = ConversationStore(store_config.max_dialogs, store_config.max_chars,
+                                       database_url=config.database_config_server_url if store_config.spill_to_database else None,
+                                       pool_config=config.database_pool, spill_ttl_seconds=store_config.spill_ttl_seconds)
+
+def apply_config(old_config, new_config):
+    """Use a reloaded config for new requests, while running streams keep their handlers."""
+    global config
+    config = new_config
+    context_manager.config = new_config
+    domain_router.reload(new_config)
+
+config_service.subscribe(apply_config)
+
+# Bulk jobs run as batch priority generations on the same loop, the only one the scheduler serves
+batch_runner = BatchRunner(domain_router, config, context_manager, loop=background_loop.loop) if config.batch.enabled else None
+
+# A worker only notices a disconnected client when it writes, so idle streams send an SSE comment
+KEEPALIVE_SECONDS = 5
+KEEPALIVE_EVENT = ": keep-alive\n\n"
+
+def client_disconnected(environ):
+    """
+    Return True if the client closed its connection.
+
+    Only known under werkzeug's server, which exposes the request socket; other servers
+    report a disconnect only when a write fails.
+    """
+    sock = environ.get('werkzeug.socket')
+    if sock is None:
+        return False
+    try:
+        readable, _, _ = select.select([sock], [], [], 0)
+        return bool(readable) and sock.recv(1, socket.MSG_PEEK) == b''
+    except (OSError, ValueError):
+        return True
+
 class Dialog(Resource):
     def post(self, dialog_id):
+        started = time.perf_counter()
         ## -- The following should match the parameters sent from the interface -- ##
         # Get parameters from the request
         sender = request.form['sender']
         persona_selected = request.form['persona_selected']
-        messages = json.loads(request.form['messages'])  # Get full message history
+        # Either the full message history (first turn or resync) or the messages added since `version`
+        messages = request.form.get('messages')
+        new_messages = request.form.get('new_messages')
+        version = request.form.get('version', type=int)
+        priority = request.form.get('priority', 'interactive')
         # upload_dir = request.form.get('upload_dir')  # Make upload_dir optional
         
-        logger.debug(f"Received request with parameters - {dialog_id=}, {sender=}, {persona_selected=}, {messages=}")
+        logger.debug(f"Received request with parameters - {dialog_id=}, {sender=}, {persona_selected=}, {version=}, {new_messages=}")
          ## End: The following should match the parameters sent from the interface -- ##
 
+        try:
+            messages, version = conversation_store.sync(dialog_id, sender,
+                                                        messages=json.loads(messages) if messages is not None else None,
+                                                        new_messages=json.loads(new_messages) if new_messages else None,
+                                                        version=version)
+        except VersionConflict as e:
+            logger.info(f"Asking client to resync: {str(e)}")
+            observe_request(persona_selected, 409, started)
+            return {'error': 'resync', 'version': e.version}, 409
+
         try:
             # Get or create handler for this persona
-            handler = domain_router.get_handler(persona_selected)
+            handler = domain_router.get_chat_model(persona_selected)
+            messages = context_manager.prepare(persona_selected, handler, messages)
 
-            # Get the streaming response from the handler
-            response_stream = handler.chat(messages, stream=True)
-            
-            # Simplified streaming function
+            # Drive the shared SSE stream on the background event loop
             def generate():
-                accumulated_message = {'role': 'assistant', 'content': ''}
-                
-                # Use asyncio.run to handle the async iterator
-                async def process_stream():
-                    try:
-                        async for chunk in response_stream:
-                            if isinstance(chunk, dict) and 'message' in chunk:
-                                if chunk.get('is_chunk', False):
-                                    content = chunk['message']
-                                    accumulated_message['content'] += content
-                                    response_data = {
-                                        'dialog_id': dialog_id, 
-                                        'message': content, 
-                                        'sender': sender, 
-                                        'is_chunk': True
-                                    }
-                                    yield f"data: {json.dumps(response_data)}\n\n"
-                        
-                        # Final message
-                        final_data = {
-                            'dialog_id': dialog_id, 
-                            'message': accumulated_message['content'], 
-                            'sender': sender, 
-                            'is_chunk': False
-                        }
-                        yield f"data: {json.dumps(final_data)}\n\n"
-                        yield "data: [DONE]\n\n"
-                    except Exception as e:
-                        logger.error(f"Error in processing stream: {str(e)}")
-                        raise
-                
-                # Use a single event loop for the entire stream processing
-                loop = asyncio.new_event_loop()
-                asyncio.set_event_loop(loop)
-                
+                # Copied into the loop's tasks, so the scheduler knows whose generation it admits
+                current_request.set(RequestInfo(sender, priority))
+                record_reply = lambda reply: {'version': conversation_store.record_reply(dialog_id, sender, reply, version)}
                 try:
-                    async_gen = process_stream()
-                    while True:
-                        try:
-                            # Get the next chunk from our async generator
-                            chunk = loop.run_until_complete(anext(async_gen))
-                            yield chunk
-                        except StopAsyncIteration:
-                            break
-                except Exception as e:
-                    logger.error(f"Error in generate: {str(e)}")
+                    yield from background_loop.iterate(stream_dialog(handler, messages, dialog_id, sender, on_complete=record_reply),
+                                                       idle_seconds=KEEPALIVE_SECONDS, idle_item=KEEPALIVE_EVENT)
+                except Overloaded:
                     raise
+                except GeneratorExit:
+                    # The client went away, closing the stream cancels the generation upstream
+                    logger.info(f"Client disconnected from dialog {dialog_id}")
+                    observe_request(persona_selected, "cancelled", started)
+                    raise
+                except Exception:
+                    observe_request(persona_selected, 500, started)
+                    raise
+                observe_request(persona_selected, 200, started)
+
+            # Wait for admission and the first event here, so an overloaded backend is a 429, not a broken stream
+            events = generate()
+            try:
+                first_event = next(events)
+                while first_event == KEEPALIVE_EVENT:
+                    # Nothing can be written before the status is known, so look at the socket instead
+                    if client_disconnected(request.environ):
+                        events.close()
+                        return '', 499
+                    first_event = next(events)
+            except Overloaded as e:
+                logger.warning(f"Rejected dialog {dialog_id}: {str(e)}")
+                observe_request(persona_selected, 429, started)
+                return {'error': 'overloaded', 'retry_after': e.retry_after}, 429, {'Retry-After': str(e.retry_after)}
+            except StopIteration:
+                first_event = None
+
+            def replay():
+                # Closed by the WSGI server when the client disconnects, which closes the stream
+                try:
+                    if first_event:
+                        yield first_event
+                    yield from events
                 finally:
-                    loop.close()
-            
-            return Response(generate(), mimetype='text/event-stream')
+                    events.close()
+            return Response(replay(), mimetype='text/event-stream')
         except Exception as e:
             logger.error(f"Error in post: {str(e)}")
 
 api.add_resource(Dialog, '/<string:dialog_id>')
 
+@app.route('/batch', methods=['POST'])
+def submit_batch():
+    """Queue a batch job from an uploaded JSONL file, or from input_path on the brain host."""
+    if batch_runner is None:
+        return jsonify(error='batch jobs are disabled'), 404
+    upload = request.files.get('file')
+    try:
+        job = batch_runner.submit(input_path=request.form.get('input_path'),
+                                  input_lines=upload.read() if upload else None,
+                                  concurrency=request.form.get('concurrency', type=int))
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+    return jsonify(job.stats()), 202
+
+@app.route('/batch/<job_id>', methods=['GET', 'DELETE'])
+def batch_job(job_id):
+    """Progress of a batch job, or cancel it with DELETE."""
+    job = batch_runner.get(job_id) if batch_runner is not None else None
+    if job is None:
+        return jsonify(error='unknown batch job'), 404
+    if request.method == 'DELETE':
+        batch_runner.cancel(job_id)
+    return jsonify(job.stats())
+
+@app.route('/batch/<job_id>/output')
+def batch_output(job_id):
+    """The results written so far, as JSONL."""
+    job = batch_runner.get(job_id) if batch_runner is not None else None
+    if job is None:
+        return jsonify(error='unknown batch job'), 404
+    if not os.path.exists(job.output_path):
+        return Response('', mimetype='application/x-ndjson')
+    return send_file(job.output_path, mimetype='application/x-ndjson')
+
+@app.route('/ready')
+def ready():
+    """Readiness, with the warm-up state of every model. Requests are served while models load."""
+    return jsonify(domain_router.readiness())
+
+@app.route('/metrics')
+def metrics():
+    """Latency, token and error metrics in the Prometheus text format."""
+    return Response(registry.render(), content_type=CONTENT_TYPE)
+
 def cleanup():
     """Cleanup function to be called when the server shuts down."""
     try:
         logger.info("Starting server cleanup")
-        # domain_router.close()
+        logger.info(f"Handler pool stats: {domain_router.stats()}")
+        logger.info(f"Context window stats: {context_manager.stats()}")
+        logger.info(f"Conversation store stats: {conversation_store.stats()}")
+        if batch_runner is not None:
+            # Running jobs stop at their checkpoint and resume at the next start
+            batch_runner.close()
+        context_manager.close()
+        conversation_store.close()
+        config_service.close()
+        domain_router.close()
+        background_loop.close()
         # service_manager.close_all()
         logger.info("Server cleanup completed")
     except Exception as e:
@@ -105,6 +220,10 @@ def cleanup():
 if __name__ == '__main__':
     print("Starting artmind brain server...")
     setup_logging()
+    config_service.start()
+    domain_router.start_warmup()
+    if batch_runner is not None:
+        batch_runner.resume_jobs()
     try:
         app.run(debug=True, port="5010")
     finally:
@@ -0,0 +1,260 @@
+import asyncio
+import functools
+import json
+import os
+import signal
+import time
+import tornado.web
+from tornado.ioloop import IOLoop
+from tornado.iostream import StreamClosedError
+from loguru import logger
+from config.logging_setup import setup_logging
+from config.config_setup import ConfigService
+from brain.domain_router import DomainRouter
+from brain.dialog_stream import stream_dialog
+from brain.context_manager import ContextManager
+from brain.conversation_store import ConversationStore, VersionConflict
+from brain.batch_jobs import BatchRunner
+from brain.scheduler import Overloaded, RequestInfo, current_request
+from brain.metrics import registry, observe_request, CONTENT_TYPE
+
+# Async serving mode: every stream runs as a coroutine on one event loop instead of
+# holding a worker thread, while keeping the same /<dialog_id> form contract and SSE output
+PORT = 5010
+# Batch output is sent to the client this many bytes at a time
+OUTPUT_CHUNK_BYTES = 64 * 1024
+
+# Load and validate configuration, reloaded when config.yaml changes
+config_service = ConfigService()
+config = config_service.config
+
+# Initialize domain router with validated config
+domain_router = DomainRouter(config)
+
+# Keeps each request's history within the persona's token budget
+context_manager = ContextManager(config)
+
+# Message history per dialog_id, so the interface only sends new messages
+store_config = config.conversation_store
+conversation_store = ConversationStore(store_config.max_dialogs, store_config.max_chars,
+                                       database_url=config.database_config_server_url if store_config.spill_to_database else None,
+                                       pool_config=config.database_pool, spill_ttl_seconds=store_config.spill_ttl_seconds)
+
+# Bulk jobs run as batch priority generations on the serving loop, the only one the scheduler serves
+batch_runner = BatchRunner(domain_router, config, context_manager) if config.batch.enabled else None
+
+def apply_config(old_config, new_config):
+    """Use a reloaded config for new requests, while running streams keep their handlers."""
+    global config
+    config = new_config
+    context_manager.config = new_config
+    domain_router.reload(new_config)
+
+config_service.subscribe(apply_config)
+
+class DialogHandler(tornado.web.RequestHandler):
+    def initialize(self):
+        self._generation = None
+        self._client_gone = False
+
+    def on_connection_close(self):
+        """Cancel the generation as soon as the client goes away, not at the next write."""
+        self._client_gone = True
+        if self._generation is not None and not self._generation.done():
+            self._generation.cancel()
+
+    async def _write_events(self, events):
+        try:
+            async for event in events:
+                self.write(event)
+                await self.flush()
+        finally:
+            await events.aclose()
+
+    async def post(self, dialog_id):
+        started = time.perf_counter()
+        ## -- The following should match the parameters sent from the interface -- ##
+        # Get parameters from the request
+        sender = self.get_body_argument('sender')
+        persona_selected = self.get_body_argument('persona_selected')
+        # Either the full message history (first turn or resync) or the messages added since `version`
+        messages = self.get_body_argument('messages', None)
+        new_messages = self.get_body_argument('new_messages', None)
+        version = self.get_body_argument('version', None)
+        version = int(version) if version else None
+        priority = self.get_body_argument('priority', 'interactive')
+
+        logger.debug(f"Received request with parameters - {dialog_id=}, {sender=}, {persona_selected=}, {version=}, {new_messages=}")
+        ## End: The following should match the parameters sent from the interface -- ##
+
+        try:
+            # A dialog spilled to the database is read back with a blocking query, so off the loop
+            messages, version = await IOLoop.current().run_in_executor(None, functools.partial(
+                conversation_store.sync, dialog_id, sender,
+                messages=json.loads(messages) if messages is not None else None,
+                new_messages=json.loads(new_messages) if new_messages else None,
+                version=version))
+        except VersionConflict as e:
+            logger.info(f"Asking client to resync: {str(e)}")
+            self.set_status(409)
+            self.finish({'error': 'resync', 'version': e.version})
+            observe_request(persona_selected, 409, started)
+            return
+
+        try:
+            # Get or create handler for this persona
+            handler = domain_router.get_chat_model(persona_selected)
+            messages = context_manager.prepare(persona_selected, handler, messages)
+            # Each request runs in its own task, so this is only seen by this request's generation
+            current_request.set(RequestInfo(sender, priority))
+
+            self.set_header('Content-Type', 'text/event-stream; charset=utf-8')
+            self.set_header('Cache-Control', 'no-cache')
+            record_reply = lambda reply: {'version': conversation_store.record_reply(dialog_id, sender, reply, version)}
+            # Runs in its own task, so a disconnect can cancel it wherever it waits
+            self._generation = asyncio.ensure_future(
+                self._write_events(stream_dialog(handler, messages, dialog_id, sender, on_complete=record_reply)))
+            await self._generation
+            observe_request(persona_selected, 200, started)
+        except Overloaded as e:
+            # Raised while waiting for admission, before anything was written
+            logger.warning(f"Rejected dialog {dialog_id}: {str(e)}")
+            self.clear()
+            self.set_status(429)
+            self.set_header('Retry-After', str(e.retry_after))
+            self.finish({'error': 'overloaded', 'retry_after': e.retry_after})
+            observe_request(persona_selected, 429, started)
+        except StreamClosedError:
+            logger.info(f"Client disconnected from dialog {dialog_id}")
+            observe_request(persona_selected, "cancelled", started)
+        except asyncio.CancelledError:
+            if not self._client_gone:
+                raise
+            # Cancelling the generation closed the stream and the backend request
+            logger.info(f"Client disconnected from dialog {dialog_id}")
+            observe_request(persona_selected, "cancelled", started)
+        except Exception as e:
+            logger.error(f"Error in post: {str(e)}")
+            observe_request(persona_selected, 500, started)
+
+class BatchHandler(tornado.web.RequestHandler):
+    def post(self):
+        """Queue a batch job from an uploaded JSONL file, or from input_path on the brain host."""
+        if batch_runner is None:
+            self.set_status(404)
+            self.finish({'error': 'batch jobs are disabled'})
+            return
+        uploads = self.request.files.get('file')
+        concurrency = self.get_body_argument('concurrency', None)
+        try:
+            job = batch_runner.submit(input_path=self.get_body_argument('input_path', None),
+                                      input_lines=uploads[0]['body'] if uploads else None,
+                                      concurrency=int(concurrency) if concurrency else None)
+        except ValueError as e:
+            self.set_status(400)
+            self.finish({'error': str(e)})
+            return
+        self.set_status(202)
+        self.finish(job.stats())
+
+class BatchJobHandler(tornado.web.RequestHandler):
+    def _job(self, job_id):
+        job = batch_runner.get(job_id) if batch_runner is not None else None
+        if job is None:
+            self.set_status(404)
+            self.finish({'error': 'unknown batch job'})
+        return job
+
+    def get(self, job_id):
+        """Progress of a batch job."""
+        if job := self._job(job_id):
+            self.finish(job.stats())
+
+    def delete(self, job_id):
+        """Cancel a batch job."""
+        if job := self._job(job_id):
+            batch_runner.cancel(job_id)
+            self.finish(job.stats())
+
+class BatchOutputHandler(BatchJobHandler):
+    async def get(self, job_id):
+        """The results written so far, as JSONL."""
+        if job := self._job(job_id):
+            self.set_header('Content-Type', 'application/x-ndjson')
+            if os.path.exists(job.output_path):
+                # Sent in chunks, so a large output does not hold up the streams on the loop
+                with open(job.output_path, 'rb') as f:
+                    while chunk := f.read(OUTPUT_CHUNK_BYTES):
+                        self.write(chunk)
+                        await self.flush()
+            self.finish()
+
+class MetricsHandler(tornado.web.RequestHandler):
+    def get(self):
+        """Latency, token and error metrics in the Prometheus text format."""
+        self.set_header('Content-Type', CONTENT_TYPE)
+        self.finish(registry.render())
+
+class ReadyHandler(tornado.web.RequestHandler):
+    def get(self):
+        """Readiness, with the warm-up state of every model. Requests are served while models load."""
+        self.write(domain_router.readiness())
+
+def make_app():
+    return tornado.web.Application([
+        (r"/metrics", MetricsHandler),
+        (r"/ready", ReadyHandler),
+        (r"/batch", BatchHandler),
+        (r"/batch/([^/]+)", BatchJobHandler),
+        (r"/batch/([^/]+)/output", BatchOutputHandler),
+        (r"/([^/]+)", DialogHandler),
+    ])
+
+async def serve(port=PORT):
+    """Serve until SIGINT/SIGTERM is received."""
+    server = make_app().listen(port, xheaders=True)
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop_event.set)
+    # Summaries are scheduled on the loop serving the streams
+    context_manager.run_on(loop)
+    if batch_runner is not None:
+        batch_runner.run_on(loop)
+        batch_runner.resume_jobs()
+    logger.info(f"Async brain server listening on port {port}")
+    await stop_event.wait()
+    server.stop()
+    await server.close_all_connections()
+
+def cleanup():
+    """Cleanup function to be called when the server shuts down."""
+    try:
+        logger.info("Starting server cleanup")
+        logger.info(f"Handler pool stats: {domain_router.stats()}")
+        logger.info(f"Context window stats: {context_manager.stats()}")
+        logger.info(f"Conversation store stats: {conversation_store.stats()}")
+        if batch_runner is not None:
+            # Running jobs stop at their checkpoint and resume at the next start
+            batch_runner.close()
+        context_manager.close()
+        conversation_store.close()
+        config_service.close()
+        domain_router.close()
+        logger.info("Server cleanup completed")
+    except Exception as e:
+        logger.error(f"Error during server cleanup: {str(e)}")
+
+if __name__ == '__main__':
+    print("Starting artmind brain server (async mode)...")
+    setup_logging()
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    config_service.start()
+    domain_router.start_warmup()
+    try:
+        loop.run_until_complete(serve())
+    finally:
+        # Run cleanup while the loop is still open so pooled async clients close cleanly
+        cleanup()
+        loop.close()
@@ -1,6 +1,11 @@
 import cattrs
-from attrs import define
+from attrs import define, field
+import os
+import threading
 import yaml
+from loguru import logger
+from watchdog.events import FileSystemEventHandler
+from watchdog.observers import Observer
 
 # ---------------------------------------------------------
 # Defining the config structure in the form of classes, and then loading it via a function
@@ -9,6 +14,11 @@ import yaml
 CONFIG_YAML = "./config/config.yaml"
 
 
+@define
+class EndpointConfig:
+    base_url: str
+    weight: float = 1.0  # share of requests relative to the persona's other endpoints
+
 @define
 class PersonaModelConfig:
     persona_name: str
@@ -18,6 +28,102 @@ class PersonaModelConfig:
     api_key: str
     icon: str
     persona_prompt: str
+    embed_batch_size: int = 64
+    embed_concurrency: int = 4
+    context_budget_tokens: int = 8192
+    response_reserve_tokens: int = 1024
+    keep_recent_messages: int = 6
+    summarize_history: bool = True
+    response_cache_ttl_seconds: int = 0  # 0 never caches this persona's answers
+    max_concurrency: int = 0  # generations of this persona at once, 0 only applies the backend limit
+    endpoints: list[EndpointConfig] = field(factory=list)  # several inference hosts instead of base_url
+
+@define
+class DatabasePoolConfig:
+    pool_size: int = 5
+    max_overflow: int = 10
+    pool_timeout: int = 30
+    pool_recycle: int = 1800
+    pool_pre_ping: bool = True
+
+@define
+class EmbeddingCacheConfig:
+    enabled: bool = True
+    cache_dir: str = "./storage/embedding_cache"
+    memory_entries: int = 10000
+    disk_entries: int = 1000000
+
+@define
+class IngestionConfig:
+    embed_persona: str = "Documents"
+    manifest_path: str = "./storage/ingest_manifest.json"
+    workers: int = 0  # 0 uses one worker per CPU
+    chunk_size: int = 1000
+    chunk_overlap: int = 200
+    pages_per_task: int = 16
+
+@define
+class ContextWindowConfig:
+    summary_block_messages: int = 8  # older turns are folded into the summary this many at a time
+    summary_max_tokens: int = 256
+    summary_cache_entries: int = 1024
+    summary_workers: int = 2
+
+@define
+class ConversationStoreConfig:
+    max_dialogs: int = 1000
+    max_chars: int = 50000000
+    spill_to_database: bool = False  # write evicted dialogs to the chat database instead of dropping them
+    spill_ttl_seconds: int = 604800
+
+@define
+class StreamRenderConfig:
+    fps: float = 15  # repaints per second while a response streams in
+    max_pending_chars: int = 1024  # repaint early once this much text is waiting
+
+@define
+class ResponseCacheConfig:
+    enabled: bool = False
+    memory_entries: int = 1000
+    memory_bytes: int = 67108864
+    cache_dir: str = ""  # empty keeps the cache in memory only
+    disk_bytes: int = 1073741824
+
+@define
+class SchedulerConfig:
+    enabled: bool = True
+    backend_concurrency: int = 4  # generations at once per backend (llm_host and base_url)
+    backend_limits: dict[str, int] = field(factory=dict)  # base_url -> backend_concurrency override
+    max_queue: int = 64
+    max_queue_per_sender: int = 8
+    max_wait_seconds: float = 30
+
+@define
+class LoadBalancingConfig:
+    health_check_interval_seconds: float = 10
+    health_check_timeout_seconds: float = 2
+    failure_threshold: int = 3  # consecutive failures that take an endpoint out of rotation
+    open_seconds: float = 30  # time out of rotation before a trial request is let through
+
+@define
+class WarmupConfig:
+    enabled: bool = True
+    keep_alive_seconds: int = 600  # how long Ollama keeps a model loaded after each request or warm-up
+    active_window_seconds: int = 3600  # models used this recently are kept loaded while idle
+    refresh_seconds: int = 240  # how often kept models are warmed again, below keep_alive_seconds
+    pinned_personas: list[str] = field(factory=list)  # personas whose models are always kept loaded
+    workers: int = 4  # models loaded at once
+
+@define
+class BatchConfig:
+    enabled: bool = True
+    work_dir: str = "./storage/batch"  # job settings, checkpoints and uploaded files
+    concurrency: int = 8  # generations at once per job, unless the job sets its own
+    max_running_jobs: int = 2  # further jobs wait until one finishes
+    backend_concurrency: int = 4  # batch generations at once per backend, over all jobs
+    backend_limits: dict[str, int] = field(factory=dict)  # base_url -> backend_concurrency override
+    checkpoint_seconds: float = 5
+    progress_seconds: float = 10
 
 @define
 class Config:
@@ -27,9 +133,115 @@ class Config:
     database_data_server_url: str
     file_storage: str
     persona_models: dict[str, PersonaModelConfig]
+    database_pool: DatabasePoolConfig = field(factory=DatabasePoolConfig)
+    embedding_cache: EmbeddingCacheConfig = field(factory=EmbeddingCacheConfig)
+    vector_index_path: str = "./storage/vector_index"
+    ingestion: IngestionConfig = field(factory=IngestionConfig)
+    context_window: ContextWindowConfig = field(factory=ContextWindowConfig)
+    conversation_store: ConversationStoreConfig = field(factory=ConversationStoreConfig)
+    stream_render: StreamRenderConfig = field(factory=StreamRenderConfig)
+    response_cache: ResponseCacheConfig = field(factory=ResponseCacheConfig)
+    coalesce_requests: bool = True  # identical concurrent dialog requests share one generation
+    scheduler: SchedulerConfig = field(factory=SchedulerConfig)
+    load_balancing: LoadBalancingConfig = field(factory=LoadBalancingConfig)
+    metrics_enabled: bool = True  # time model calls and export them on /metrics
+    warmup: WarmupConfig = field(factory=WarmupConfig)
+    batch: BatchConfig = field(factory=BatchConfig)
 
-def init_config():
-    with open(CONFIG_YAML) as yaml_stream:
+def init_config(path=CONFIG_YAML):
+    with open(path) as yaml_stream:
         data = yaml.safe_load(yaml_stream)
         config = cattrs.structure(data, Config)
-    return config
\ No newline at end of file
+    return config
+
+class ConfigService:
+    """
+    Parses the config file once and keeps the structured Config for every caller.
+
+    Once started, watchdog reports changes to the file. After changes settle for
+    debounce_seconds, the file is parsed and validated again and the new Config is
+    swapped in as a whole, so a reader never sees a half-updated config. A file that
+    fails to parse or validate is logged and the previous config stays in use.
+    Subscribers are called with the old and new config after each swap.
+    """
+
+    def __init__(self, path=CONFIG_YAML, debounce_seconds=0.5):
+        self.path = os.path.abspath(path)
+        self.debounce_seconds = debounce_seconds
+        self.config = init_config(self.path)
+        self.reloads = 0
+        self.failed_reloads = 0
+        self._subscribers = []
+        self._lock = threading.Lock()
+        self._observer = None
+        self._timer = None
+
+    def subscribe(self, callback):
+        """Call callback(old_config, new_config) after every reload that changes the config."""
+        with self._lock:
+            self._subscribers.append(callback)
+
+    def start(self):
+        """Start watching the config file."""
+        if self._observer is not None:
+            return
+        service = self
+
+        class Handler(FileSystemEventHandler):
+            def on_any_event(self, event):
+                # Reading the file also raises events, only writes and renames matter.
+                # Editors often write a temporary file and rename it over the config.
+                if event.is_directory or event.event_type not in ("created", "modified", "moved", "closed"):
+                    return
+                paths = (event.src_path, getattr(event, "dest_path", ""))
+                if any(path and os.path.abspath(path) == service.path for path in paths):
+                    service._schedule_reload()
+
+        self._observer = Observer()
+        # The directory is watched, since renaming over the file replaces the watched inode
+        self._observer.schedule(Handler(), os.path.dirname(self.path))
+        self._observer.daemon = True
+        self._observer.start()
+        logger.info(f"Watching {self.path} for config changes")
+
+    def _schedule_reload(self):
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+            self._timer = threading.Timer(self.debounce_seconds, self.reload)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def reload(self):
+        """Parse the config file again and swap it in if it is valid and changed."""
+        try:
+            config = init_config(self.path)
+        except Exception as e:
+            self.failed_reloads += 1
+            logger.error(f"Keeping the current config, {self.path} is invalid: {str(e)}")
+            return False
+        with self._lock:
+            old_config = self.config
+            if config == old_config:
+                return False
+            self.config = config
+            self.reloads += 1
+            subscribers = list(self._subscribers)
+        logger.info(f"Reloaded config from {self.path}")
+        for callback in subscribers:
+            try:
+                callback(old_config, config)
+            except Exception as e:
+                logger.error(f"Error applying reloaded config: {str(e)}")
+        return True
+
+    def stats(self) -> dict:
+        return {"reloads": self.reloads, "failed_reloads": self.failed_reloads}
+
+    def close(self):
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+        if self._observer is not None:
+            self._observer.stop()
+            self._observer.join(timeout=2)
\ No newline at end of file
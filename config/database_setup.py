@@ -0,0 +1,59 @@
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from loguru import logger
+import threading
+
+# ---------------------------------------------------------
+# Process-wide SQLAlchemy engines, one bounded connection pool per database URL
+# ---------------------------------------------------------
+_engines = {}
+_lock = threading.Lock()
+
+
+def get_engine(database_url, pool_config=None):
+    """
+    Return the shared engine for a database URL, creating it on first use.
+
+    Args:
+        database_url: SQLAlchemy database URL
+        pool_config: Optional DatabasePoolConfig, only used when the engine is created
+    """
+    with _lock:
+        engine = _engines.get(database_url)
+        if engine is None:
+            pool_kwargs = {}
+            if pool_config is not None:
+                pool_kwargs = {
+                    "pool_size": pool_config.pool_size,
+                    "max_overflow": pool_config.max_overflow,
+                    "pool_timeout": pool_config.pool_timeout,
+                    "pool_recycle": pool_config.pool_recycle,
+                    "pool_pre_ping": pool_config.pool_pre_ping,
+                }
+            engine = create_engine(database_url, **pool_kwargs)
+            _engines[database_url] = engine
+            logger.info(f"Created database engine with pool settings {pool_kwargs}")
+        return engine
+
+
+def get_sessionmaker(database_url, pool_config=None):
+    """Return a session factory bound to the shared engine of a database URL."""
+    return sessionmaker(bind=get_engine(database_url, pool_config))
+
+
+def pool_stats(engine):
+    """Return connection pool statistics of an engine for monitoring."""
+    pool = engine.pool
+    stats = {"status": pool.status()}
+    for name in ("size", "checkedin", "checkedout", "overflow"):
+        if hasattr(pool, name):
+            stats[name] = getattr(pool, name)()
+    return stats
+
+
+def dispose_engine(database_url):
+    """Close all pooled connections of a database URL and forget its engine."""
+    with _lock:
+        engine = _engines.pop(database_url, None)
+    if engine is not None:
+        engine.dispose()
@@ -1,12 +1,50 @@
 from loguru import logger
+import os
 import sys
 
+# Lowest level any sink accepts, so hot paths can skip building log arguments entirely
+_min_level_no = 0
+
+# Per-chunk events are logged for the first chunk of a stream and then every this many chunks
+CHUNK_LOG_EVERY = 100
+
 
 # Add a method for convenience
 def deep_debug(self, message, *args, **kwargs):
-    self.log("DEEPDEBUG", message, *args, **kwargs)
+    # depth=1 so records point at the caller rather than this helper
+    self.opt(depth=1).log("DEEPDEBUG", message, *args, **kwargs)
+
+def log_enabled(level):
+    """Return True if a message at this level would reach any sink."""
+    return logger.level(level).no >= _min_level_no
+
+class LogSampler:
+    """
+    Lets through the first event of a stream and then every n-th one.
+
+    Use it for per-chunk events, so a long stream logs a handful of lines instead of one per token.
+    """
 
-def setup_logging():
+    def __init__(self, every=CHUNK_LOG_EVERY):
+        self.every = every
+        self.count = 0
+
+    def __call__(self):
+        self.count += 1
+        return self.count == 1 or self.count % self.every == 0
+
+def setup_logging(enqueue=True, deep_debug_enabled=None, log_dir="logs"):
+    """
+    Configure the file and stderr sinks.
+
+    Args:
+        enqueue: Hand records to a background writer thread, so serialization and
+            disk writes happen off the calling thread and the event loop
+        deep_debug_enabled: Add the DEEPDEBUG sink; defaults to the ARTMIND_DEEP_DEBUG
+            environment variable, and when off DEEPDEBUG calls return before formatting
+        log_dir: Directory of the log files
+    """
+    global _min_level_no
     logger.remove()
 
     # Define a custom level called "DEEPDEBUG" with a lower level number than DEBUG (10)
@@ -19,7 +57,12 @@ def setup_logging():
 
     logger.deep_debug = deep_debug.__get__(logger)
 
-    logger.add("logs/info.log", level="INFO", format="{time} | {level} | {message}", rotation="10 MB", serialize=True)
-    logger.add("logs/debug.log", level="DEBUG", format="{time} | {level} | {message}", rotation="10 MB", serialize=True)
-    logger.add("logs/deepdebug.log", level="DEEPDEBUG", format="{time} | {level} | {message}", rotation="10 MB", serialize=True)
-    logger.add(sys.stderr, level="ERROR")
\ No newline at end of file
+    if deep_debug_enabled is None:
+        deep_debug_enabled = os.environ.get("ARTMIND_DEEP_DEBUG", "").lower() in ("1", "true", "yes")
+
+    logger.add(os.path.join(log_dir, "info.log"), level="INFO", format="{time} | {level} | {message}", rotation="10 MB", serialize=True, enqueue=enqueue)
+    logger.add(os.path.join(log_dir, "debug.log"), level="DEBUG", format="{time} | {level} | {message}", rotation="10 MB", serialize=True, enqueue=enqueue)
+    if deep_debug_enabled:
+        logger.add(os.path.join(log_dir, "deepdebug.log"), level="DEEPDEBUG", format="{time} | {level} | {message}", rotation="10 MB", serialize=True, enqueue=enqueue)
+    logger.add(sys.stderr, level="ERROR")
+    _min_level_no = logger.level("DEEPDEBUG" if deep_debug_enabled else "DEBUG").no
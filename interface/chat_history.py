@@ -1,35 +1,129 @@
-from sqlalchemy import create_engine, text
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy import text
 from datetime import datetime
 import json
+import re
+import threading
+import time
 from loguru import logger
+from config.database_setup import get_engine, get_sessionmaker, pool_stats, dispose_engine
 
-def init_db_connection(database_url):
-    """Initialize database connection."""
-    engine = create_engine(database_url)
-    Session = sessionmaker(bind=engine)
-    return Session()
+# Seconds a cached sidebar listing stays valid, bounds staleness across processes
+HISTORY_LIST_CACHE_TTL = 60
+
+# Text search configuration used to index and query chat histories
+SEARCH_CONFIG = "english"
+
+# Seconds a cached search result stays valid; Streamlit repeats the search on every rerun
+SEARCH_CACHE_TTL = 30
+
+# Database URLs whose schema has already been set up by this process
+_schema_ready = set()
+_schema_lock = threading.Lock()
+
+def ensure_schema(database_url, Session):
+    """Create and migrate the chat tables once per process."""
+    with _schema_lock:
+        if database_url in _schema_ready:
+            return
+        with Session() as session:
+            create_chat_history_table(session)
+        _schema_ready.add(database_url)
 
 def create_chat_history_table(session):
-    """Create the chat_history table if it doesn't exist."""
+    """Create the chat_history and chat_message tables if they don't exist."""
     query = """
     CREATE TABLE IF NOT EXISTS chat_history (
         id SERIAL PRIMARY KEY,
         user_name TEXT NOT NULL,
         persona TEXT NOT NULL,
         title TEXT NOT NULL,
-        messages JSONB NOT NULL,
+        messages JSONB,
+        message_count INTEGER NOT NULL DEFAULT 0,
         created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
         updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
     );
+    ALTER TABLE chat_history ALTER COLUMN messages DROP NOT NULL;
+    ALTER TABLE chat_history ADD COLUMN IF NOT EXISTS message_count INTEGER NOT NULL DEFAULT 0;
+    CREATE TABLE IF NOT EXISTS chat_message (
+        history_id INTEGER NOT NULL REFERENCES chat_history(id) ON DELETE CASCADE,
+        seq INTEGER NOT NULL,
+        role TEXT NOT NULL,
+        content TEXT NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (history_id, seq)
+    );
+    CREATE INDEX IF NOT EXISTS chat_history_user_created_idx
+        ON chat_history (user_name, created_at DESC, id DESC);
+    ALTER TABLE chat_history ADD COLUMN IF NOT EXISTS search_vector tsvector;
+    CREATE INDEX IF NOT EXISTS chat_history_search_idx
+        ON chat_history USING GIN (search_vector);
     """
     session.execute(text(query))
     session.commit()
+    migrate_chat_messages(session)
+    index_chat_histories(session)
+
+def migrate_chat_messages(session):
+    """Move messages stored in the legacy chat_history.messages JSONB column into chat_message rows."""
+    query = """
+    INSERT INTO chat_message (history_id, seq, role, content, created_at)
+    SELECT h.id, m.ordinality - 1, m.value->>'role', COALESCE(m.value->>'content', ''), h.created_at
+    FROM chat_history h
+    CROSS JOIN LATERAL jsonb_array_elements(h.messages) WITH ORDINALITY AS m(value, ordinality)
+    WHERE h.messages IS NOT NULL AND jsonb_typeof(h.messages) = 'array'
+    ON CONFLICT (history_id, seq) DO NOTHING;
+
+    UPDATE chat_history
+    SET message_count = CASE WHEN jsonb_typeof(messages) = 'array' THEN jsonb_array_length(messages) ELSE 0 END,
+        messages = NULL
+    WHERE messages IS NOT NULL;
+    """
+    result = session.execute(text(query))
+    session.commit()
+    if result.rowcount:
+        logger.info(f"Migrated {result.rowcount} chat histories to chat_message rows")
+
+def index_chat_histories(session):
+    """
+    Build the search vector of chats saved before search existed.
+
+    Saves keep it up to date afterwards, so each row is only indexed here once.
+    """
+    query = f"""
+    UPDATE chat_history h
+    SET search_vector = setweight(to_tsvector('{SEARCH_CONFIG}', h.title), 'A')
+        || COALESCE((SELECT to_tsvector('{SEARCH_CONFIG}', string_agg(m.content, ' ' ORDER BY m.seq))
+                     FROM chat_message m WHERE m.history_id = h.id), ''::tsvector)
+    WHERE h.search_vector IS NULL;
+    """
+    result = session.execute(text(query))
+    session.commit()
+    if result.rowcount:
+        logger.info(f"Indexed {result.rowcount} chat histories for search")
+
+def search_terms(search_text):
+    """
+    Split a search box query into a web search style query and a prefix.
+
+    The last word is matched as a prefix, so chats show up while it is still being typed.
+    """
+    search_text = search_text.strip()
+    words = search_text.split()
+    if words and re.fullmatch(r"\w+", words[-1]):
+        return " ".join(words[:-1]), words[-1]
+    return search_text, ""
 
 class ChatHistoryManager:
-    def __init__(self, database_url):
-        self.session = init_db_connection(database_url)
-        create_chat_history_table(self.session)
+    def __init__(self, database_url, pool_config=None):
+        self.database_url = database_url
+        # Sessions are short-lived and drawn from the shared, bounded engine pool
+        self.Session = get_sessionmaker(database_url, pool_config)
+        ensure_schema(database_url, self.Session)
+        # Per-user sidebar listings: {user_name: {"items", "cursor", "exhausted", "loaded_at"}}
+        self._listing_cache = {}
+        self._listing_lock = threading.Lock()
+        # Last search of each user: {user_name: ((search_text, limit), results, has_more, loaded_at)}
+        self._search_cache = {}
 
     def generate_chat_title(self, text, existing_titles=None):
         """Generate a title for the chat using basic text processing."""
@@ -61,40 +155,111 @@ class ChatHistoryManager:
             return "New Chat"
 
     def save_chat_history(self, user_name, persona, messages, title):
-        """Save chat history to database."""
+        """Save a new chat history to database and return its id."""
         try:
-            # Convert messages to JSON string if it's a list
-            if isinstance(messages, list):
-                messages_json = json.dumps(messages)
-            else:
-                messages_json = messages
+            # Accept a JSON string for backwards compatibility
+            if isinstance(messages, str):
+                messages = json.loads(messages)
 
-            query = """
-            INSERT INTO chat_history (user_name, persona, title, messages)
-            VALUES (:user_name, :persona, :title, :messages)
+            query = f"""
+            INSERT INTO chat_history (user_name, persona, title, search_vector)
+            VALUES (:user_name, :persona, :title, setweight(to_tsvector('{SEARCH_CONFIG}', :title), 'A'))
             RETURNING id;
             """
-            result = self.session.execute(
-                text(query),
-                {
-                    "user_name": user_name,
-                    "persona": persona,
-                    "title": title,
-                    "messages": messages_json
-                }
-            )
-            self.session.commit()
-            return result.scalar()
+            with self.Session() as session:
+                result = session.execute(
+                    text(query),
+                    {
+                        "user_name": user_name,
+                        "persona": persona,
+                        "title": title
+                    }
+                )
+                history_id = result.scalar()
+                self._insert_messages(session, history_id, messages, start_seq=0)
+                session.commit()
+            self.invalidate_listing(user_name)
+            return history_id
         except Exception as e:
             logger.error(f"Error saving chat history: {str(e)}")
-            self.session.rollback()
             raise
 
+    def append_messages(self, history_id, messages, start_seq):
+        """Append only the new messages of a chat, numbered from start_seq."""
+        try:
+            if not messages:
+                return
+            with self.Session() as session:
+                self._insert_messages(session, history_id, messages, start_seq)
+                session.commit()
+            # The owner is not known here, and searches are cheap to repeat
+            with self._listing_lock:
+                self._search_cache.clear()
+        except Exception as e:
+            logger.error(f"Error appending chat messages: {str(e)}")
+            raise
+
+    def _insert_messages(self, session, history_id, messages, start_seq):
+        """Insert message rows and bump the history's message count, without committing."""
+        if messages:
+            query = """
+            INSERT INTO chat_message (history_id, seq, role, content)
+            VALUES (:history_id, :seq, :role, :content);
+            """
+            session.execute(
+                text(query),
+                [
+                    {
+                        "history_id": history_id,
+                        "seq": start_seq + offset,
+                        "role": message["role"],
+                        "content": message["content"]
+                    }
+                    for offset, message in enumerate(messages)
+                ]
+            )
+        # Only the new messages are added to the search vector
+        query = f"""
+        UPDATE chat_history
+        SET message_count = :message_count, updated_at = CURRENT_TIMESTAMP,
+            search_vector = COALESCE(search_vector, ''::tsvector) || to_tsvector('{SEARCH_CONFIG}', :new_text)
+        WHERE id = :history_id;
+        """
+        session.execute(
+            text(query),
+            {
+                "history_id": history_id,
+                "message_count": start_seq + len(messages),
+                "new_text": " ".join(message["content"] for message in messages)
+            }
+        )
+
+    def get_messages(self, history_ids):
+        """Retrieve the ordered messages of one or more chat histories, keyed by history id."""
+        with self.Session() as session:
+            return self._get_messages(session, history_ids)
+
+    def _get_messages(self, session, history_ids):
+        """Retrieve messages keyed by history id within an open session."""
+        if not history_ids:
+            return {}
+        query = """
+        SELECT history_id, role, content
+        FROM chat_message
+        WHERE history_id = ANY(:history_ids)
+        ORDER BY history_id, seq
+        """
+        result = session.execute(text(query), {"history_ids": list(history_ids)})
+        messages = {history_id: [] for history_id in history_ids}
+        for row in result:
+            messages[row[0]].append({"role": row[1], "content": row[2]})
+        return messages
+
     def get_chat_histories(self, user_name=None, limit=10):
         """Retrieve chat histories from database."""
         try:
             query = """
-            SELECT id, user_name, persona, title, messages, created_at, updated_at
+            SELECT id, user_name, persona, title, created_at, updated_at
             FROM chat_history
             """
             params = {}
@@ -105,22 +270,19 @@ class ChatHistoryManager:
             query += " ORDER BY created_at DESC LIMIT :limit"
             params["limit"] = limit
             
-            result = self.session.execute(text(query), params)
+            with self.Session() as session:
+                rows = session.execute(text(query), params).all()
+                messages = self._get_messages(session, [row[0] for row in rows])
             histories = []
-            for row in result:
-                # Handle both string and list message formats
-                messages = row[4]
-                if isinstance(messages, str):
-                    messages = json.loads(messages)
-                
+            for row in rows:
                 histories.append({
                     "id": row[0],
                     "user_name": row[1],
                     "persona": row[2],
                     "title": row[3],
-                    "messages": messages,
-                    "created_at": row[5],
-                    "updated_at": row[6]
+                    "messages": messages[row[0]],
+                    "created_at": row[4],
+                    "updated_at": row[5]
                 })
             return histories
         except Exception as e:
@@ -131,35 +293,175 @@ class ChatHistoryManager:
         """Retrieve a specific chat history by ID."""
         try:
             query = """
-            SELECT id, user_name, persona, title, messages, created_at, updated_at
+            SELECT id, user_name, persona, title, created_at, updated_at
             FROM chat_history
             WHERE id = :history_id
             """
-            result = self.session.execute(text(query), {"history_id": history_id})
-            row = result.first()
-            if row:
-                # Handle both string and list message formats
-                messages = row[4]
-                if isinstance(messages, str):
-                    messages = json.loads(messages)
-                    
-                return {
-                    "id": row[0],
-                    "user_name": row[1],
-                    "persona": row[2],
-                    "title": row[3],
-                    "messages": messages,
-                    "created_at": row[5],
-                    "updated_at": row[6]
-                }
+            with self.Session() as session:
+                row = session.execute(text(query), {"history_id": history_id}).first()
+                if row:
+                    return {
+                        "id": row[0],
+                        "user_name": row[1],
+                        "persona": row[2],
+                        "title": row[3],
+                        "messages": self._get_messages(session, [row[0]])[row[0]],
+                        "created_at": row[4],
+                        "updated_at": row[5]
+                    }
             return None
         except Exception as e:
             logger.error(f"Error retrieving chat history: {str(e)}")
             raise
 
+    def list_chat_histories(self, user_name, limit=10, before=None):
+        """
+        List chat metadata for the sidebar without touching message bodies.
+
+        Args:
+            user_name: Owner of the chats
+            limit: Maximum number of rows to return
+            before: Keyset cursor (created_at, id) of the last row of the previous page
+
+        Returns:
+            A list of dicts with id, title and created_at, newest first
+        """
+        try:
+            query = """
+            SELECT id, title, created_at
+            FROM chat_history
+            WHERE user_name = :user_name
+            """
+            params = {"user_name": user_name, "limit": limit}
+            if before is not None:
+                query += " AND (created_at, id) < (:before_created_at, :before_id)"
+                params["before_created_at"], params["before_id"] = before
+
+            query += " ORDER BY created_at DESC, id DESC LIMIT :limit"
+            with self.Session() as session:
+                result = session.execute(text(query), params)
+                return [{"id": row[0], "title": row[1], "created_at": row[2]} for row in result]
+        except Exception as e:
+            logger.error(f"Error listing chat histories: {str(e)}")
+            raise
+
+    def search_chat_histories(self, user_name, search_text, limit=10, offset=0):
+        """
+        Rank a user's chats by how well their title and messages match a search.
+
+        Matching uses the GIN-indexed search vector, and only the page of results
+        reads message bodies, to cut a snippet around the first matching message.
+
+        Args:
+            user_name: Owner of the chats
+            search_text: Words to find, with web search syntax ("quoted phrase", -excluded, or)
+            limit: Maximum number of rows to return
+            offset: Number of better ranked rows to skip
+
+        Returns:
+            A list of dicts with id, title and snippet, best match first. The snippet is
+            empty when no single message matches, e.g. when only the title does.
+        """
+        words, prefix = search_terms(search_text)
+        if not words and not prefix:
+            return []
+        query = f"""
+        WITH search AS (
+            SELECT websearch_to_tsquery('{SEARCH_CONFIG}', :words)
+                   && to_tsquery('{SEARCH_CONFIG}', :prefix) AS query
+        ), page AS (
+            SELECT h.id, h.title, ts_rank(h.search_vector, search.query) AS rank
+            FROM chat_history h, search
+            WHERE h.user_name = :user_name AND h.search_vector @@ search.query
+            ORDER BY rank DESC, h.id DESC
+            LIMIT :limit OFFSET :offset
+        )
+        SELECT page.id, page.title,
+               (SELECT ts_headline('{SEARCH_CONFIG}', m.content, search.query,
+                                   'StartSel=**, StopSel=**, MaxWords=20, MinWords=8')
+                FROM chat_message m
+                WHERE m.history_id = page.id AND to_tsvector('{SEARCH_CONFIG}', m.content) @@ search.query
+                ORDER BY m.seq
+                LIMIT 1)
+        FROM page, search
+        ORDER BY page.rank DESC, page.id DESC
+        """
+        params = {
+            "user_name": user_name,
+            "words": words,
+            # A quoted prefix so punctuation-free words are never read as query operators
+            "prefix": f"'{prefix}':*" if prefix else "",
+            "limit": limit,
+            "offset": offset,
+        }
+        try:
+            with self.Session() as session:
+                result = session.execute(text(query), params)
+                return [{"id": row[0], "title": row[1], "snippet": row[2] or ""} for row in result]
+        except Exception as e:
+            logger.error(f"Error searching chat histories: {str(e)}")
+            raise
+
+    def search_history_options(self, user_name, search_text, limit=10):
+        """
+        Build sidebar options from the best matching chats of a search.
+
+        Returns:
+            The options, the option to history id mapping, the snippet of each option,
+            and whether more results exist
+        """
+        key = (search_text, limit)
+        with self._listing_lock:
+            cached = self._search_cache.get(user_name)
+        if cached is not None and cached[0] == key and time.monotonic() - cached[3] <= SEARCH_CACHE_TTL:
+            results, has_more = cached[1], cached[2]
+        else:
+            # Fetch one extra row to know whether another page exists
+            results = self.search_chat_histories(user_name, search_text, limit=limit + 1)
+            has_more = len(results) > limit
+            results = results[:limit]
+            with self._listing_lock:
+                self._search_cache[user_name] = (key, results, has_more, time.monotonic())
+
+        history_options = ["New Chat"]
+        history_dict = {"New Chat": None}
+        snippets = {}
+        for result in results:
+            option_text = result["title"]
+            history_options.append(option_text)
+            history_dict[option_text] = result["id"]
+            snippets[option_text] = result["snippet"]
+        return history_options, history_dict, snippets, has_more
+
+    def invalidate_listing(self, user_name):
+        """Drop the cached sidebar listing and search of a user."""
+        with self._listing_lock:
+            self._listing_cache.pop(user_name, None)
+            self._search_cache.pop(user_name, None)
+
+    def _get_listing(self, user_name, limit):
+        """Return at least limit cached listing rows, fetching only the missing pages."""
+        with self._listing_lock:
+            entry = self._listing_cache.get(user_name)
+            if entry is None or time.monotonic() - entry["loaded_at"] > HISTORY_LIST_CACHE_TTL:
+                entry = {"items": [], "cursor": None, "exhausted": False, "loaded_at": time.monotonic()}
+                self._listing_cache[user_name] = entry
+
+            missing = limit - len(entry["items"])
+            if missing > 0 and not entry["exhausted"]:
+                # Fetch one extra row to know whether another page exists
+                rows = self.list_chat_histories(user_name, limit=missing + 1, before=entry["cursor"])
+                entry["exhausted"] = len(rows) <= missing
+                rows = rows[:missing]
+                entry["items"].extend(rows)
+                if rows:
+                    entry["cursor"] = (rows[-1]["created_at"], rows[-1]["id"])
+            has_more = len(entry["items"]) > limit or not entry["exhausted"]
+            return entry["items"][:limit], has_more
+
     def build_history_options(self, user_name, limit=10):
         """Build chat history options and mapping for the UI."""
-        histories = self.get_chat_histories(user_name=user_name, limit=limit)
+        histories, has_more = self._get_listing(user_name, limit)
         history_options = ["New Chat"]
         history_dict = {"New Chat": None}
         existing_titles = set()
@@ -170,7 +472,7 @@ class ChatHistoryManager:
             history_dict[option_text] = history["id"]
             existing_titles.add(option_text)
 
-        return history_options, history_dict, existing_titles
+        return history_options, history_dict, existing_titles, has_more
 
     def load_chat_history(self, state, history_id):
         """Load a specific chat history into the session state."""
@@ -179,23 +481,41 @@ class ChatHistoryManager:
             if history:
                 state.history = history["messages"]
                 state.current_history_id = history_id
+                state.saved_message_count = len(history["messages"])
+                state.new_dialog()
                 return True
         except Exception as e:
             logger.error(f"Failed to load chat history: {str(e)}")
         return False
 
+    def save_chat(self, state, existing_titles):
+        """
+        Save the current chat incrementally.
+
+        A chat that was loaded or saved before only gets its new messages appended,
+        so the cost is proportional to the new turns rather than the whole conversation.
+        """
+        if not state.history or len(state.history) <= 1:
+            return
+        if state.current_history_id is not None:
+            new_messages = state.history[state.saved_message_count:]
+            self.append_messages(state.current_history_id, new_messages, state.saved_message_count)
+            logger.info(f"Appended {len(new_messages)} messages to chat history {state.current_history_id}")
+        else:
+            title = "New Chat"
+            for message in state.history:
+                if message["role"] == "user":
+                    title = self.generate_chat_title(message["content"], existing_titles)
+                    break
+
+            state.current_history_id = self.save_chat_history(state.user_name, state.persona_selected, state.history, title)
+            logger.info(f"Saved chat history with title: {title}")
+        state.saved_message_count = len(state.history)
+
     def save_and_reset_chat(self, state, existing_titles):
         """Save the current chat history and reset the session state."""
         try:
-            if state.history and len(state.history) > 1:
-                title = "New Chat"
-                for message in state.history:
-                    if message["role"] == "user":
-                        title = self.generate_chat_title(message["content"], existing_titles)
-                        break
-
-                self.save_chat_history(state.user_name, state.persona_selected, state.history, title)
-                logger.info(f"Saved chat history with title: {title}")
+            self.save_chat(state, existing_titles)
 
             # Reset session state
             current_persona = state.persona_selected
@@ -206,9 +526,13 @@ class ChatHistoryManager:
             logger.error(f"Failed to save and reset chat: {str(e)}")
             return False
 
+    def pool_stats(self):
+        """Return statistics of the shared connection pool for monitoring."""
+        return pool_stats(get_engine(self.database_url))
+
     def close(self):
-        """Close the database session."""
+        """Close all pooled connections of the shared engine, e.g. at process shutdown."""
         try:
-            self.session.close()
+            dispose_engine(self.database_url)
         except Exception as e:
-            logger.error(f"Error closing chat history session: {str(e)}")
\ No newline at end of file
+            logger.error(f"Error closing chat history connections: {str(e)}")
\ No newline at end of file
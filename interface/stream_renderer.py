@@ -0,0 +1,55 @@
+import time
+
+CURSOR = "▌"
+
+
+class StreamRenderer:
+    """
+    Buffers streamed chunks and repaints a Streamlit placeholder at a bounded rate.
+
+    Every repaint re-renders the whole accumulated markdown, so repainting per token
+    costs O(n²) over an answer. Chunks are appended to a list instead, and the text is
+    joined and painted only when a frame interval has passed or enough new text is
+    pending, so the work per answer grows with the number of frames, not tokens.
+    """
+
+    def __init__(self, placeholder, fps=15, max_pending_chars=1024, clock=time.monotonic):
+        self.placeholder = placeholder
+        self.frame_interval = 1.0 / fps if fps > 0 else 0.0
+        self.max_pending_chars = max_pending_chars
+        self.clock = clock
+        self._parts = []
+        self._pending_chars = 0
+        self._last_paint = None
+        self.chunks = 0
+        self.paints = 0
+
+    @property
+    def text(self):
+        """The full text received so far."""
+        if len(self._parts) > 1:
+            self._parts = ["".join(self._parts)]
+        return self._parts[0] if self._parts else ""
+
+    def append(self, chunk):
+        """Buffer a chunk and repaint if a frame is due."""
+        self._parts.append(chunk)
+        self._pending_chars += len(chunk)
+        self.chunks += 1
+        now = self.clock()
+        if (self._last_paint is None or now - self._last_paint >= self.frame_interval
+                or self._pending_chars >= self.max_pending_chars):
+            self._paint(self.text + CURSOR, now)
+
+    def finish(self):
+        """Paint the complete text without the cursor and return it."""
+        text = self.text
+        if text:
+            self._paint(text, self.clock())
+        return text
+
+    def _paint(self, markdown, now):
+        self.placeholder.markdown(markdown)
+        self._pending_chars = 0
+        self._last_paint = now
+        self.paints += 1
@@ -4,20 +4,21 @@ import json
 import requests
 from requests.adapters import HTTPAdapter
 from urllib3.util.retry import Retry
+from interface.stream_renderer import StreamRenderer
 
-def process_streaming_message(data_line, message_placeholder, full_response):
-    """Process a single SSE data line and update the UI."""
+def process_streaming_message(data_line, renderer, state=None):
+    """Process a single SSE data line and hand its content to the renderer."""
     try:
         chunk_data = json.loads(data_line)
         if chunk_data.get('is_chunk') and (message := chunk_data.get('message')):
-            full_response += message
-            message_placeholder.markdown(full_response + "▌")
-            logger.debug(f"Updated response: {full_response}")
+            renderer.append(message)
+        elif not chunk_data.get('is_chunk') and state is not None:
+            # The final event carries the dialog version the brain now holds
+            state.dialog_version = chunk_data.get('version')
     except json.JSONDecodeError:
         logger.error(f"Failed to parse chunk: {data_line}")
     except Exception as e:
         logger.error(f"Error processing chunk: {data_line}, error: {e}")
-    return full_response
 
 def get_response_handle(artmind_server_url: str, payload: dict) -> requests.Response:
     """Get response from server with increased timeout and retries."""
@@ -44,6 +45,18 @@ def get_response_handle(artmind_server_url: str, payload: dict) -> requests.Resp
         logger.error(f"Error making request to server: {str(e)}")
         raise
 
+def stop_generation(state, partial_response):
+    """
+    Keep what was received of a stopped answer.
+
+    The brain does not record a stopped answer, so the next request resends the
+    full history instead of a delta.
+    """
+    logger.info(f"Stopped generation of dialog {state.dialog_id} after {len(partial_response)} chars")
+    if partial_response:
+        state.history.append({"role": "assistant", "content": partial_response})
+    state.dialog_version = None
+
 def display_chat_messages(messages):
     """Display all messages in the chat history."""
     for message in messages:
@@ -63,7 +76,6 @@ def handle_chat_input(config, persona_selected, state):
     # Prepare for assistant response
     with st.chat_message("assistant"):
         message_placeholder = st.empty()
-        full_response = ""
         
         try:
             # Ensure system prompt is included
@@ -72,17 +84,37 @@ def handle_chat_input(config, persona_selected, state):
                 persona_prompt = config.persona_models[persona_selected].persona_prompt
                 messages_with_system = [{"role": "system", "content": persona_prompt}] + messages_with_system
             
-            # Get streaming response
-            response = get_response_handle(
-                config.artmind_server_url,
-                { ## -- The following should match the parameters received in the brain -- ##
-                    "sender": state.user_name,
-                    "persona_selected": state.persona_selected,
-                    "messages": json.dumps(messages_with_system),  # Send full message history
-                    # "upload_dir": state.upload_dir,
-                }
-            )
+            dialog_url = f"{config.artmind_server_url}/{state.dialog_id}"
+            payload = { ## -- The following should match the parameters received in the brain -- ##
+                "sender": state.user_name,
+                "persona_selected": state.persona_selected,
+                # "upload_dir": state.upload_dir,
+            }
+            if state.dialog_persona != persona_selected:
+                # The brain's copy starts with the previous persona's prompt, resend it all
+                state.dialog_version = None
+            if state.dialog_version is not None:
+                # The brain holds the history up to dialog_version, send only the new message
+                delta = dict(payload, new_messages=json.dumps([state.history[-1]]), version=state.dialog_version)
+                response = get_response_handle(dialog_url, delta)
+                if response.status_code == 409:
+                    logger.info(f"Brain asked to resync dialog {state.dialog_id}")
+                    response.close()
+                    state.dialog_version = None
+            if state.dialog_version is None:
+                # First turn or resync: send the full message history
+                response = get_response_handle(dialog_url, dict(payload, messages=json.dumps(messages_with_system)))
+                state.dialog_persona = persona_selected
             
+            if response.status_code != 200:
+                response.close()
+
+            if response.status_code == 429:
+                retry_after = response.headers.get("Retry-After", "a few")
+                logger.warning(f"Brain is overloaded, retry after {retry_after}s")
+                message_placeholder.warning(f"The assistant is busy, please try again in {retry_after} seconds.")
+                return
+
             if response.status_code != 200:
                 logger.error(f"Server error: {response.status_code}")
                 message_placeholder.error(f"Server error: {response.status_code}")
@@ -91,7 +123,13 @@ def handle_chat_input(config, persona_selected, state):
             # Show initial cursor and process stream
             message_placeholder.markdown("▌")
             response.encoding = 'utf-8'
+            renderer = StreamRenderer(message_placeholder, fps=config.stream_render.fps,
+                                      max_pending_chars=config.stream_render.max_pending_chars)
+            # Clicking stop reruns the script, which interrupts the loop below at its next repaint
+            stop_placeholder = st.empty()
+            stop_placeholder.button("Stop generating", key=f"stop_{state.dialog_id}")
             
+            interrupted = True
             try:
                 for line in response.iter_lines(decode_unicode=True):
                     if not line:
@@ -104,20 +142,26 @@ def handle_chat_input(config, persona_selected, state):
                     if data == "[DONE]":
                         break
                         
-                    full_response = process_streaming_message(
-                        data,
-                        message_placeholder,
-                        full_response
-                    )
+                    process_streaming_message(data, renderer, state)
+                interrupted = False
 
             except Exception as e:
+                interrupted = False
                 logger.exception("Error reading stream")
                 message_placeholder.error("Error reading response stream")
                 return
+            finally:
+                # Closing the connection is what makes the brain cancel the generation
+                response.close()
+                if interrupted:
+                    stop_generation(state, renderer.text)
+
+            stop_placeholder.empty()
 
             # Update UI with final response
+            full_response = renderer.finish()
             if full_response:
-                message_placeholder.markdown(full_response)
+                logger.debug(f"Rendered response of {len(full_response)} chars in {renderer.paints} paints for {renderer.chunks} chunks")
                 state.history.append({
                     "role": "assistant",
                     "content": full_response
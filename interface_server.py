@@ -2,11 +2,32 @@ import streamlit as st
 from attrs import field, define
 from loguru import logger
 import getpass
-from config.config_setup import init_config
+import uuid
+from config.config_setup import ConfigService
 from config.logging_setup import setup_logging
 from interface.ui_components import handle_chat_input, display_chat_messages
 from interface.chat_history import ChatHistoryManager
 
+# Number of chats added to the sidebar by each "Load more chats" click
+HISTORY_PAGE_SIZE = 10
+
+@st.cache_resource
+def init_logging():
+    """Set up logging once per process; reruns would otherwise restart the queued sinks' writer thread."""
+    setup_logging()
+
+@st.cache_resource
+def get_config_service():
+    """Parse config.yaml once per process rather than on every rerun, and reload it when it changes."""
+    config_service = ConfigService()
+    config_service.start()
+    return config_service
+
+@st.cache_resource
+def get_chat_manager(database_url, _pool_config):
+    """One ChatHistoryManager, and so one connection pool, shared by all reruns and sessions."""
+    return ChatHistoryManager(database_url, _pool_config)
+
 def init_page(page_title):
     # Set page title and favicon
     st.set_page_config(page_title=page_title, page_icon="🧠", layout="wide")
@@ -18,8 +39,16 @@ class SessionState:
     """Centralized session state management"""
     history: list = field(factory=list)
     current_history_id: str = None
+    saved_message_count: int = 0
+    history_limit: int = HISTORY_PAGE_SIZE
+    search_text: str = ""
+    search_limit: int = HISTORY_PAGE_SIZE
     persona_selected: str = None
     user_name: str = field(factory=getpass.getuser)
+    # The brain keeps the dialog's messages; after the first turn only new messages are sent
+    dialog_id: str = field(factory=lambda: uuid.uuid4().hex)
+    dialog_version: int = None
+    dialog_persona: str = None  # persona whose prompt the brain's copy of the dialog starts with
 
     @classmethod
     def initialize(cls):
@@ -31,15 +60,24 @@ class SessionState:
     def clear_chat(self):
         """Clear chat history and related state"""
         self.history = []
-        self.current_history_id = None    
+        self.current_history_id = None
+        self.saved_message_count = 0
+        self.new_dialog()
+
+    def new_dialog(self):
+        """Start a new brain dialog, so the next request sends the full history."""
+        self.dialog_id = uuid.uuid4().hex
+        self.dialog_version = None
+        self.dialog_persona = None
 
 @logger.catch
 def main():
     # Initialize logging and configuration, history and upload manager
-    setup_logging()
-    config = init_config()
+    init_logging()
+    config = get_config_service().config
     state = init_page(config.page_title)
-    chat_manager = ChatHistoryManager(config.database_config_server_url)
+    chat_manager = get_chat_manager(config.database_config_server_url, config.database_pool)
+    logger.opt(lazy=True).debug("Chat history pool stats: {}", chat_manager.pool_stats)
 
     persona_icons_dict = {}
     for persona_model in config.persona_models.values():
@@ -57,13 +95,36 @@ def main():
     st.sidebar.divider()
 
     # Handle chat history
-    history_options, history_dict, existing_titles = chat_manager.build_history_options(state.user_name)
+    history_options, history_dict, existing_titles, has_more = chat_manager.build_history_options(
+        state.user_name, limit=state.history_limit
+    )
+
+    # Streamlit only reruns once typing pauses with Enter or focus leaving the box,
+    # so the database sees one query per search rather than one per keystroke
+    search_text = st.sidebar.text_input("Search chats", key="chat_search", placeholder="Words in titles or messages")
+    snippets = {}
+    if search_text.strip():
+        if search_text != state.search_text:
+            state.search_text = search_text
+            state.search_limit = HISTORY_PAGE_SIZE
+        history_options, history_dict, snippets, has_more = chat_manager.search_history_options(
+            state.user_name, search_text, limit=state.search_limit
+        )
 
     selected_chat = st.sidebar.selectbox(
         "Select Chat",
         options=history_options,
         key="chat_history_dropdown"
     )
+    if snippets.get(selected_chat):
+        st.sidebar.caption(snippets[selected_chat])
+
+    if has_more and st.sidebar.button("Load more chats"):
+        if search_text.strip():
+            state.search_limit += HISTORY_PAGE_SIZE
+        else:
+            state.history_limit += HISTORY_PAGE_SIZE
+        st.rerun()
 
     # Handle chat selection
     if selected_chat != "New Chat":
@@ -83,7 +144,7 @@ def main():
     
     # Display chat history and handle new messages
     display_chat_messages(state.history)
-    logger.deep_debug(f"{config=}")        
+    logger.deep_debug("config={}", config)        
     handle_chat_input(config, state.persona_selected, state)
 
 if __name__ == "__main__":
@@ -0,0 +1 @@
+uv run python brain_server_async.py
@@ -0,0 +1,113 @@
+import json
+import os
+from types import SimpleNamespace
+import pytest
+from brain.batch_jobs import CHECKPOINT_FILE, BatchJob, BatchRunner, write_json_atomic
+from config.config_setup import BatchConfig
+
+
+class EchoModel:
+    """Streams the last user message back, one word per chunk."""
+
+    def __init__(self):
+        self.calls = []
+
+    def chat(self, messages, stream=False):
+        self.calls.append(messages[-1]["content"])
+        return self._stream(messages[-1]["content"])
+
+    async def _stream(self, text):
+        for word in text.split():
+            yield {'message': word, 'is_chunk': True}
+
+
+class Router:
+    def __init__(self):
+        persona = SimpleNamespace(llm_host="ollama", base_url="http://backend", endpoints=[])
+        self.config = SimpleNamespace(persona_models={"Chat": persona})
+        self.model = EchoModel()
+
+    def get_chat_model(self, persona):
+        return self.model
+
+
+@pytest.fixture
+def runner(tmp_path):
+    config = SimpleNamespace(batch=BatchConfig(work_dir=str(tmp_path / "batch"), concurrency=1, checkpoint_seconds=0))
+    os.makedirs(config.batch.work_dir)
+    runner = BatchRunner(Router(), config)
+    yield runner
+    runner.close()
+
+
+def write_input(path, texts):
+    with open(path, "w", encoding="utf-8") as f:
+        for text in texts:
+            f.write(json.dumps({"persona": "Chat", "messages": [{"role": "user", "content": text}]}) + "\n")
+
+
+def read_output(path):
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f]
+
+
+def test_job_writes_one_result_per_line(runner, tmp_path):
+    write_input(tmp_path / "in.jsonl", ["one", "two words", "three more words"])
+    job = runner.submit(input_path=str(tmp_path / "in.jsonl"), output_path=str(tmp_path / "out.jsonl"))
+    job.future.result(timeout=10)
+
+    results = read_output(tmp_path / "out.jsonl")
+    assert job.status == "completed"
+    assert sorted((r["id"], r["tokens"]) for r in results) == [(1, 1), (2, 2), (3, 3)]
+    assert job.tokens == 6
+
+
+def test_new_job_keeps_existing_output(runner, tmp_path):
+    previous = '{"id": "earlier run"}\n' * 3
+    (tmp_path / "out.jsonl").write_text(previous, encoding="utf-8")
+    write_input(tmp_path / "in.jsonl", ["one", "two"])
+    job = runner.submit(input_path=str(tmp_path / "in.jsonl"), output_path=str(tmp_path / "out.jsonl"))
+    job.future.result(timeout=10)
+
+    text = (tmp_path / "out.jsonl").read_text(encoding="utf-8")
+    assert text.startswith(previous)
+    assert len(text.splitlines()) == 5
+
+
+def test_resume_cuts_output_to_checkpoint_and_skips_done_lines(runner, tmp_path):
+    write_input(tmp_path / "in.jsonl", ["one", "two", "three"])
+    job_dir = tmp_path / "batch" / "job"
+    job_dir.mkdir()
+    output_path = tmp_path / "out.jsonl"
+    kept = json.dumps({"id": 1, "response": "one"}) + "\n"
+    # The first line was checkpointed, the half written second one was not
+    output_path.write_text(kept + '{"id": 2, "resp', encoding="utf-8")
+    job = BatchJob("job", str(job_dir), 1, str(tmp_path / "in.jsonl"), str(output_path))
+    job.save()
+    write_json_atomic(os.path.join(job_dir, CHECKPOINT_FILE),
+                      {"done_lines": [1], "output_bytes": len(kept.encode("utf-8")), "failed": 0, "tokens": 1})
+
+    assert runner.resume_jobs() == 1
+    job = runner.get("job")
+    job.future.result(timeout=10)
+
+    results = read_output(output_path)
+    assert [r["id"] for r in results] == [1, 2, 3]
+    assert runner.router.model.calls == ["two", "three"]
+    assert job.resumed == 1 and job.done == 3
+
+
+def test_first_checkpoint_records_existing_output(runner, tmp_path):
+    write_input(tmp_path / "in.jsonl", ["one"])
+    job_dir = tmp_path / "batch" / "job"
+    job_dir.mkdir()
+    output_path = tmp_path / "out.jsonl"
+    output_path.write_text("kept\n", encoding="utf-8")
+    job = BatchJob("job", str(job_dir), 1, str(tmp_path / "in.jsonl"), str(output_path))
+
+    assert runner._load_checkpoint(job) == set()
+    with open(job_dir / CHECKPOINT_FILE, encoding="utf-8") as f:
+        assert json.load(f)["output_bytes"] == len("kept\n")
+    # A crash before any result was checkpointed leaves the earlier output alone
+    assert runner._load_checkpoint(job) == set()
+    assert output_path.read_text(encoding="utf-8") == "kept\n"
@@ -0,0 +1,68 @@
+import pytest
+from brain.conversation_store import ConversationStore, VersionConflict
+
+
+def user(text):
+    return {"role": "user", "content": text}
+
+
+def assistant(text):
+    return {"role": "assistant", "content": text}
+
+
+def test_append_at_current_version():
+    store = ConversationStore()
+    history, version = store.sync("d1", "alice", messages=[user("hi")])
+    assert version == 1
+
+    history, version = store.sync("d1", "alice", new_messages=[user("again")], version=1)
+    assert version == 2
+    assert [m["content"] for m in history] == ["hi", "again"]
+
+
+def test_stale_version_conflicts():
+    store = ConversationStore()
+    store.sync("d1", "alice", messages=[user("hi")])
+    store.sync("d1", "alice", new_messages=[user("from another tab")], version=1)
+
+    with pytest.raises(VersionConflict) as e:
+        store.sync("d1", "alice", new_messages=[user("late")], version=1)
+    assert e.value.version == 2
+    assert store.stats()["conflicts"] == 1
+
+
+def test_unknown_dialog_and_other_sender_conflict():
+    store = ConversationStore()
+    store.sync("d1", "alice", messages=[user("hi")])
+
+    with pytest.raises(VersionConflict):
+        store.sync("missing", "alice", new_messages=[user("hi")], version=1)
+    with pytest.raises(VersionConflict):
+        store.sync("d1", "mallory", new_messages=[user("hi")], version=1)
+
+
+def test_full_history_resyncs_after_conflict():
+    store = ConversationStore()
+    store.sync("d1", "alice", messages=[user("hi")])
+    store.sync("d1", "alice", new_messages=[user("other")], version=1)
+
+    history, version = store.sync("d1", "alice", messages=[user("hi"), user("resent")])
+    assert version == 3
+    assert [m["content"] for m in history] == ["hi", "resent"]
+
+
+def test_reply_at_stale_version_is_not_recorded():
+    store = ConversationStore()
+    store.sync("d1", "alice", messages=[user("hi")])
+    assert store.record_reply("d1", "alice", assistant("hello"), 1) == 2
+    assert store.record_reply("d1", "alice", assistant("twice"), 1) is None
+    assert [m["content"] for m in store.get("d1", "alice").messages] == ["hi", "hello"]
+
+
+def test_evicted_dialog_without_database_resyncs():
+    store = ConversationStore(max_dialogs=1)
+    store.sync("d1", "alice", messages=[user("hi")])
+    store.sync("d2", "alice", messages=[user("hi")])
+
+    with pytest.raises(VersionConflict):
+        store.sync("d1", "alice", new_messages=[user("again")], version=1)
@@ -0,0 +1,67 @@
+import numpy as np
+from brain.embedding_cache import DiskTier, EmbeddingCache, text_digest
+
+
+def vectors(n, dim=8, start=0):
+    return np.arange(start, start + n * dim, dtype=np.float32).reshape(n, dim)
+
+
+def digests(n, prefix="text"):
+    return [text_digest(f"{prefix} {i}") for i in range(n)]
+
+
+def test_disk_tier_round_trip(tmp_path):
+    tier = DiskTier(str(tmp_path), "ollama", "model", max_entries=100)
+    keys, rows = digests(10), vectors(10)
+    tier.put_many(keys, rows)
+
+    for key, row in zip(keys, rows):
+        np.testing.assert_array_equal(tier.get(key), row)
+    assert tier.get(text_digest("never stored")) is None
+
+
+def test_disk_tier_reloads_from_disk(tmp_path):
+    keys, rows = digests(10), vectors(10)
+    DiskTier(str(tmp_path), "ollama", "model", max_entries=100).put_many(keys, rows)
+
+    reopened = DiskTier(str(tmp_path), "ollama", "model", max_entries=100)
+    assert len(reopened) == 10
+    for key, row in zip(keys, rows):
+        np.testing.assert_array_equal(reopened.get(key), row)
+
+
+def test_disk_tiers_sharing_a_directory_stay_in_step(tmp_path):
+    # Two handles on one directory behave like two processes appending to it
+    first = DiskTier(str(tmp_path), "ollama", "model", max_entries=100)
+    second = DiskTier(str(tmp_path), "ollama", "model", max_entries=100)
+    first.put_many(digests(5, "first"), vectors(5))
+    second.put_many(digests(5, "second"), vectors(5, start=1000))
+
+    reopened = DiskTier(str(tmp_path), "ollama", "model", max_entries=100)
+    for key, row in zip(digests(5, "first") + digests(5, "second"), np.vstack([vectors(5), vectors(5, start=1000)])):
+        np.testing.assert_array_equal(reopened.get(key), row)
+
+
+def test_disk_tier_evicts_down_to_max_entries(tmp_path):
+    tier = DiskTier(str(tmp_path), "ollama", "model", max_entries=10)
+    keys, rows = digests(25), vectors(25)
+    for start in range(0, 25, 5):
+        tier.put_many(keys[start:start + 5], rows[start:start + 5])
+
+    assert len(tier) <= 10
+    stored = [(key, row) for key, row in zip(keys, rows) if tier.get(key) is not None]
+    assert stored
+    for key, row in stored:
+        np.testing.assert_array_equal(tier.get(key), row)
+
+
+def test_embedding_cache_serves_disk_hits_after_restart(tmp_path):
+    keys, rows = digests(3), vectors(3)
+    EmbeddingCache(str(tmp_path), memory_entries=10).put_many("ollama", "model", keys, rows)
+
+    cache = EmbeddingCache(str(tmp_path), memory_entries=10)
+    cached = cache.get_many("ollama", "model", keys + [text_digest("new")])
+    assert cached[-1] is None
+    for vector, row in zip(cached, rows):
+        np.testing.assert_array_equal(vector, row)
+    assert cache.stats()["disk_hits"] == 3
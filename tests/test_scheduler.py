@@ -0,0 +1,192 @@
+import asyncio
+import pytest
+from brain.scheduler import Overloaded, RequestInfo, ScheduledChatModel, Scheduler, current_request
+
+BACKEND = "ollama:http://backend"
+
+
+def interactive(sender="alice"):
+    return RequestInfo(sender, "interactive")
+
+
+def batch(sender="job"):
+    return RequestInfo(sender, "batch")
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+async def settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+def test_admits_up_to_backend_limit_then_queues():
+    async def scenario():
+        scheduler = Scheduler()
+        tickets = [await scheduler.acquire(BACKEND, 2, "Chat", 0, interactive(f"user{i}")) for i in range(2)]
+        waiting = asyncio.create_task(scheduler.acquire(BACKEND, 2, "Chat", 0, interactive("user2")))
+        await settle()
+        assert not waiting.done()
+        assert scheduler.stats()["queue_depth"] == 1
+
+        scheduler.release(tickets[0])
+        await asyncio.wait_for(waiting, 1)
+        assert scheduler.stats()["running"] == {BACKEND: 2}
+
+    run(scenario())
+
+
+def test_batch_is_limited_to_its_share():
+    async def scenario():
+        scheduler = Scheduler()
+        for i in range(2):
+            await scheduler.acquire(BACKEND, 4, "Chat", 0, batch(f"job{i}"))
+        third = asyncio.create_task(scheduler.acquire(BACKEND, 4, "Chat", 0, batch("job2")))
+        await settle()
+        assert not third.done()
+        # Interactive requests still find room beside the batch share
+        await asyncio.wait_for(scheduler.acquire(BACKEND, 4, "Chat", 0, interactive()), 1)
+        third.cancel()
+
+    run(scenario())
+
+
+def test_persona_limit():
+    async def scenario():
+        scheduler = Scheduler()
+        await scheduler.acquire(BACKEND, 4, "Data", 1, interactive("alice"))
+        waiting = asyncio.create_task(scheduler.acquire(BACKEND, 4, "Data", 1, interactive("bob")))
+        await settle()
+        assert not waiting.done()
+        await asyncio.wait_for(scheduler.acquire(BACKEND, 4, "Chat", 0, interactive("carol")), 1)
+        waiting.cancel()
+
+    run(scenario())
+
+
+def test_interactive_admitted_before_batch():
+    async def scenario():
+        scheduler = Scheduler()
+        holder = await scheduler.acquire(BACKEND, 2, "Chat", 0, interactive("holder"))
+        await scheduler.acquire(BACKEND, 2, "Chat", 0, interactive("other"))
+        order = []
+
+        async def wait(request):
+            ticket = await scheduler.acquire(BACKEND, 2, "Chat", 0, request)
+            order.append(request.priority)
+            return ticket
+
+        queued_batch = asyncio.create_task(wait(batch()))
+        await settle()
+        queued_interactive = asyncio.create_task(wait(interactive("late")))
+        await settle()
+        scheduler.release(holder)
+        await asyncio.wait_for(queued_interactive, 1)
+        assert order == ["interactive"]
+        queued_batch.cancel()
+
+    run(scenario())
+
+
+def test_senders_take_turns():
+    async def scenario():
+        scheduler = Scheduler()
+        holder = await scheduler.acquire(BACKEND, 1, "Chat", 0, interactive("holder"))
+        order = []
+
+        async def wait(sender):
+            ticket = await scheduler.acquire(BACKEND, 1, "Chat", 0, interactive(sender))
+            order.append(sender)
+            scheduler.release(ticket)
+
+        tasks = [asyncio.create_task(wait(sender)) for sender in ("alice", "alice", "alice", "bob")]
+        await settle()
+        scheduler.release(holder)
+        await asyncio.wait_for(asyncio.gather(*tasks), 1)
+        assert order[:2] == ["alice", "bob"]
+
+    run(scenario())
+
+
+def test_rejects_when_sender_queue_is_full():
+    async def scenario():
+        scheduler = Scheduler(max_queue=10, max_queue_per_sender=1)
+        await scheduler.acquire(BACKEND, 1, "Chat", 0, interactive("holder"))
+        queued = asyncio.create_task(scheduler.acquire(BACKEND, 1, "Chat", 0, interactive("alice")))
+        await settle()
+        with pytest.raises(Overloaded) as e:
+            await scheduler.acquire(BACKEND, 1, "Chat", 0, interactive("alice"))
+        assert e.value.retry_after >= 1
+        assert scheduler.stats()["rejected"] == 1
+        queued.cancel()
+
+    run(scenario())
+
+
+def test_rejects_when_queue_is_full():
+    async def scenario():
+        scheduler = Scheduler(max_queue=1)
+        await scheduler.acquire(BACKEND, 1, "Chat", 0, interactive("holder"))
+        queued = asyncio.create_task(scheduler.acquire(BACKEND, 1, "Chat", 0, interactive("alice")))
+        await settle()
+        with pytest.raises(Overloaded):
+            await scheduler.acquire(BACKEND, 1, "Chat", 0, interactive("bob"))
+        queued.cancel()
+
+    run(scenario())
+
+
+def test_times_out_in_queue():
+    async def scenario():
+        scheduler = Scheduler(max_wait_seconds=0.05)
+        await scheduler.acquire(BACKEND, 1, "Chat", 0, interactive("holder"))
+        with pytest.raises(Overloaded):
+            await scheduler.acquire(BACKEND, 1, "Chat", 0, interactive("alice"))
+        stats = scheduler.stats()
+        assert stats["timed_out"] == 1 and stats["queue_depth"] == 0
+
+    run(scenario())
+
+
+def test_cancelled_waiter_leaves_the_queue():
+    async def scenario():
+        scheduler = Scheduler()
+        holder = await scheduler.acquire(BACKEND, 1, "Chat", 0, interactive("holder"))
+        waiting = asyncio.create_task(scheduler.acquire(BACKEND, 1, "Chat", 0, interactive("alice")))
+        await settle()
+        waiting.cancel()
+        await settle()
+        assert scheduler.stats()["queue_depth"] == 0
+        scheduler.release(holder)
+        assert scheduler.stats()["running"] == {}
+
+    run(scenario())
+
+
+class WordModel:
+    model = "model"
+    backend = "ollama"
+
+    def chat(self, messages, stream=False):
+        return self._stream()
+
+    async def _stream(self):
+        for word in ("a", "b", "c"):
+            yield {'message': word, 'is_chunk': True}
+
+
+def test_scheduled_model_holds_slot_for_the_stream():
+    async def scenario():
+        scheduler = Scheduler()
+        model = ScheduledChatModel(WordModel(), scheduler, "Chat", BACKEND, 1)
+        current_request.set(interactive())
+        stream = model.chat([], stream=True)
+        await stream.__anext__()
+        assert scheduler.stats()["running"] == {BACKEND: 1}
+        chunks = [chunk async for chunk in stream]
+        assert len(chunks) == 2
+        assert scheduler.stats()["running"] == {}
+
+    run(scenario())